@@ -1,18 +1,70 @@
+import numpy as np
 import pandas as pd
 import folium
 from folium.plugins import TimestampedGeoJson, Fullscreen, MousePosition 
 from datetime import datetime, timedelta
+import argparse
+import json
+import os
+import sys
 
-def process_data(csv_path):
-    """Data preprocessing"""
-    df = pd.read_csv(csv_path, parse_dates=['start_date', 'end_date'])
-    
-    typhoon_center = [26.7, 124.2]  # Coordinates of Ningbo City
-    # Calculate the duration and filter invalid data
-    df['duration'] = (df['end_date'] - df['start_date']).dt.days + 1
-    df = df[df['duration'] > 0]
-    
-    # Generate geographical features
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import instrument, query
+from common.boundary import load_simplified_boundary
+from common.best_track import get_storm, load_track_archive
+from common.data_access import data_path, digest, file_digest
+from common.popups import LazyPopups, PopupStore, placeholder
+from common.server import FeatureIndex, QueryLayer, serve
+from common.spatial import sites_near_track
+from common.timeline import IntervalTimeline, day_numbers, interval_index
+
+POPUP_TEMPLATE = """
+                    <div style="width:400px; font-family:Arial">
+                        <h4 style="color:#0D47A1; margin:0; font-size:25px">{location}</h4>
+                        <p style="margin:10px 0; font-size:21px">
+                            <b>Date:</b> {start} - {end}<br>
+                            <b>Admin Level:</b> {admin_level}
+                        </p>
+                        <hr style="margin:12px 0">
+                        <p style="font-size:15px; line-height:1.6; word-wrap:break-word; word-break:break-word; white-space:pre-wrap">{details}</p>
+                    </div>
+                """
+
+# Class-based version of POPUP_TEMPLATE used for lazily loaded popups
+LAZY_POPUP_TEMPLATE = (
+    '<div class="disaster-popup"><h4>{location}</h4>'
+    '<p class="meta"><b>Date:</b> {start} - {end}<br><b>Admin Level:</b> {admin_level}</p>'
+    '<hr><p class="details">{details}</p></div>'
+)
+
+LAZY_POPUP_CSS = """
+    .disaster-popup { width:400px; font-family:Arial }
+    .disaster-popup h4 { color:#0D47A1; margin:0; font-size:25px }
+    .disaster-popup .meta { margin:10px 0; font-size:21px }
+    .disaster-popup hr { margin:12px 0 }
+    .disaster-popup .details { font-size:15px; line-height:1.6; word-wrap:break-word; word-break:break-word; white-space:pre-wrap }
+"""
+
+FEATURE_STYLE = {
+    "color": "#1976D2",
+    "fillColor": "#1976D2",
+    "opacity": 0.8,
+    "fillOpacity": 0.6,
+    "radius": 8
+}
+
+def load_data(csv_path=None, filters=None):
+    """Read the impact table and drop rows with an invalid duration
+
+    filters are common.query selection arguments; the selection runs on
+    the resident table, so the CSV is only read once per process.
+    """
+    df = query.filter_table(csv_path, **(filters or {}))
+    # Filter invalid data
+    return df[df['duration'] > 0]
+
+def build_features_iterrows(df):
+    """Row-by-row feature builder (reference implementation)"""
     features = []
     for _, row in df.iterrows():
         dates = [row['start_date'] + timedelta(days=i) for i in range(row['duration'])]
@@ -26,41 +78,287 @@ def process_data(csv_path):
             "properties": {
                 "times": [d.strftime('%Y-%m-%dT%H:%M:%S') for d in dates],
                 "location": row['location'],
-                "style": {
-                    "color": "#1976D2",
-                    "fillColor": "#1976D2",
-                    "opacity": 0.8,
-                    "fillOpacity": 0.6,
-                    "radius": 8
-                },
-                "popup": f"""
-                    <div style="width:400px; font-family:Arial">
-                        <h4 style="color:#0D47A1; margin:0; font-size:25px">{row['location']}</h4>
-                        <p style="margin:10px 0; font-size:21px">
-                            <b>Date:</b> {row['start_date'].date()} - {row['end_date'].date()}<br>
-                            <b>Admin Level:</b> {row['admin_level']}
-                        </p>
-                        <hr style="margin:12px 0">
-                        <p style="font-size:15px; line-height:1.6; word-wrap:break-word; word-break:break-word; white-space:pre-wrap">{row['details']}</p>
-                    </div>
-                """
+                "style": dict(FEATURE_STYLE),
+                "popup": POPUP_TEMPLATE.format(
+                    location=row['location'],
+                    start=row['start_date'].date(),
+                    end=row['end_date'].date(),
+                    admin_level=row['admin_level'],
+                    details=row['details']
+                )
             }
         })
-            
-    # Add the location of Ningbo City (displayed throughout the time period)
-    features.insert(0, {
+    return features
+
+def expand_times(start, duration):
+    """Expand each start date into one ISO timestamp per impact day.
+
+    Returns one list of strings per row, built from a single flat
+    datetime64 array instead of per-row timedelta arithmetic.
+    """
+    start = np.asarray(start, dtype='datetime64[s]')
+    duration = np.asarray(duration, dtype=np.int64)
+    total = int(duration.sum())
+    bounds = np.concatenate(([0], np.cumsum(duration)))
+    # Day offset of every expanded entry relative to the start of its row
+    offsets = np.arange(total, dtype=np.int64) - np.repeat(bounds[:-1], duration)
+    stamps = np.repeat(start, duration) + offsets.astype('timedelta64[D]')
+    flat = np.datetime_as_string(stamps, unit='s').tolist()
+    bounds = bounds.tolist()
+    return [flat[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+def popup_columns(df, popups=None):
+    """Popup builder plus the admin level and details columns it is fed
+
+    With a PopupStore, the popup content goes to the store and each feature
+    only carries a placeholder that LazyPopups fills in on click.
+    """
+    if popups is None:
+        return POPUP_TEMPLATE.format, df['admin_level'].tolist(), df['details'].tolist()
+
+    def popup(**record):
+        return placeholder(popups.add(record))
+    return popup, df['admin_level'].fillna('').tolist(), df['details'].fillna('').tolist()
+
+def build_features_columnar(df, popups=None):
+    """Columnar feature builder, same output as build_features_iterrows"""
+    start = df['start_date'].to_numpy(dtype='datetime64[s]')
+    end = df['end_date'].to_numpy(dtype='datetime64[s]')
+    times = expand_times(start, df['duration'].to_numpy())
+    start_days = np.datetime_as_string(start, unit='D').tolist()
+    end_days = np.datetime_as_string(end, unit='D').tolist()
+
+    popup, levels, details = popup_columns(df, popups)
+    columns = zip(
+        df['longitude'].tolist(), df['latitude'].tolist(),
+        df['location'].tolist(), levels, details, start_days, end_days, times
+    )
+    return [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {
+                "times": row_times,
+                "location": location,
+                "style": dict(FEATURE_STYLE),
+                "popup": popup(location=location, start=s, end=e,
+                               admin_level=level, details=details)
+            }
+        }
+        for lon, lat, location, level, details, s, e, row_times in columns
+    ]
+
+def build_features_intervals(df, popups=None):
+    """Features carrying one [first day, last day] interval instead of daily times
+
+    Used with IntervalTimeline; the style is the layer default (FEATURE_STYLE)
+    rather than a copy on every feature.
+    """
+    start = df['start_date'].to_numpy(dtype='datetime64[D]')
+    end = df['end_date'].to_numpy(dtype='datetime64[D]')
+    start_days = np.datetime_as_string(start, unit='D').tolist()
+    end_days = np.datetime_as_string(end, unit='D').tolist()
+
+    popup, levels, details = popup_columns(df, popups)
+    columns = zip(
+        df['longitude'].tolist(), df['latitude'].tolist(),
+        df['location'].tolist(), levels, details, start_days, end_days,
+        day_numbers(start).tolist(), day_numbers(end).tolist()
+    )
+    return [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {
+                "interval": [first, last],
+                "location": location,
+                "popup": popup(location=location, start=s, end=e,
+                               admin_level=level, details=details)
+            }
+        }
+        for lon, lat, location, level, details, s, e, first, last in columns
+    ]
+
+def center_feature(intervals=False):
+    """Location of Ningbo City, displayed throughout the time period"""
+    typhoon_center = [26.7, 124.2]  # Coordinates of Ningbo City
+    if intervals:
+        timing = {"interval": day_numbers(['2023-07-31', '2023-08-06']).tolist()}
+    else:
+        timing = {"times": ["2023-07-31T00:00:00", "2023-08-06T23:59:59"]}
+    return {
         "type": "Feature",
         "geometry": {"type": "Point", "coordinates": typhoon_center},
         "properties": {
-            "times": ["2023-07-31T00:00:00", "2023-08-06T23:59:59"],
+            **timing,
             "style": {"color": "#FF0000", "fillColor": "#FF0000", "radius": 10}
         }
-    })
+    }
+
+def select_rows(csv_path, near_track_km=None, storm=None, filters=None):
+    """Rows to map; with near_track_km, only locations that came within
+    that distance of the storm track (Khanun by default), and with filters
+    only the rows of that common.query selection"""
+    with instrument.span('load_data'):
+        df = load_data(csv_path, filters)
+    if near_track_km is not None:
+        with instrument.span('sites_near_track', radius_km=near_track_km):
+            storm = storm or get_storm(load_track_archive(), 0)
+            df = sites_near_track(df, storm, near_track_km)
+    return df
+
+def process_data(csv_path, vectorized=True, near_track_km=None, storm=None,
+                 popups=None, intervals=False, filters=None):
+    """Data preprocessing
+
+    near_track_km, storm and filters select the rows as in select_rows. popups is
+    an optional PopupStore for lazy popups (columnar builder only).
+    intervals builds the [start, end] features of IntervalTimeline
+    instead of daily times.
+    """
+    df = select_rows(csv_path, near_track_km, storm, filters)
+    
+    # Generate geographical features
+    with instrument.span('build_features', rows=len(df)):
+        if intervals:
+            features = build_features_intervals(df, popups)
+        elif vectorized or popups is not None:
+            features = build_features_columnar(df, popups)
+        else:
+            features = build_features_iterrows(df)
+    instrument.count('features', len(features))
+            
+    # Add the location of Ningbo City (displayed throughout the time period)
+    features.insert(0, center_feature(intervals))
     
     return {'type': 'FeatureCollection', 'features': features}
 
-def create_map(geojson_data):
-    """Create a map that matches the example image effect"""
+def build_index(csv_path, near_track_km=None, storm=None, filters=None):
+    """Rows and interval features kept resident by the --serve mode"""
+    df = select_rows(csv_path, near_track_km, storm, filters)
+    df = df.dropna(subset=['latitude', 'longitude'])
+    with instrument.span('build_features', rows=len(df)):
+        features = build_features_intervals(df)
+    version = digest(f'{file_digest(csv_path)}:{near_track_km}:{filters}')
+    return FeatureIndex(df, features, version)
+
+def iter_features(csv_path, chunk_size=50000, popups=None, intervals=False,
+                  skip_rows=0):
+    """Yield the same features as process_data, reading the CSV in chunks.
+
+    Only one chunk of rows and its features are alive at a time, so memory
+    stays flat however many locations or impact days the table holds.
+    With skip_rows, only the features of the rows after the first skip_rows
+    are yielded (without the center feature), for appending to a page.
+    """
+    build = build_features_intervals if intervals else build_features_columnar
+    if not skip_rows:
+        yield center_feature(intervals)
+    reader = pd.read_csv(csv_path, parse_dates=['start_date', 'end_date'],
+                         chunksize=chunk_size)
+    for df in reader:
+        if skip_rows >= len(df):
+            skip_rows -= len(df)
+            continue
+        df, skip_rows = df.iloc[skip_rows:].copy(), 0
+        df['duration'] = (df['end_date'] - df['start_date']).dt.days + 1
+        yield from build(df[df['duration'] > 0], popups)
+
+def write_features(f, features):
+    """Write features to an open file as the body of a JSON array, one at a time"""
+    count = 0
+    for feature in features:
+        if count:
+            f.write(', ')
+        f.write(json.dumps(feature))
+        count += 1
+    return count
+
+def write_geojson(features, output_path):
+    """Stream features into a sidecar FeatureCollection file"""
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write('{"type": "FeatureCollection", "features": [')
+        count = write_features(f, features)
+        f.write(']}')
+    return count
+
+# Stands in for the features inside the rendered page until they are streamed
+STREAM_MARKER = '/*__STREAMED_FEATURES__*/'
+# Stands in for the IntervalTimeline index, written once all features are out
+INDEX_MARKER = '/*__INTERVAL_INDEX__*/'
+# Left after the last feature of a streamed timestamp page; append_streaming
+# inserts new features there
+APPEND_MARKER = '/*__APPEND_FEATURES__*/'
+
+def save_streaming(features, output_path, popup_url=None, intervals=False):
+    """Render the map around a placeholder and stream features into the HTML.
+
+    Unlike create_map(...).save(), the FeatureCollection is never held in
+    memory, neither as a dict nor as a serialized string. With intervals
+    only the two day numbers of each feature are kept to build the index.
+    """
+    collection = '{"type": "FeatureCollection", "features": [' + STREAM_MARKER + ']}'
+    html = create_map(collection, popup_url=popup_url, intervals=intervals,
+                      index=INDEX_MARKER)
+    with instrument.span('render_html'):
+        html = html.get_root().render()
+    head, tail = html.split(STREAM_MARKER, 1)
+    spans = []
+    if intervals:
+        features = (spans.append(feature['properties']['interval']) or feature
+                    for feature in features)
+    with instrument.span('stream_features'), open(output_path, 'w', encoding='utf-8') as f:
+        f.write(head)
+        count = write_features(f, features)
+        if intervals:
+            first, last = zip(*spans) if spans else ((), ())
+            middle, tail = tail.split(INDEX_MARKER, 1)
+            f.write(middle)
+            f.write(json.dumps(interval_index(first, last)))
+        else:
+            f.write(APPEND_MARKER)
+        f.write(tail)
+    instrument.count('features', count)
+    instrument.count_file('bytes_written', output_path)
+    return count
+
+def append_streaming(features, output_path):
+    """Add features to a page written by save_streaming, keeping the ones it has.
+
+    The TimestampedGeoJson slider takes its range from the features, so
+    new days show up without touching the rest of the page.
+    """
+    with open(output_path, 'r', encoding='utf-8') as f:
+        html = f.read()
+    if APPEND_MARKER not in html:
+        raise ValueError(f'{output_path} was not written by save_streaming')
+    head, tail = html.split(APPEND_MARKER, 1)
+    with open(output_path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(head)
+        count = 0
+        for feature in features:
+            # The page always holds the center feature, so a separator is needed
+            f.write(', ')
+            f.write(json.dumps(feature))
+            count += 1
+        f.write(APPEND_MARKER)
+        f.write(tail)
+    os.replace(output_path + '.tmp', output_path)
+    instrument.count('features', count)
+    return count
+
+@instrument.span('create_map')
+def create_map(geojson_data, boundary_zoom=13, popup_url=None, intervals=False,
+               index=None, query_url=None):
+    """Create a map that matches the example image effect
+
+    The Ningbo boundary is simplified to stay pixel-exact up to boundary_zoom.
+    popup_url points at the PopupStore directory when popups are lazy.
+    With intervals the features carry [start, end] day intervals and are
+    shown by IntervalTimeline; index is its interval_index (built from the
+    features when not given). With query_url the page instead loads the
+    features in view from that common.server API and geojson_data is unused.
+    """
     # Initialize the map (gray map without labels)
     m = folium.Map(
         location=[29.95, 121.5],
@@ -85,9 +383,7 @@ def create_map(geojson_data):
 
     # Add the precise boundary of Ningbo City
     try:
-        import json
-        with open(r'D:\Visual Analysis of Typhoons\data\Ningbo.json', 'r', encoding='utf-8') as f:
-            ningbo_geojson = json.load(f)
+        ningbo_geojson = load_simplified_boundary(zoom=boundary_zoom)
         
         # Add the boundary layer
         folium.GeoJson(
@@ -115,14 +411,20 @@ def create_map(geojson_data):
         print(f"Failed to load Ningbo boundary data: {e}")
 
     # Add the timeline layer
-    timestamped_layer = TimestampedGeoJson(
-        geojson_data,
-        period='P1D',
-        transition_time=500,
-        date_options='YYYY/MM/DD',
-        add_last_point=True,
-        loop=False  
-    ).add_to(m)
+    if query_url:
+        QueryLayer(query_url, style=FEATURE_STYLE, date_input='dateControl').add_to(m)
+    elif intervals:
+        IntervalTimeline(geojson_data, index, style=FEATURE_STYLE, date_input='dateControl',
+                         interval=500).add_to(m)
+    else:
+        timestamped_layer = TimestampedGeoJson(
+            geojson_data,
+            period='P1D',
+            transition_time=500,
+            date_options='YYYY/MM/DD',
+            add_last_point=True,
+            loop=False  
+        ).add_to(m)
     
     # Add controls
     m.get_root().html.add_child(folium.Element('''
@@ -144,6 +446,10 @@ def create_map(geojson_data):
                    border: 1px solid #9E9E9E;
                    border-radius: 3px">
     </div>
+    '''))
+    if not intervals and not query_url:
+        # IntervalTimeline and QueryLayer keep the date input in sync themselves
+        m.get_root().html.add_child(folium.Element('''
     <script>
         
         function setupSync() {
@@ -175,6 +481,9 @@ def create_map(geojson_data):
     </script>
     '''))
 
+    if popup_url:
+        LazyPopups(popup_url, LAZY_POPUP_TEMPLATE, LAZY_POPUP_CSS).add_to(m)
+
     # Add other controls
     Fullscreen(position='topright').add_to(m)
     MousePosition(position='bottomleft').add_to(m)
@@ -182,8 +491,71 @@ def create_map(geojson_data):
     return m
 
 if __name__ == "__main__":
-    # 使用绝对路径访问数据文件
-    data = process_data(r"D:\Visual Analysis of Typhoons\data\typhoon_data.csv")
-    map_obj = create_map(data)
-    map_obj.save("Interactive spatiotemporal mapping of disaster locations.html")
-    print("Interactive spatiotemporal mapping of disaster locations has been completed!")
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stream', action='store_true',
+                        help='Stream features into the HTML instead of building them in memory')
+    parser.add_argument('--geojson',
+                        help='Also stream the features of the whole CSV to this sidecar .geojson file')
+    parser.add_argument('--near-track', type=float, metavar='KM',
+                        help='Only map locations within KM of the Khanun track')
+    parser.add_argument('--lazy-popups', action='store_true',
+                        help='Write popup content to a side store fetched on click')
+    parser.add_argument('--intervals', action='store_true',
+                        help='Encode each location as one [start, end] day interval with '
+                             'a sorted index instead of one timestamp per impact day')
+    parser.add_argument('--append-after', type=int, metavar='ROWS',
+                        help='Add the CSV rows after the first ROWS to a page written with --stream')
+    parser.add_argument('--serve', action='store_true',
+                        help='Keep the data in memory and serve the map on a local HTTP server '
+                             'that returns only the features in view')
+    parser.add_argument('--host', default='127.0.0.1', help='Address of the --serve server')
+    parser.add_argument('--port', type=int, default=8000, help='Port of the --serve server')
+    query.add_arguments(parser)
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.configure(args)
+    filters = query.filters_from(args)
+    filtered = any(filters.values())
+    if args.stream and (args.near_track is not None or filtered):
+        parser.error('--near-track and the row filters need the whole table and cannot be '
+                     'combined with --stream')
+    if args.geojson and (args.near_track is not None or filtered):
+        # The sidecar is streamed from the whole CSV
+        parser.error('--geojson cannot be combined with --near-track or the row filters')
+    if args.append_after is not None and (args.near_track is not None or args.lazy_popups
+                                          or args.intervals or filtered):
+        parser.error('--append-after cannot be combined with --near-track, --lazy-popups, '
+                     '--intervals or the row filters')
+    if args.serve and (args.stream or args.append_after is not None or args.lazy_popups
+                       or args.geojson):
+        parser.error('--serve cannot be combined with --stream, --append-after, '
+                     '--lazy-popups or --geojson')
+
+    # 数据文件位于 common.data_access 配置的数据目录
+    csv_path = data_path('typhoon_data.csv')
+    output_path = "Interactive spatiotemporal mapping of disaster locations.html"
+    popups = popup_url = None
+    if args.lazy_popups:
+        popup_url = os.path.splitext(os.path.basename(output_path))[0] + '_popups'
+        popups = PopupStore(os.path.join(os.path.dirname(output_path), popup_url))
+    if args.serve:
+        index = build_index(csv_path, near_track_km=args.near_track, filters=filters)
+        page = create_map(None, query_url='api').get_root().render()
+        serve(index, page, args.host, args.port)
+    elif args.append_after is not None:
+        append_streaming(iter_features(csv_path, skip_rows=args.append_after), output_path)
+    elif args.stream:
+        save_streaming(iter_features(csv_path, popups=popups, intervals=args.intervals),
+                       output_path, popup_url, args.intervals)
+    else:
+        data = process_data(csv_path, near_track_km=args.near_track, popups=popups,
+                            intervals=args.intervals, filters=filters)
+        map_obj = create_map(data, popup_url=popup_url, intervals=args.intervals)
+        with instrument.span('save_html'):
+            map_obj.save(output_path)
+        instrument.count_file('bytes_written', output_path)
+    if popups is not None:
+        popups.close()
+    if args.geojson:
+        write_geojson(iter_features(csv_path, intervals=args.intervals), args.geojson)
+    print("Interactive spatiotemporal mapping of disaster locations has been completed!")
@@ -1,14 +1,99 @@
+import argparse
+import json
 import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import instrument, payload
+from common.boundary import load_simplified_boundary
+from common.categories import CATEGORIES, category_masks, inverted_index
+from common.data_access import (BOUNDARY_JSON, IMPACT_CSV, data_path, digest, file_digest,
+                                load_impact_table)
+from common.payload import add_strings, read_meta, write_payload
+from common.timeline import day_numbers
+
+# Above this many locations the page draws canvas circles instead of DOM markers
+MARKER_LIMIT = 5000
 
 def check_files():
     files = [
-        r"D:\Visual Analysis of Typhoons\data\typhoon_data.csv",
-        r"D:\Visual Analysis of Typhoons\data\Ningbo.json"
+        data_path(IMPACT_CSV),
+        data_path(BOUNDARY_JSON)
     ]
     for file in files:
         if not os.path.exists(file):
             raise FileNotFoundError(f"找不到文件: {file}")
 
+# Binary payload the page loads instead of the CSV (see common.payload)
+PAYLOAD = 'data.bin'
+# Simplified Ningbo.json next to the page, fetched relative to it
+BOUNDARY = 'ningbo.json'
+
+def build_payload(csv_path=None):
+    """Columns of the page payload, one row per location with coordinates
+
+    lat/lon as float32, start/end as days since 1970-01-01, the category
+    bitmask of every row, the per-category row lists and the
+    dictionary-encoded location, admin_level and details strings.
+    """
+    df = load_impact_table(csv_path).dropna(subset=['latitude', 'longitude'])
+    masks = category_masks(df['categories'])
+    offsets, rows = inverted_index(masks, len(CATEGORIES))
+    columns = {
+        'lat': df['latitude'].to_numpy(dtype=np.float32),
+        'lon': df['longitude'].to_numpy(dtype=np.float32),
+        'start': day_numbers(df['start_date']).astype(np.int32),
+        'end': day_numbers(df['end_date']).astype(np.int32),
+        'categories': masks,
+        'postings.offsets': offsets,
+        'postings.rows': rows,
+    }
+    for name in ('location', 'admin_level', 'details'):
+        add_strings(columns, name, df[name])
+    return columns
+
+def payload_code():
+    """Digest of the code that lays out the payload and the page reading it:
+    this script and common.payload (which carries the format VERSION)"""
+    return digest(file_digest(os.path.abspath(__file__)) + file_digest(payload.__file__))
+
+def publish_payload(output_dir, csv_path=None, force=False):
+    """Write the payload unless both the CSV and payload_code are unchanged
+
+    The SHA-1 of the CSV and the payload_code digest are kept in the payload
+    header. Returns whether the payload was written.
+    """
+    csv_path = csv_path or data_path(IMPACT_CSV)
+    source = file_digest(csv_path)
+    code = payload_code()
+    path = os.path.join(output_dir, PAYLOAD)
+    if not force and os.path.exists(path + '.gz'):
+        try:
+            meta = read_meta(path)
+            if meta.get('source_sha1') == source and meta.get('code_sha1') == code:
+                return False
+        except (OSError, ValueError):
+            pass
+    with instrument.span('build_payload'):
+        columns = build_payload(csv_path)
+    instrument.count('features', len(columns['lat']))
+    with instrument.span('write_payload'):
+        write_payload(path, columns, meta={'source_sha1': source, 'code_sha1': code,
+                                           'rows': len(columns['lat'])})
+    instrument.count_file('bytes_written', path)
+    instrument.count_file('bytes_written', path + '.gz')
+    return True
+
+def publish_boundary(output_dir, zoom=13):
+    """Write the simplified district boundary the page fetches"""
+    path = os.path.join(output_dir, BOUNDARY)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(load_simplified_boundary(zoom=zoom), f, ensure_ascii=False, separators=(',', ':'))
+    instrument.count_file('bytes_written', path)
+
+@instrument.span('generate_html')
 def generate_html():
     html_content = '''<!DOCTYPE html>
 <html>
@@ -86,20 +171,54 @@ def generate_html():
 <body>
     <div id="map"></div>
     <script>
-        const categories = [
-            "Population", 
-            "Infrastructure", 
-            "Buildings", 
-            "Industry", 
-            "Public Services", 
-            "Agriculture and Fishery", 
-            "Service Industry", 
-            "Land Resources", 
-            "Ecological Resources", 
-            "Water Resources", 
-            "Biological Resources", 
-            "Mineral Resources"
-        ];
+        const categories = __CATEGORIES__;
+
+        // Columns of the payload written by publish_payload: the category
+        // bitmask of every location and the locations of every category
+        let masks = new Uint16Array(0);
+        let postingOffsets = new Uint32Array(categories.length + 1);
+        let postingRows = new Uint32Array(0);
+        let visible = new Uint8Array(0);
+        let selectedMask = 0;
+
+        const TYPES = {
+            uint8: Uint8Array, uint16: Uint16Array, uint32: Uint32Array,
+            int32: Int32Array, float32: Float32Array, float64: Float64Array
+        };
+
+        // Typed-array views over the payload columns (layout in common/payload.py)
+        function readPayload(buffer) {
+            const headerLength = new DataView(buffer).getUint32(4, true);
+            const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+            const start = 8 + headerLength;
+            const columns = {};
+            header.columns.forEach(c => {
+                columns[c.name] = new TYPES[c.dtype](buffer, start + c.offset, c.length);
+            });
+            return columns;
+        }
+
+        // Value of a dictionary-encoded string column, decoded on demand
+        function stringAt(columns, name, i) {
+            const code = columns[name][i];
+            const offsets = columns[name + '.offsets'];
+            return new TextDecoder().decode(columns[name + '.text'].subarray(offsets[code], offsets[code + 1]));
+        }
+
+        function formatDay(day) {
+            const d = new Date(day * 86400000);
+            return d.getUTCFullYear() + '/' + (d.getUTCMonth() + 1) + '/' + d.getUTCDate();
+        }
+
+        function loadPayload(url) {
+            return fetch(url + '.gz').then(response => {
+                if (!response.ok) throw new Error(response.status + ' ' + url + '.gz');
+                if (typeof DecompressionStream === 'undefined') {
+                    return fetch(url).then(plain => plain.arrayBuffer());
+                }
+                return new Response(response.body.pipeThrough(new DecompressionStream('gzip'))).arrayBuffer();
+            });
+        }
 
         const map = L.map('map').setView([29.8683, 121.5440], 10);
         
@@ -109,6 +228,7 @@ def generate_html():
         }).addTo(map);
 
         let markers = [];
+        const markerLayer = L.layerGroup().addTo(map);
 
         const legend = L.control({position: 'topright'});
         legend.onAdd = function(map) {
@@ -134,8 +254,11 @@ def generate_html():
         };
         legend.addTo(map);
 
-        fetch('D:/Visual Analysis of Typhoons/data/Ningbo.json')
-            .then(response => response.json())
+        fetch('__BOUNDARY__')
+            .then(response => {
+                if (!response.ok) throw new Error(response.status + ' ' + response.url);
+                return response.json();
+            })
             .then(data => {
                 L.geoJSON(data, {
                     style: {
@@ -153,104 +276,107 @@ def generate_html():
                 alert('Failed to load Ningbo boundary data');
             });
 
-        fetch('D:/Visual Analysis of Typhoons/data/typhoon_data.csv')
-            .then(response => response.text())
-            .then(data => {
-                const rows = data.split('\\n').slice(1);
-                rows.forEach(row => {
-                    if (!row.trim()) return;
-                    
-                    let cols = [];
-                    let current = '';
-                    let inQuotes = false;
-                    
-                    for(let char of row) {
-                        if (char === '"') {
-                            inQuotes = !inQuotes;
-                        } else if (char === ',' && !inQuotes) {
-                            cols.push(current);
-                            current = '';
-                        } else {
-                            current += char;
-                        }
-                    }
-                    cols.push(current);
-
-                    if (cols.length < 8) return;
-
-                    const location = cols[0].replace(/^"|"$/g, '');
-                    const lat = parseFloat(cols[1]);
-                    const lng = parseFloat(cols[2]);
-                    
-                    if (isNaN(lat) || isNaN(lng)) return;
-
-                    const start_date = cols[3];
-                    const end_date = cols[4];
-                    const details = cols[5];
-                    const admin_level = cols[6];
-                    const categoryList = cols[7]
-                        .replace(/^"|"$/g, '')
-                        .split(',')
-                        .map(cat => cat.trim())
-                        .filter(cat => cat);
-
-                    const marker = L.marker([lat, lng])
-                        .bindPopup(`
+        loadPayload('__PAYLOAD__')
+            .then(buffer => {
+                const columns = readPayload(buffer);
+                const lat = columns.lat, lng = columns.lon;
+                const count = lat.length;
+                const useCanvas = count > __MARKER_LIMIT__;
+                const renderer = useCanvas ? L.canvas() : null;
+                masks = columns.categories;
+                postingOffsets = columns['postings.offsets'];
+                postingRows = columns['postings.rows'];
+                visible = new Uint8Array(count);
+
+                for (let i = 0; i < count; i++) {
+                    const marker = useCanvas
+                        ? L.circleMarker([lat[i], lng[i]], {radius: 5, renderer: renderer})
+                        : L.marker([lat[i], lng[i]]);
+                    // The popup is only built when it is opened
+                    marker.bindPopup(() => {
+                        const categoryList = categories.filter((category, c) => masks[i] & (1 << c));
+                        return `
                             <div class="popup-content">
-                                <div class="popup-title">${location}</div>
+                                <div class="popup-title">${stringAt(columns, 'location', i)}</div>
                                 <div class="popup-item">
                                     <strong>⏰ Time Range</strong>
-                                    ${start_date} to ${end_date}
+                                    ${formatDay(columns.start[i])} to ${formatDay(columns.end[i])}
                                 </div>
                                 <div class="popup-item">
                                     <strong>📝 Details</strong>
-                                    ${details}
+                                    ${stringAt(columns, 'details', i)}
                                 </div>
                                 <div class="popup-item">
                                     <strong>🏢 Admin Level</strong>
-                                    ${admin_level}
+                                    ${stringAt(columns, 'admin_level', i)}
                                 </div>
                                 <div class="popup-item">
                                     <strong>🏷️ Impact Categories</strong>
                                     ${categoryList.join(', ')}
                                 </div>
                             </div>
-                        `, {
-                            maxWidth: 420,
-                            className: 'custom-popup'
-                        });
-                    
-                    marker.categories = categoryList;
-                    markers.push(marker);
-                    marker.addTo(map);
-                });
+                        `;
+                    }, {
+                        maxWidth: 420,
+                        className: 'custom-popup'
+                    });
+
+                    markers[i] = marker;
+                    if (matches(i, selectedMask)) {
+                        visible[i] = 1;
+                        markerLayer.addLayer(marker);
+                    }
+                }
             })
             .catch(error => {
-                console.error('Error loading CSV:', error);
+                console.error('Error loading data:', error);
                 alert('Failed to load data. Please check the console for details.');
             });
 
+        function matches(i, mask) {
+            return mask === 0 || (masks[i] & mask) !== 0;
+        }
+
+        function setVisible(i, show) {
+            const marker = markers[i];
+            if (!marker || visible[i] === show) return;
+            visible[i] = show;
+            if (show) {
+                markerLayer.addLayer(marker);
+            } else {
+                markerLayer.removeLayer(marker);
+            }
+        }
+
+        // No category selected shows every location
+        function applySelection(mask) {
+            const previous = selectedMask;
+            const changed = previous ^ mask;
+            selectedMask = mask;
+            if (previous === 0 || mask === 0 || ((mask & changed) && (previous & changed))) {
+                for (let i = 0; i < masks.length; i++) {
+                    setVisible(i, matches(i, mask) ? 1 : 0);
+                }
+                return;
+            }
+            // Only the locations of the toggled categories can change
+            categories.forEach((category, c) => {
+                if (!(changed & (1 << c))) return;
+                for (let k = postingOffsets[c]; k < postingOffsets[c + 1]; k++) {
+                    const i = postingRows[k];
+                    setVisible(i, (masks[i] & mask) !== 0 ? 1 : 0);
+                }
+            });
+        }
+
         window.filterMarkers = function() {
             try {
-                const selectedCategories = categories.filter(category => 
-                    document.getElementById(category) && 
-                    document.getElementById(category).checked
-                );
-
-                markers.forEach(marker => {
-                    if (!marker.categories) return;
-                    
-                    const hasSelectedCategory = marker.categories.some(category => {
-                        const trimmedCategory = category.trim();
-                        return selectedCategories.includes(trimmedCategory);
-                    });
-                    
-                    if (selectedCategories.length === 0 || hasSelectedCategory) {
-                        marker.addTo(map);
-                    } else {
-                        marker.remove();
-                    }
+                let mask = 0;
+                categories.forEach((category, c) => {
+                    const checkbox = document.getElementById(category);
+                    if (checkbox && checkbox.checked) mask |= 1 << c;
                 });
+                applySelection(mask);
             } catch (error) {
                 console.error('Filter error:', error);
             }
@@ -268,16 +394,35 @@ def generate_html():
     </script>
 </body>
 </html>'''
+    html_content = (html_content
+                    .replace('__CATEGORIES__', json.dumps(list(CATEGORIES)))
+                    .replace('__PAYLOAD__', PAYLOAD)
+                    .replace('__BOUNDARY__', BOUNDARY)
+                    .replace('__MARKER_LIMIT__', str(MARKER_LIMIT)))
 
     # 将HTML内容写入文件
     with open('typhoon_map/index.html', 'w', encoding='utf-8') as f:
         f.write(html_content)
+    instrument.count_file('bytes_written', 'typhoon_map/index.html')
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--force', action='store_true',
+                        help='Rebuild the data payload even if the CSV is unchanged')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.configure(args)
     try:
         check_files()
         os.makedirs('typhoon_map', exist_ok=True)
         generate_html()
+        publish_boundary('typhoon_map')
         print("HTML文件已生成在 typhoon_map/index.html")
+        if publish_payload('typhoon_map', force=args.force):
+            print(f"数据已生成在 typhoon_map/{PAYLOAD}")
+        else:
+            print("CSV 和数据代码未变化, 跳过数据发布")
     except Exception as e:
-        print(f"错误: {e}")
\ No newline at end of file
+        print(f"错误: {e}")
+        # common.build records the outputs as built only on exit status 0
+        sys.exit(1)
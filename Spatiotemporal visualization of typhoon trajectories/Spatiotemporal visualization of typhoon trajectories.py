@@ -1,162 +1,462 @@
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-from datetime import datetime
 import numpy as np
-from matplotlib.colors import Normalize  
-import cartopy.crs as ccrs  
-import cartopy.feature as cfeature  
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import Normalize
+from matplotlib.lines import Line2D
+import cartopy.crs as ccrs
 import matplotlib as mpl
 from matplotlib.font_manager import FontProperties
+from PIL import Image
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import instrument
+from common.basemap import add_geography, draw_basemap
+from common.best_track import get_storm, load_track_archive, storm_count
+from common.data_access import KHANUN_TRACK, data_path
+from common.interpolate import METHODS, interpolate_track
 
-# Read and parse the data
-data = []
-with open(r"D:\Visual Analysis of Typhoons\data\Track data of Typhoon Khanun.txt", "r") as f:
-    for line in f:
-        if line.startswith("66666"):
-            continue
-        parts = line.strip().split()
-        if len(parts) < 6:
-            continue
-            
-        # Parse the date-time and geographical information
-        dt = datetime.strptime(parts[0], "%Y%m%d%H")
-        lat = float(parts[2])/10   # Convert to actual latitude
-        lon = float(parts[3])/10   # Convert to actual longitude
-        wind = int(parts[5])       # Wind speed for marker size
-        
-        data.append({
-            "time": dt,
-            "lat": lat,
-            "lon": lon,
-            "wind": wind
-        })
-
-# Convert to numpy array for easier processing
-times = np.array([d["time"] for d in data])
-lats = np.array([d["lat"] for d in data])
-lons = np.array([d["lon"] for d in data])
-winds = np.array([d["wind"] for d in data])
-
-
-# Create a canvas with geographical projection
-# Add the following import at the beginning of the file
-import matplotlib as mpl
-from matplotlib.font_manager import FontProperties
 
-# Add font settings before creating the canvas
-# Set the global font to a font that supports Chinese characters
-plt.rcParams['font.sans-serif'] = ['SimHei']  # Use SimHei font
-plt.rcParams['axes.unicode_minus'] = False  # Solve the problem of minus sign display
-
-# Create the map projection
-# Modify the canvas size (originally 14,8, now adjusted to 10,6)
-plt.figure(figsize=(10, 6))
-ax = plt.axes(projection=ccrs.PlateCarree())
-
-# For special font settings in Cartopy, specify the font using an absolute path
-font_path = 'C:/Windows/Fonts/msyh.ttc'  # Microsoft YaHei font
-font = FontProperties(fname=font_path, size=12)
-# Modify the title and labels to English
-ax.set_title("Typhoon Khanun Path 2023", fontproperties=font, pad=20)
-ax.set_xlabel("Longitude", fontproperties=font)
-ax.set_ylabel("Latitude", fontproperties=font)
-ax.set_extent([115, 135, 18, 42], crs=ccrs.PlateCarree())  
-# Set the font for Cartopy geographical labels
-ax.gridlines(draw_labels=True,
-             xformatter=plt.FixedFormatter([]),  # Customize longitude labels
-             yformatter=plt.FixedFormatter([]),
-             linewidth=0.5,
-             color='gray',
-             alpha=0.5,
-             linestyle='--')
-
-# Add longitude and latitude labels
-ax.text(0.5, -0.12, 'Longitude', 
-        transform=ax.transAxes,
-        ha='center', va='center', 
-        fontsize=12, fontfamily='SimHei')
-
-# Modify the position of the latitude label, move it to the left and adjust the font size
-ax.text(-0.2, 0.5, 'Latitude',
-        transform=ax.transAxes,
-        rotation=90, 
-        ha='center', va='center',
-        fontsize=11)  
-        
-# Set the color mapping (according to time)
-norm = mdates.date2num(times)
-cmap = plt.get_cmap("plasma")
-colors = cmap((norm - norm.min())/(norm.max() - norm.min()))
-
-# Draw the track line and scatter points
-sc = ax.scatter(lons, lats, c=colors, s=winds*2, 
-                edgecolor="white", alpha=0.8, zorder=3)
-line = ax.plot(lons, lats, color="grey", 
-               linewidth=1.5, alpha=0.6, zorder=2)[0]
-
-# Add start and end markers
-ax.scatter(lons[0], lats[0], s=120, facecolor="lime", 
-           edgecolor="black", label="Start", zorder=4)
-ax.scatter(lons[-1], lats[-1], s=120, facecolor="red", 
-           edgecolor="black", label="End", zorder=4)
-
-# Add the color bar
-# Modify the part of creating the color bar
-
-norm_values = mdates.date2num(times)  # Get the date values
-cbar = plt.colorbar(
-    plt.cm.ScalarMappable(norm=Normalize(norm_values.min(), norm_values.max()),
-                        cmap=cmap),
-    ax=ax,
-    format=mdates.DateFormatter("%m-%d")  # New formatting
-)
-cbar.ax.tick_params(length=0)  # Hide the tick marks
-
-cbar.set_label("Time", fontsize=12)
-cbar.ax.yaxis.set_major_formatter(mdates.DateFormatter("%m-%d"))
-
-# Set the axis range
-lon_pad = (lons.max() - lons.min())*0.1
-lat_pad = (lats.max() - lats.min())*0.1
-ax.set_xlim(lons.min()-lon_pad, lons.max()+lon_pad)
-ax.set_ylim(lats.min()-lat_pad, lats.max()+lat_pad)
-
-# Add geographical information annotations
-ax.add_feature(cfeature.LAND, facecolor='#f0f0f0')
-ax.add_feature(cfeature.OCEAN, facecolor='#e0f3ff') 
-ax.add_feature(cfeature.COASTLINE.with_scale('50m'), linewidth=0.8)
-ax.add_feature(cfeature.BORDERS, linestyle=':', linewidth=0.5)
-
-# Provincial borders
-province_borders = cfeature.NaturalEarthFeature(
-    category='cultural',
-    name='admin_1_states_provinces_lines',
-    scale='50m',
-    facecolor='none'
-)
-ax.add_feature(province_borders, edgecolor='gray', linewidth=0.5)
-
-# Modify the annotation of Shanghai to English
-ax.plot(121.47, 31.23, 'o', color='red', markersize=6, 
-        transform=ccrs.PlateCarree())
-ax.text(121.97, 31.23, 'Shanghai', fontsize=10, 
-        transform=ccrs.PlateCarree())
-
-ax.gridlines(draw_labels=True,  # Automatically annotate longitude and latitude
-             linewidth=0.5, 
-             color='gray',
-             alpha=0.5,
-             linestyle='--')
-
-# Set the legend and labels
-ax.set_title("Typhoon Khanun Path 2023", fontsize=16, pad=20)
-ax.set_xlabel("Longitude", fontsize=12)
-ax.set_ylabel("Latitude", fontsize=12)
-ax.grid(True, linestyle="--", alpha=0.5)
-ax.legend(loc="upper right")
-# Output verification
-plt.savefig('enhanced_typhoon_path.png', dpi=300, bbox_inches='tight')
-# Optimize the layout
-plt.tight_layout()
-plt.show()
\ No newline at end of file
+def parse_storms(*paths):
+    """Read CMA best-track files and return one dict per storm
+
+    Each storm holds its id and name from the 66666 header line plus the
+    time/lat/lon/wind arrays of its records. The files are decoded once
+    into the columnar track store and reopened from it on later runs.
+    """
+    with instrument.span('load_track_archive', files=len(paths)):
+        archive = load_track_archive(*paths)
+    return [get_storm(archive, i) for i in range(storm_count(archive))
+            if archive["count"][i]]
+
+
+def storm_title(storm):
+    """Figure title such as 'Typhoon Khanun Path 2023'"""
+    name = storm["name"].title() or storm["id"]
+    return f"Typhoon {name} Path {np.datetime64(storm['times'][0], 'Y')}"
+
+
+def track_colors(times):
+    """Colour of every fix on the plasma colormap, by time"""
+    norm = mdates.date2num(times)
+    cmap = plt.get_cmap("plasma")
+    return cmap((norm - norm.min())/max(norm.max() - norm.min(), 1e-9))
+
+
+@instrument.span('plot_track')
+def plot_track(times, lats, lons, winds, title="Typhoon Khanun Path 2023",
+               dpi=300, basemap=True, snap=None, track=True):
+    """Draw one storm track on a cartopy map and return the figure
+
+    With basemap, the geographic background is the cached image of
+    common.basemap rendered for dpi (and widened to a snap-degree grid)
+    instead of being drawn from the Natural Earth shapes. With track
+    False only the map, colour bar and legend are drawn, for animation.
+    """
+    # Add font settings before creating the canvas
+    # Set the global font to a font that supports Chinese characters
+    plt.rcParams['font.sans-serif'] = ['SimHei']  # Use SimHei font
+    plt.rcParams['axes.unicode_minus'] = False  # Solve the problem of minus sign display
+
+    # Create the map projection
+    # Modify the canvas size (originally 14,8, now adjusted to 10,6)
+    figsize = (10, 6)
+    fig = plt.figure(figsize=figsize)
+    ax = plt.axes(projection=ccrs.PlateCarree())
+
+    # For special font settings in Cartopy, specify the font using an absolute path
+    font_path = 'C:/Windows/Fonts/msyh.ttc'  # Microsoft YaHei font
+    if os.path.exists(font_path):
+        font = FontProperties(fname=font_path, size=12)
+    else:
+        font = FontProperties(size=12)
+    # Modify the title and labels to English
+    ax.set_title(title, fontproperties=font, pad=20)
+    ax.set_xlabel("Longitude", fontproperties=font)
+    ax.set_ylabel("Latitude", fontproperties=font)
+    ax.set_extent([115, 135, 18, 42], crs=ccrs.PlateCarree())
+    # Set the font for Cartopy geographical labels
+    ax.gridlines(draw_labels=True,
+                 xformatter=plt.FixedFormatter([]),  # Customize longitude labels
+                 yformatter=plt.FixedFormatter([]),
+                 linewidth=0.5,
+                 color='gray',
+                 alpha=0.5,
+                 linestyle='--')
+
+    # Add longitude and latitude labels
+    ax.text(0.5, -0.12, 'Longitude',
+            transform=ax.transAxes,
+            ha='center', va='center',
+            fontsize=12, fontfamily='SimHei')
+
+    # Modify the position of the latitude label, move it to the left and adjust the font size
+    ax.text(-0.2, 0.5, 'Latitude',
+            transform=ax.transAxes,
+            rotation=90,
+            ha='center', va='center',
+            fontsize=11)
+
+    # Set the color mapping (according to time)
+    cmap = plt.get_cmap("plasma")
+    colors = track_colors(times)
+
+    if track:
+        # Draw the track line and scatter points
+        sc = ax.scatter(lons, lats, c=colors, s=winds*2,
+                        edgecolor="white", alpha=0.8, zorder=3)
+        line = ax.plot(lons, lats, color="grey",
+                       linewidth=1.5, alpha=0.6, zorder=2)[0]
+
+        # Add start and end markers
+        ax.scatter(lons[0], lats[0], s=120, facecolor="lime",
+                   edgecolor="black", label="Start", zorder=4)
+        ax.scatter(lons[-1], lats[-1], s=120, facecolor="red",
+                   edgecolor="black", label="End", zorder=4)
+
+    # Add the color bar
+    norm_values = mdates.date2num(times)  # Get the date values
+    cbar = plt.colorbar(
+        plt.cm.ScalarMappable(norm=Normalize(norm_values.min(), norm_values.max()),
+                            cmap=cmap),
+        ax=ax,
+        format=mdates.DateFormatter("%m-%d")  # New formatting
+    )
+    cbar.ax.tick_params(length=0)  # Hide the tick marks
+
+    cbar.set_label("Time", fontsize=12)
+    cbar.ax.yaxis.set_major_formatter(mdates.DateFormatter("%m-%d"))
+
+    # Set the axis range
+    lon_pad = (lons.max() - lons.min())*0.1
+    lat_pad = (lats.max() - lats.min())*0.1
+    ax.set_xlim(lons.min()-lon_pad, lons.max()+lon_pad)
+    ax.set_ylim(lats.min()-lat_pad, lats.max()+lat_pad)
+
+    # Add geographical information annotations
+    if basemap:
+        with instrument.span('basemap'):
+            draw_basemap(ax, figsize, dpi, snap=snap)
+    else:
+        # (the shapes themselves are read and projected when the figure is drawn)
+        with instrument.span('natural_earth_features'):
+            add_geography(ax)
+
+    # Modify the annotation of Shanghai to English
+    ax.plot(121.47, 31.23, 'o', color='red', markersize=6,
+            transform=ccrs.PlateCarree())
+    ax.text(121.97, 31.23, 'Shanghai', fontsize=10,
+            transform=ccrs.PlateCarree())
+
+    ax.gridlines(draw_labels=True,  # Automatically annotate longitude and latitude
+                 linewidth=0.5,
+                 color='gray',
+                 alpha=0.5,
+                 linestyle='--')
+
+    # Set the legend and labels
+    ax.set_title(title, fontsize=16, pad=20)
+    ax.set_xlabel("Longitude", fontsize=12)
+    ax.set_ylabel("Latitude", fontsize=12)
+    ax.grid(True, linestyle="--", alpha=0.5)
+    if track:
+        ax.legend(loc="upper right")
+    else:
+        # The start and end markers are drawn frame by frame; show them anyway
+        ax.legend(handles=[
+            Line2D([], [], marker="o", linestyle="none", markersize=np.sqrt(120),
+                   markerfacecolor=color, markeredgecolor="black", label=label)
+            for color, label in (("lime", "Start"), ("red", "End"))
+        ], loc="upper right")
+    return fig
+
+
+def _init_worker():
+    """Workers render off-screen"""
+    mpl.use("Agg")
+
+
+def render_storm(storm, output_path, dpi=300, basemap=True, snap=None):
+    """Render one storm to a PNG and return the elapsed seconds"""
+    start = time.perf_counter()
+    fig = plot_track(storm["times"], storm["lats"], storm["lons"], storm["winds"],
+                     title=storm_title(storm), dpi=dpi, basemap=basemap, snap=snap)
+    with instrument.span('savefig', dpi=dpi):
+        fig.savefig(output_path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+    instrument.count_file('bytes_written', output_path)
+    return time.perf_counter() - start
+
+
+def storm_filename(storm, taken):
+    """Unique PNG name of a storm, such as '2306_KHANUN.png'
+
+    Unnumbered depressions all share the id '0000', so a name already in
+    taken gets the storm's first fix time, then a counter. The name is
+    added to taken.
+    """
+    base = f"{storm['id']}_{storm['name'] or 'unnamed'}"
+    name = base
+    if name in taken:
+        first = np.datetime_as_string(np.datetime64(storm["times"][0], "h"))
+        name = base = f"{base}_{first.replace('-', '').replace('T', '')}"
+    count = 1
+    while name in taken:
+        count += 1
+        name = f"{base}_{count}"
+    taken.add(name)
+    return name + ".png"
+
+
+def render_batch(storms, output_dir, workers=None, dpi=300, basemap=True, snap=None):
+    """Render one PNG per storm over a process pool
+
+    Yields (storm id, output path, seconds) as each storm finishes.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    taken = set()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {}
+        for storm in storms:
+            output_path = os.path.join(output_dir, storm_filename(storm, taken))
+            future = pool.submit(render_storm, storm, output_path, dpi, basemap, snap)
+            futures[future] = (storm["id"], output_path)
+        for future in as_completed(futures):
+            storm_id, output_path = futures[future]
+            yield storm_id, output_path, future.result()
+
+
+def frame_times(storm, frame_hours=None):
+    """Times of the animation frames: the fixes, or one every frame_hours hours"""
+    times = np.asarray(storm["times"], dtype="datetime64[s]")
+    if not frame_hours:
+        return times
+    step = np.timedelta64(int(round(frame_hours * 3600)), "s")
+    grid = np.arange(times[0], times[-1], step)
+    # Always end on the last fix
+    return np.append(grid, times[-1])
+
+
+class TrackAnimator:
+    """Draws the frames of a storm track animation with blitting.
+
+    The map, colour bar and legend are drawn once. The track then only
+    grows, so each frame restores the previous frame's trail, adds the
+    fixes reached since to it, saves it as the next trail and draws the
+    time label on top: every frame costs a few artists, however long the
+    track is. With frame_hours, frames fall between the fixes and the
+    storm's head is drawn at its interpolated position (common.interpolate)
+    on top of the trail.
+    """
+
+    def __init__(self, storm, dpi=100, basemap=True, snap=None, frame_hours=None,
+                 method="great_circle"):
+        self.lats, self.lons = storm["lats"], storm["lons"]
+        self.winds, self.times = storm["winds"], storm["times"]
+        self.colors = track_colors(self.times)
+        self.frame_times = frame_times(storm, frame_hours)
+        self.head = None
+        if frame_hours:
+            self.head = interpolate_track(storm, self.frame_times, method)
+            self.head["color"] = track_colors(self.frame_times)
+        self.fig = plot_track(self.times, self.lats, self.lons, self.winds,
+                              title=storm_title(storm), dpi=dpi, basemap=basemap,
+                              snap=snap, track=False)
+        self.fig.set_dpi(dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        ax = self.ax = self.fig.axes[0]
+        # Same styles as the static plot; animated artists are left out of draw()
+        self.segment = ax.plot([], [], color="grey", linewidth=1.5, alpha=0.6,
+                               zorder=2, animated=True)[0]
+        self.fix = ax.scatter([], [], edgecolor="white", alpha=0.8, zorder=3, animated=True)
+        self.marker = ax.scatter([], [], s=120, edgecolor="black", zorder=4, animated=True)
+        self.label = ax.text(0.02, 0.97, "", transform=ax.transAxes, ha="left", va="top",
+                             fontsize=12, animated=True,
+                             bbox=dict(facecolor="white", alpha=0.8, edgecolor="none"))
+        self.canvas.draw()
+        self.trail = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.drawn = 0
+
+    def _draw_line(self, lon0, lat0, lon1, lat1):
+        self.segment.set_data([lon0, lon1], [lat0, lat1])
+        self.ax.draw_artist(self.segment)
+
+    def _draw_fix(self, lon, lat, wind, color):
+        self.fix.set_offsets([[lon, lat]])
+        self.fix.set_sizes([wind * 2])
+        self.fix.set_facecolor([color])
+        self.ax.draw_artist(self.fix)
+
+    def _draw_point(self, k):
+        self._draw_fix(self.lons[k], self.lats[k], self.winds[k], self.colors[k])
+        for index, color in ((0, "lime"), (len(self.lats) - 1, "red")):
+            if k == index:
+                self.marker.set_offsets([[self.lons[k], self.lats[k]]])
+                self.marker.set_facecolor(color)
+                self.ax.draw_artist(self.marker)
+
+    def _add_fix(self, k):
+        if k:
+            self._draw_line(self.lons[k - 1], self.lats[k - 1], self.lons[k], self.lats[k])
+            # The lines stay under the fixes, as in the static plot
+            self._draw_point(k - 1)
+        self._draw_point(k)
+
+    def frame(self, k):
+        """RGBA array of frame k; frames must be asked for in order"""
+        now = self.frame_times[k]
+        self.canvas.restore_region(self.trail)
+        while self.drawn < len(self.times) and self.times[self.drawn] <= now:
+            self._add_fix(self.drawn)
+            self.drawn += 1
+        self.trail = self.canvas.copy_from_bbox(self.fig.bbox)
+        last = self.drawn - 1
+        if self.head is not None and self.times[last] < now:
+            lon, lat = self.head["lon"][k], self.head["lat"][k]
+            self._draw_line(self.lons[last], self.lats[last], lon, lat)
+            self._draw_fix(lon, lat, self.head["wind"][k], self.head["color"][k])
+        self.label.set_text(np.datetime_as_string(now, unit="m").replace("T", " "))
+        self.ax.draw_artist(self.label)
+        return np.asarray(self.canvas.buffer_rgba())
+
+    def close(self):
+        plt.close(self.fig)
+
+
+def _render_frame_chunk(storm, first, last, directory, options):
+    """Write frames first..last-1 as PNGs; run in a worker process"""
+    animator = TrackAnimator(storm, **options)
+    for k in range(first, last):
+        Image.fromarray(animator.frame(k)).save(os.path.join(directory, f"{k:05d}.png"),
+                                                compress_level=1)
+    animator.close()
+    return last - first
+
+
+def _parallel_frames(storm, count, directory, workers, options):
+    """Render the frames in contiguous chunks over a process pool, then read them back in order"""
+    bounds = np.linspace(0, count, workers + 1).round().astype(int)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(_render_frame_chunk, storm, int(a), int(b), directory, options)
+                   for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+        for future in futures:
+            future.result()
+    for k in range(count):
+        with Image.open(os.path.join(directory, f"{k:05d}.png")) as image:
+            yield np.asarray(image.convert("RGBA"))
+
+
+def write_animation(frames, output_path, fps=4):
+    """Encode RGBA frames to a GIF (Pillow) or, for any other extension, with ffmpeg"""
+    frames = iter(frames)
+    first = next(frames)
+    if output_path.lower().endswith(".gif"):
+        def quantized(frame):
+            return Image.fromarray(frame).convert("RGB").quantize()
+
+        quantized(first).save(output_path, save_all=True,
+                              append_images=(quantized(frame) for frame in frames),
+                              duration=round(1000 / fps), loop=0)
+        return
+    height, width = first.shape[:2]
+    command = [
+        mpl.rcParams["animation.ffmpeg_path"], "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgba", "-s", f"{width}x{height}", "-r", str(fps),
+        "-i", "-",
+        # yuv420p needs even dimensions
+        "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p", output_path,
+    ]
+    with subprocess.Popen(command, stdin=subprocess.PIPE) as process:
+        process.stdin.write(first.tobytes())
+        for frame in frames:
+            process.stdin.write(frame.tobytes())
+        process.stdin.close()
+        if process.wait():
+            raise RuntimeError(f"ffmpeg failed to write {output_path}")
+
+
+def animate_track(storm, output_path, fps=4, dpi=100, workers=1, basemap=True, snap=None,
+                  frame_hours=None, method="great_circle"):
+    """Write an MP4 or GIF of the storm advancing one fix (6 hours) per frame.
+
+    With frame_hours, frames are that many hours apart and the storm
+    moves smoothly between the fixes. With workers > 1 the frames are
+    rendered in chunks by worker processes and stitched in order.
+    Returns the number of frames.
+    """
+    options = dict(dpi=dpi, basemap=basemap, snap=snap, frame_hours=frame_hours, method=method)
+    count = len(frame_times(storm, frame_hours))
+    with instrument.span("animate_track", frames=count, workers=workers):
+        if workers > 1:
+            with tempfile.TemporaryDirectory() as directory:
+                write_animation(_parallel_frames(storm, count, directory, workers, options),
+                                output_path, fps)
+        else:
+            animator = TrackAnimator(storm, **options)
+            write_animation((animator.frame(k) for k in range(count)), output_path, fps)
+            animator.close()
+    instrument.count_file("bytes_written", output_path)
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', nargs='+', metavar='TRACK_FILE',
+                        help='Render every storm in these CMA best-track files')
+    parser.add_argument('--animate', metavar='OUTPUT',
+                        help='Write an animation of the Khanun track to OUTPUT (.mp4 or .gif)')
+    parser.add_argument('--fps', type=float, default=4, help='Animation frames per second')
+    parser.add_argument('--frame-hours', type=float, metavar='HOURS',
+                        help='Hours between animation frames, interpolating between the fixes '
+                             '(default: one frame per fix)')
+    parser.add_argument('--interpolation', choices=METHODS, default='great_circle',
+                        help='Path between the fixes for --frame-hours')
+    parser.add_argument('--frame-dpi', type=int, default=100, help='Resolution of the animation')
+    parser.add_argument('--output-dir', default='typhoon_tracks')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--dpi', type=int, default=300)
+    parser.add_argument('--no-basemap-cache', dest='basemap', action='store_false',
+                        help='Draw the Natural Earth background as vectors for every storm')
+    parser.add_argument('--basemap-snap', type=float, metavar='DEG',
+                        help='Share cached backgrounds between storms by widening their '
+                             'extent to a DEG-degree grid')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.configure(args)
+
+    if args.animate:
+        storm = parse_storms(data_path(KHANUN_TRACK))[0]
+        start = time.perf_counter()
+        frames = animate_track(storm, args.animate, fps=args.fps, dpi=args.frame_dpi,
+                               workers=args.workers or 1, basemap=args.basemap,
+                               snap=args.basemap_snap, frame_hours=args.frame_hours,
+                               method=args.interpolation)
+        print(f"Wrote {frames} frames to {args.animate} in {time.perf_counter() - start:.2f}s")
+    elif args.batch:
+        storms = parse_storms(*args.batch)
+        start = time.perf_counter()
+        for storm_id, output_path, seconds in render_batch(storms, args.output_dir,
+                                                           args.workers, args.dpi,
+                                                           args.basemap, args.basemap_snap):
+            print(f"{storm_id}: {output_path} ({seconds:.2f}s)")
+        print(f"Rendered {len(storms)} storms in {time.perf_counter() - start:.2f}s")
+    else:
+        # Read and parse the data
+        storm = parse_storms(data_path(KHANUN_TRACK))[0]
+        fig = plot_track(storm["times"], storm["lats"], storm["lons"], storm["winds"],
+                         title=storm_title(storm), dpi=args.dpi, basemap=args.basemap,
+                         snap=args.basemap_snap)
+        # Output verification
+        with instrument.span('savefig', dpi=args.dpi):
+            plt.savefig('enhanced_typhoon_path.png', dpi=args.dpi, bbox_inches='tight')
+        instrument.count_file('bytes_written', 'enhanced_typhoon_path.png')
+        # Optimize the layout
+        plt.tight_layout()
+        plt.show()
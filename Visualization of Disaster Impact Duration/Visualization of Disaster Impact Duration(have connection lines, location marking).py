@@ -1,18 +1,56 @@
 import folium
 from folium import plugins
-import pandas as pd
 from branca.colormap import LinearColormap
 # Add the precise boundary of Ningbo
-import json
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import instrument, query
+from common.boundary import load_simplified_boundary
+from common.best_track import get_storm, load_track_archive
+from common.districts import add_districts, district_summary
+from common.exposure import COLOR_BY, DEFAULT_RADIUS_KM, add_exposure
+from common.layers import (CHOROPLETH, RENDER_MODES, add_cluster_layer, add_direct_layer,
+                           add_district_layer, add_point_layer, add_spoke_layer,
+                           add_tile_layer)
+from common.popups import LazyPopups, placeholder, write_popup_store
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--render', choices=RENDER_MODES, default='markers',
+                    help='markers: one Leaflet object per location; direct: the same '
+                         'objects created by one JS loop over one data array; geojson/cluster: '
+                         'one layer for all locations, for large tables; tiles: vector '
+                         'tiles loaded per view (serve the output directory over HTTP)')
+parser.add_argument('--lazy-popups', action='store_true',
+                    help='Write popup details to a side store loaded on click '
+                         '(serve the output directory over HTTP)')
+parser.add_argument('--color-by', choices=COLOR_BY, default='days',
+                    help='Colour the locations by impact days or by their exposure to the '
+                         'Khanun track: closest approach, hours within --radius, or wind '
+                         'at closest approach')
+parser.add_argument('--radius', type=float, default=DEFAULT_RADIUS_KM, metavar='KM',
+                    help='Radius for --color-by hours')
+parser.add_argument('--districts', choices=CHOROPLETH,
+                    help='Fill the Ningbo districts by their number of affected locations '
+                         'or mean impact days')
+query.add_arguments(parser)
+instrument.add_arguments(parser)
+args = parser.parse_args()
+instrument.configure(args)
 
 # Data preprocessing
 try:
-    df = pd.read_csv(r'D:\Visual Analysis of Typhoons\data\typhoon_data.csv', parse_dates=['start_date', 'end_date'])
-    df['Impact Days'] = (df['end_date'] - df['start_date']).dt.days + 1
-    avg_lat = df['latitude'].mean()
-    avg_lng = df['longitude'].mean()
-except:
-    avg_lat, avg_lng = 26.0, 118.0
+    with instrument.span('load_data'):
+        df = query.filter_table(**query.filters_from(args))
+except (OSError, ValueError) as e:
+    parser.error(f'cannot load the impact table: {e}')
+if df.empty:
+    # Nothing to centre the map on or colour by
+    parser.error('no rows match the row filters')
+avg_lat = df['latitude'].mean()
+avg_lng = df['longitude'].mean()
 
 # Create the map
 m = folium.Map(
@@ -24,89 +62,163 @@ m = folium.Map(
     prefer_canvas=True
 )
 
-try:
-    # Load Ningbo GeoJSON data
-    with open('D:/Visual Analysis of Typhoons/data/Ningbo.json', 'r', encoding='utf-8') as f:
-        ningbo_geojson = json.load(f)
-
-    folium.GeoJson(
-        ningbo_geojson,
-        name='Ningbo',
-        style_function=lambda x: {
-            'fillColor': '#3388ff',
-            'color': '#3388ff',
-            'weight': 2,
-            'fillOpacity': 0.2
-        },
-        tooltip='Ningbo'
-    ).add_to(m)
-except Exception as e:
-    print(f"Failed to load Ningbo boundary data: {e}")
+# Style of the Ningbo boundary, inline or in the vector tiles
+boundary_style = {
+    'fillColor': '#3388ff',
+    'color': '#3388ff',
+    'weight': 2,
+    'fillOpacity': 0.2
+}
+
+if args.districts:
+    # The district choropleth replaces the plain boundary overlay
+    df = add_districts(df)
+    add_district_layer(m, district_summary(df), args.districts)
+
+# In tiles mode the boundary is drawn from the vector tiles instead
+if args.render != 'tiles' and not args.districts:
+    try:
+        # Load Ningbo GeoJSON data
+        # Simplified to stay pixel-exact two levels past the initial zoom
+        ningbo_geojson = load_simplified_boundary(zoom=9)
+
+        folium.GeoJson(
+            ningbo_geojson,
+            name='Ningbo',
+            style_function=lambda x: boundary_style,
+            tooltip='Ningbo'
+        ).add_to(m)
+    except Exception as e:
+        print(f"Failed to load Ningbo boundary data: {e}")
 
 # Create a color scale
-colormap = LinearColormap(['#FFEDA0', '#FEB24C', '#FC4E2A'],
-                         vmin=df['Impact Days'].min(),
-                         vmax=df['Impact Days'].max()).to_step(5)
-colormap.caption = 'Typhoon Impact Duration (days)'
+color_column, caption, reverse = COLOR_BY[args.color_by]
+if args.color_by != 'days':
+    with instrument.span('exposure', radius_km=args.radius):
+        df = add_exposure(df, get_storm(load_track_archive(), 0), radius_km=args.radius)
+colors = ['#FFEDA0', '#FEB24C', '#FC4E2A']
+colormap = LinearColormap(colors[::-1] if reverse else colors,
+                         vmin=df[color_column].min(),
+                         vmax=df[color_column].max()).to_step(5)
+colormap.caption = caption.format(radius=args.radius)
 m.add_child(colormap)
 
 # Add markers
 # Add a marker for the center of Ningbo after creating the map
 ningbo_center = [29.87, 121.54]  # Coordinates of the center of Ningbo
 
-# Modify the marker addition part to optimize the visual effect
-for _, row in df.iterrows():
-    location = [row['latitude'], row['longitude']]
-
-    # Add a dashed connecting line
-    folium.PolyLine(
-        locations=[ningbo_center, location],
-        color='#666666',  # Softer gray
-        weight=1.5,  # Slightly thinner line
-        opacity=0.7,
-        dash_array='5, 3'  # Dashed style
-    ).add_to(m)
-
-    # Marker for the disaster - affected location (optimized style)
-    folium.CircleMarker(
-        location=location,
-        radius=8,
-        color=colormap(row['Impact Days']),
-        fill=True,
-        fill_color=colormap(row['Impact Days']),
-        fill_opacity=0.9,  # Increase fill transparency
-        popup=folium.Popup(f"""
+# Popup content of a disaster-affected location
+POPUP_HTML = """
             <div style="width:300px;font-family:Microsoft YaHei">
-                <h4 style="color:#2c7bb6;margin:0">{row['location']}</h4>
-                <p style="margin:5px 0">Impact Days: <b>{row['Impact Days']} days</b></p>
+                <h4 style="color:#2c7bb6;margin:0">{location}</h4>
+                <p style="margin:5px 0">Impact Days: <b>{days} days</b></p>
                 <hr style="margin:5px 0">
-                <p style="font-size:0.9em">{row['details']}</p>
+                <p style="font-size:0.9em">{details}</p>
             </div>
-        """, max_width=300),
-        tooltip=f"{row['location']}",
-        z_index_offset=100
-    ).add_to(m)
-
-    # Label for the location name (optimized style)
-    folium.Marker(
-        location=[location[0]-0.015, location[1]],  # Fine - tune the position
-        icon=folium.DivIcon(
-            html=f"""
-            <div style="
-                font-size:10px;
-                color:#444;
-                font-weight:500;
-                background:rgba(255,255,255,0.85);
-                padding:2px 5px;
-                border-radius:3px;
-                white-space:nowrap;
-                border:1px solid #ddd;
-                font-family:Microsoft YaHei
-            ">{row["location"]}</div>
-            """
-        ),
-        z_index_offset=200
-    ).add_to(m)
+        """
+
+# The same popup as CSS classes, rendered on click from the side store
+LAZY_POPUP_TEMPLATE = """
+            <div class="impact-popup">
+                <h4>{location}</h4>
+                <p>Impact Days: <b>{days} days</b></p>
+                <hr>
+                <p class="details">{details}</p>
+            </div>
+        """
+LAZY_POPUP_CSS = """
+    .impact-popup { width: 300px; font-family: Microsoft YaHei; }
+    .impact-popup h4 { color: #2c7bb6; margin: 0; }
+    .impact-popup p { margin: 5px 0; }
+    .impact-popup hr { margin: 5px 0; }
+    .impact-popup .details { font-size: 0.9em; }
+"""
+
+# Label of a disaster-affected location
+LABEL_HTML = """
+                <div style="
+                    font-size:10px;
+                    color:#444;
+                    font-weight:500;
+                    background:rgba(255,255,255,0.85);
+                    padding:2px 5px;
+                    border-radius:3px;
+                    white-space:nowrap;
+                    border:1px solid #ddd;
+                    font-family:Microsoft YaHei
+                ">{location}</div>
+                """
+
+output_path = 'Visualization of Disaster Impact Duration(have connection lines, location marking).html'
+
+if args.lazy_popups:
+    # Records are stored in row order, so a row's position is its popup id
+    popup_dir = os.path.splitext(output_path)[0] + '_popups'
+    write_popup_store(
+        ({'location': location, 'days': days, 'details': details}
+         for location, days, details in zip(df['location'].tolist(), df['Impact Days'].tolist(),
+                                            df['details'].fillna('').tolist())),
+        popup_dir
+    )
+    LazyPopups(os.path.basename(popup_dir), LAZY_POPUP_TEMPLATE, LAZY_POPUP_CSS).add_to(m)
+
+layers = instrument.span('build_layers', render=args.render, rows=len(df)).start()
+if args.render == 'markers':
+    # Modify the marker addition part to optimize the visual effect
+    for i, (_, row) in enumerate(df.iterrows()):
+        location = [row['latitude'], row['longitude']]
+
+        # Add a dashed connecting line
+        folium.PolyLine(
+            locations=[ningbo_center, location],
+            color='#666666',  # Softer gray
+            weight=1.5,  # Slightly thinner line
+            opacity=0.7,
+            dash_array='5, 3'  # Dashed style
+        ).add_to(m)
+
+        # Marker for the disaster - affected location (optimized style)
+        folium.CircleMarker(
+            location=location,
+            radius=8,
+            color=colormap(row[color_column]),
+            fill=True,
+            fill_color=colormap(row[color_column]),
+            fill_opacity=0.9,  # Increase fill transparency
+            popup=folium.Popup(placeholder(i) if args.lazy_popups else POPUP_HTML.format(
+                location=row['location'], days=row['Impact Days'], details=row['details']
+            ), max_width=300),
+            tooltip=f"{row['location']}",
+            z_index_offset=100
+        ).add_to(m)
+
+        # Label for the location name (optimized style)
+        folium.Marker(
+            location=[location[0]-0.015, location[1]],  # Fine - tune the position
+            icon=folium.DivIcon(html=LABEL_HTML.format(location=row['location'])),
+            z_index_offset=200
+        ).add_to(m)
+elif args.render == 'direct':
+    # The lines, markers and labels above, created client-side from one data array
+    add_direct_layer(m, df, colormap, POPUP_HTML, lazy=args.lazy_popups, column=color_column,
+                     spokes=ningbo_center, label_html=LABEL_HTML)
+else:
+    # One layer for all locations instead of one Leaflet object per row
+    add_spoke_layer(m, df, ningbo_center)
+    if args.render == 'geojson':
+        add_point_layer(m, df, colormap, POPUP_HTML, lazy=args.lazy_popups,
+                        column=color_column)
+    elif args.render == 'cluster':
+        add_cluster_layer(m, df, colormap, POPUP_HTML, lazy=args.lazy_popups,
+                          column=color_column)
+    else:
+        # Served next to the page from <output>_tiles/{z}/{x}/{y}.pbf
+        add_tile_layer(m, df, colormap, POPUP_HTML, os.path.splitext(output_path)[0] + '_tiles',
+                       lazy=args.lazy_popups, boundary_style=boundary_style,
+                       column=color_column)
+
+layers.stop()
+instrument.count('features', len(df))
 
 # Marker for the center of Ningbo
 folium.Marker(
@@ -145,7 +257,8 @@ if(typeof L === 'undefined'){
 '''))
 
 # Save the file
-output_path = 'Visualization of Disaster Impact Duration(have connection lines, location marking).html'
-m.save(output_path)
+with instrument.span('save_html'):
+    m.save(output_path)
+instrument.count_file('bytes_written', output_path)
 print(f"The map has been saved to: {output_path}")
     
\ No newline at end of file
@@ -0,0 +1,59 @@
+"""Compare the iterrows and columnar feature builders of process_data.
+
+Usage:
+    python benchmarks/bench_process_data.py [--sizes 1000 100000 1000000]
+
+The iterrows builder takes several minutes at 1M rows; pass --skip-loop-above
+to only time the columnar builder for the larger sizes.
+"""
+import argparse
+import importlib.util
+import os
+import time
+
+from synthetic import loaded_impact_frame
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(
+    ROOT,
+    'Interactive spatiotemporal mapping of disaster locations',
+    'Interactive spatiotemporal mapping of disaster locations.py'
+)
+
+
+def load_script(path, name):
+    """Import a script whose file name contains spaces"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed(func, df):
+    begin = time.perf_counter()
+    features = func(df)
+    return time.perf_counter() - begin, len(features)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--skip-loop-above', type=int, default=None,
+                        help='Only time the columnar builder above this row count')
+    args = parser.parse_args()
+
+    module = load_script(SCRIPT, 'interactive_map')
+    print(f"{'rows':>10} {'iterrows (s)':>14} {'columnar (s)':>14} {'speedup':>9}")
+    for rows in args.sizes:
+        df = loaded_impact_frame(rows)
+        columnar, count = timed(module.build_features_columnar, df)
+        if args.skip_loop_above is not None and rows > args.skip_loop_above:
+            print(f"{rows:>10} {'-':>14} {columnar:>14.3f} {'-':>9}")
+            continue
+        loop, loop_count = timed(module.build_features_iterrows, df)
+        assert loop_count == count
+        print(f"{rows:>10} {loop:>14.3f} {columnar:>14.3f} {loop / columnar:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""Time and memory-profile every stage of the map generators on synthetic data.
+
+Usage:
+    python benchmarks/bench_suite.py [--rows 1000 100000] [--storms 20]
+    python benchmarks/bench_suite.py --save-baseline
+    python benchmarks/bench_suite.py --baseline benchmarks/baseline.json
+
+For every table size an impact CSV is generated (see synthetic.py) and
+taken through the stages of the interactive map: CSV load, process_data
+feature building, folium map construction and HTML save. A synthetic
+best-track file goes through track parsing and cartopy rendering of the
+trajectory plot. Each case runs in a fresh worker process, so the peak
+RSS reported for a stage is the high-water mark of that case up to and
+including the stage. --trace-memory adds the tracemalloc peak of every
+stage on its own, at the cost of slower timings.
+
+The on-disk cache of common.data_access is disabled, so every stage does
+its full work. With --baseline, seconds per stage are compared against a
+file written by --save-baseline and the exit status is 1 if any stage is
+slower by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_process_data import SCRIPT as INTERACTIVE_SCRIPT, load_script
+from synthetic import write_best_track, write_impact_csv
+
+TRAJECTORY_SCRIPT = os.path.join(
+    ROOT,
+    'Spatiotemporal visualization of typhoon trajectories',
+    'Spatiotemporal visualization of typhoon trajectories.py'
+)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def peak_rss_mb():
+    """High-water mark of this process's resident set, or None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+class Recorder:
+    """Collects one result dict per timed stage"""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = []
+
+    def run(self, stage, unit, func, count):
+        """Time func(); count is the number of units processed, or a function of the result"""
+        if self.trace_memory:
+            tracemalloc.start()
+        begin = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - begin
+        traced = None
+        if self.trace_memory:
+            traced = tracemalloc.get_traced_memory()[1] / (1 << 20)
+            tracemalloc.stop()
+        items = count(result) if callable(count) else count
+        self.stages.append({
+            'stage': stage,
+            'seconds': seconds,
+            'items': items,
+            'unit': unit,
+            'throughput': items / seconds if seconds > 0 else None,
+            'peak_rss_mb': peak_rss_mb(),
+            'traced_peak_mb': traced,
+        })
+        return result
+
+
+def _disable_cache():
+    from common import data_access
+    data_access.set_cache_dir(None)
+    data_access.clear_cache()
+
+
+def run_impact_case(case, trace_memory):
+    """CSV load, feature building, map construction and HTML save for one table size"""
+    _disable_cache()
+    from common.data_access import load_impact_table
+    module = load_script(INTERACTIVE_SCRIPT, 'interactive_map')
+    recorder = Recorder(trace_memory)
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, 'typhoon_data.csv')
+        write_impact_csv(csv_path, case['rows'], max_days=case['max_days'],
+                         min_days=case['min_days'], max_categories=case['max_categories'],
+                         seed=case['seed'])
+        rows = case['rows']
+        recorder.run('csv_load', 'rows', lambda: load_impact_table(csv_path), rows)
+        data = recorder.run('process_data', 'features', lambda: module.process_data(csv_path),
+                            lambda result: len(result['features']))
+        features = len(data['features'])
+        m = recorder.run('map_build', 'features', lambda: module.create_map(data), features)
+        html_path = os.path.join(directory, 'map.html')
+        recorder.run('html_save', 'bytes', lambda: m.save(html_path),
+                     lambda result: os.path.getsize(html_path))
+    return recorder.stages
+
+
+def run_track_case(case, trace_memory):
+    """Best-track parsing and cartopy rendering for one synthetic archive"""
+    _disable_cache()
+    os.environ['MPLBACKEND'] = 'Agg'
+    module = load_script(TRAJECTORY_SCRIPT, 'trajectories')
+    recorder = Recorder(trace_memory)
+    with tempfile.TemporaryDirectory() as directory:
+        track_path = os.path.join(directory, 'best_track.txt')
+        write_best_track(track_path, case['storms'], fixes=case['fixes'], seed=case['seed'])
+        storms = recorder.run('track_parse', 'fixes', lambda: module.parse_storms(track_path),
+                              lambda result: sum(len(s['times']) for s in result))
+        selected = storms[:case['render']]
+
+        def render():
+            for i, storm in enumerate(selected):
+                module.render_storm(storm, os.path.join(directory, f'{i}.png'), case['dpi'])
+
+        recorder.run('cartopy_render', 'storms', render, len(selected))
+    return recorder.stages
+
+
+RUNNERS = {'impact': run_impact_case, 'track': run_track_case}
+
+
+def case_name(case):
+    if case['kind'] == 'impact':
+        return f"impact-{case['rows']}"
+    return f"track-{case['storms']}x{case['fixes']}"
+
+
+def run_case(case, trace_memory=False):
+    """Run one case in a fresh worker process and return its stage results"""
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(RUNNERS[case['kind']], case, trace_memory).result()
+
+
+def compare(results, baseline, tolerance):
+    """Add baseline seconds and ratio to every stage; returns the regressed ones"""
+    reference = {(c['name'], s['stage']): s['seconds']
+                 for c in baseline.get('cases', []) for s in c['stages']}
+    regressions = []
+    for case in results['cases']:
+        for stage in case['stages']:
+            before = reference.get((case['name'], stage['stage']))
+            if not before:
+                continue
+            stage['baseline_seconds'] = before
+            stage['ratio'] = stage['seconds'] / before
+            if stage['ratio'] > 1 + tolerance:
+                regressions.append((case['name'], stage['stage']))
+    return regressions
+
+
+def _rate(value, unit):
+    if value is None:
+        return '-'
+    for scale, suffix in ((1e9, 'G'), (1e6, 'M'), (1e3, 'k')):
+        if value >= scale:
+            return f'{value / scale:.1f}{suffix} {unit}/s'
+    return f'{value:.1f} {unit}/s'
+
+
+def _mb(value):
+    return '-' if value is None else f'{value:.1f}'
+
+
+def print_report(results):
+    print(f"{'case':<18} {'stage':<15} {'seconds':>9} {'throughput':>20} "
+          f"{'peak RSS MB':>12} {'traced MB':>10} {'vs baseline':>12}")
+    for case in results['cases']:
+        for stage in case['stages']:
+            ratio = f"{stage['ratio']:.2f}x" if 'ratio' in stage else '-'
+            print(f"{case['name']:<18} {stage['stage']:<15} {stage['seconds']:>9.3f} "
+                  f"{_rate(stage['throughput'], stage['unit']):>20} "
+                  f"{_mb(stage['peak_rss_mb']):>12} {_mb(stage['traced_peak_mb']):>10} {ratio:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Impact table sizes')
+    parser.add_argument('--max-days', type=int, default=21, help='Longest impact window')
+    parser.add_argument('--min-days', type=int, default=1, help='Shortest impact window')
+    parser.add_argument('--max-categories', type=int, default=3,
+                        help='Most categories listed by one row')
+    parser.add_argument('--storms', type=int, default=20, help='Storms in the best-track file')
+    parser.add_argument('--fixes', type=int, default=66, help='Average fixes per storm')
+    parser.add_argument('--render', type=int, default=3, help='Storms rendered with cartopy')
+    parser.add_argument('--dpi', type=int, default=100)
+    parser.add_argument('--no-tracks', action='store_true', help='Skip the best-track stages')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Record the tracemalloc peak of every stage')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', nargs='?', const=DEFAULT_BASELINE,
+                        help='Compare against this results file (default: benchmarks/baseline.json)')
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE,
+                        help='Store the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed slowdown against the baseline, as a fraction')
+    args = parser.parse_args()
+
+    cases = [{'kind': 'impact', 'rows': rows, 'max_days': args.max_days,
+              'min_days': args.min_days, 'max_categories': args.max_categories,
+              'seed': args.seed}
+             for rows in args.rows]
+    if not args.no_tracks:
+        cases.append({'kind': 'track', 'storms': args.storms, 'fixes': args.fixes,
+                      'render': args.render, 'dpi': args.dpi, 'seed': args.seed})
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cases': [],
+    }
+    for case in cases:
+        name = case_name(case)
+        print(f'Running {name}...', file=sys.stderr)
+        results['cases'].append({'name': name, 'case': case,
+                                 'stages': run_case(case, args.trace_memory)})
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+    print_report(results)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+    if regressions:
+        print(f'Slower than the baseline by more than {args.tolerance:.0%}: '
+              + ', '.join(f'{case}/{stage}' for case, stage in regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Synthetic inputs for the benchmarks.
+
+impact_frame/write_impact_csv produce tables with the columns of
+typhoon_data.csv (dates written as 2023/8/1, categories as a padded
+comma-separated list), with a configurable number of rows, impact-window
+lengths and category mix; loaded_impact_frame is the same table after
+load_impact_table's parsing. write_best_track produces a CMA best-track file
+with any number of storms, each a header line plus one fix every 6 hours
+drifting north-west from the Philippine Sea like Khanun.
+"""
+import numpy as np
+import pandas as pd
+
+# Default category mix: relative frequency of each category in a row's list
+CATEGORY_WEIGHTS = {
+    'Population': 5,
+    'Infrastructure': 5,
+    'Water Resources': 3,
+    'Service Industry': 3,
+    'Ecological Resources': 2,
+    'Agriculture and Fishery': 2,
+    'Buildings': 1,
+    'Public Services': 1,
+}
+
+ADMIN_LEVELS = ('town', 'subdistrict', 'township', 'POI')
+
+DETAILS = (
+    'Evacuate villagers; reservoir pre-discharge; coastal wind force 7-8',
+    'Scenic areas closed; ferry services suspended',
+    'Farmland flooded; fishing boats returned to port',
+    'Power outage in parts of the town; roads closed by landslides',
+)
+
+
+def _category_lists(rng, rows, weights, max_categories):
+    names = np.array(list(weights))
+    p = np.array(list(weights.values()), dtype=float)
+    p /= p.sum()
+    counts = rng.integers(1, max_categories + 1, rows)
+    picks = rng.choice(len(names), size=(rows, max_categories), p=p)
+    lists = []
+    for row, count in zip(picks.tolist(), counts.tolist()):
+        # Repeated picks collapse, as a real row never lists a category twice
+        lists.append(','.join(dict.fromkeys(names[row[:count]].tolist())) + '  ')
+    return lists
+
+
+def _slash_dates(days):
+    """datetime64[D] values as 2023/8/1 strings, the format of typhoon_data.csv"""
+    dates = pd.DatetimeIndex(days)
+    return (dates.year.astype(str) + '/' + dates.month.astype(str)
+            + '/' + dates.day.astype(str))
+
+
+def impact_frame(rows, max_days=21, min_days=1, start='2023-07-28', start_spread=10,
+                 category_weights=None, max_categories=3, seed=0):
+    """Raw impact table as read from typhoon_data.csv, before date parsing.
+
+    Impact windows are min_days..max_days long and start within
+    start_spread days of start. category_weights maps category names to
+    relative frequencies (CATEGORY_WEIGHTS by default).
+    """
+    rng = np.random.default_rng(seed)
+    first = np.datetime64(start, 'D') + rng.integers(0, start_spread, rows).astype('timedelta64[D]')
+    duration = rng.integers(min_days, max_days + 1, rows)
+    last = first + (duration - 1).astype('timedelta64[D]')
+    return pd.DataFrame({
+        'location': [f'Site {i} Village,Town {i % 97}' for i in range(rows)],
+        'latitude': rng.uniform(28.8, 30.4, rows).round(4),
+        'longitude': rng.uniform(120.9, 122.3, rows).round(4),
+        'start_date': _slash_dates(first),
+        'end_date': _slash_dates(last),
+        'details': rng.choice(DETAILS, rows),
+        'admin_level': rng.choice(ADMIN_LEVELS, rows),
+        'categories': _category_lists(rng, rows, category_weights or CATEGORY_WEIGHTS,
+                                      max_categories),
+    })
+
+
+def loaded_impact_frame(rows, **options):
+    """impact_frame(rows, **options) as common.data_access.load_impact_table
+    returns it: dates parsed and the duration columns added"""
+    df = impact_frame(rows, **options)
+    for column in ('start_date', 'end_date'):
+        df[column] = pd.to_datetime(df[column], format='%Y/%m/%d')
+    df['duration'] = (df['end_date'] - df['start_date']).dt.days + 1
+    df['Impact Days'] = df['duration']
+    return df
+
+
+def write_impact_csv(path, rows, **options):
+    """Write impact_frame(rows, **options) to path; returns the row count"""
+    impact_frame(rows, **options).to_csv(path, index=False)
+    return rows
+
+
+def storm_fixes(rng, fixes, start):
+    """Times, lat/lon, pressure and wind of one synthetic 6-hourly track"""
+    times = start + np.arange(fixes) * np.timedelta64(6, 'h')
+    # Bearing from north, wandering around north-west
+    bearing = np.radians(rng.uniform(290, 340)) + np.cumsum(rng.normal(0, 0.08, fixes))
+    step = rng.uniform(0.6, 1.4, fixes)
+    lat = rng.uniform(10, 20) + np.cumsum(step * np.cos(bearing))
+    lon = rng.uniform(130, 145) + np.cumsum(step * np.sin(bearing))
+    # Intensify to a peak around the middle of the track, then decay
+    phase = np.sin(np.linspace(0, np.pi, fixes))
+    wind = np.round(13 + phase * rng.uniform(20, 45)).astype(int)
+    pressure = np.round(1005 - (wind - 13) * 1.6).astype(int)
+    return times, np.clip(lat, 0, 60), np.clip(lon, 100, 180), pressure, wind
+
+
+def write_best_track(path, storms, fixes=66, year=2023, seed=0):
+    """Write a CMA best-track file of storms tracks with about fixes records each"""
+    rng = np.random.default_rng(seed)
+    season = np.datetime64(f'{year}-06-01T00', 'h')
+    with open(path, 'w') as f:
+        for i in range(storms):
+            count = max(2, int(rng.integers(fixes // 2, fixes * 3 // 2 + 1)))
+            start = season + np.timedelta64(int(rng.integers(0, 120)) * 24, 'h')
+            times, lat, lon, pressure, wind = storm_fixes(rng, count, start)
+            number = f'{year % 100:02d}{(i + 1) % 100:02d}'
+            # The serial doubles as the storm id so ids stay unique past 99 storms
+            f.write(f'66666 {number} {count:4d} {i + 1:04d} {i + 1:04d} 0 6 '
+                    f'SYN{i:05d}{"":28s}20240322\n')
+            stamps = np.datetime_as_string(times, unit='h')
+            for stamp, la, lo, p, w in zip(stamps, lat, lon, pressure, wind):
+                time = stamp.replace('-', '').replace('T', '')
+                grade = 1 + min(int(w) // 10, 5)
+                f.write(f'{time} {grade} {round(la * 10):3d} {round(lo * 10):4d} {p:4d}'
+                        f'      {w:2d}\n')
+    return storms
@@ -0,0 +1,117 @@
+"""Cached raster background for the cartopy trajectory plots.
+
+Land, ocean, 50m coastlines, country borders and the 50m province lines
+are the same for every storm drawn over the same area, but cartopy reads,
+projects and rasterizes the Natural Earth shapes again for every figure.
+Here the background is drawn once per (extent, projection, dpi, figsize)
+into an RGBA image that each plot then shows with a single imshow under
+its track.
+
+Images are memoized per process and written as PNG to the shared cache
+directory (common.data_access), so later runs and the worker processes
+of a batch reuse them. With snap, extents are widened to a grid of that
+many degrees so storms over roughly the same area share one image.
+"""
+import math
+import os
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import matplotlib.image as mimage
+import cartopy.crs as ccrs
+import cartopy.feature as cfeature
+
+from common import data_access, instrument
+
+# Bump when add_geography draws something different
+BASEMAP_VERSION = 1
+
+_memo = {}
+
+
+def add_geography(ax):
+    """Natural Earth background of the trajectory plot, as vector features"""
+    ax.add_feature(cfeature.LAND, facecolor='#f0f0f0')
+    ax.add_feature(cfeature.OCEAN, facecolor='#e0f3ff')
+    ax.add_feature(cfeature.COASTLINE.with_scale('50m'), linewidth=0.8)
+    ax.add_feature(cfeature.BORDERS, linestyle=':', linewidth=0.5)
+
+    # Provincial borders
+    province_borders = cfeature.NaturalEarthFeature(
+        category='cultural',
+        name='admin_1_states_provinces_lines',
+        scale='50m',
+        facecolor='none'
+    )
+    ax.add_feature(province_borders, edgecolor='gray', linewidth=0.5)
+
+
+def snap_extent(extent, snap):
+    """Widen (x0, x1, y0, y1) outward to multiples of snap degrees"""
+    x0, x1, y0, y1 = extent
+    if not snap:
+        return tuple(float(v) for v in extent)
+    return (math.floor(x0 / snap) * snap, math.ceil(x1 / snap) * snap,
+            math.floor(y0 / snap) * snap, math.ceil(y1 / snap) * snap)
+
+
+def render_basemap(extent, projection, figsize, dpi):
+    """RGBA uint8 image of the background over extent, figsize * dpi pixels.
+
+    extent is (x0, x1, y0, y1) in the coordinates of projection.
+    """
+    fig = Figure(figsize=figsize, dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1], projection=projection)
+    ax.set_extent(extent, crs=projection)
+    # Fill the whole image; imshow maps it back onto the extent
+    ax.set_aspect('auto')
+    ax.spines['geo'].set_visible(False)
+    ax.patch.set_visible(False)
+    add_geography(ax)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).copy()
+
+
+def load_basemap(extent, projection=None, figsize=(10, 6), dpi=300):
+    """Background image for extent, rendered once and then served from the caches"""
+    projection = projection or ccrs.PlateCarree()
+    params = (tuple(round(v, 6) for v in extent), projection.proj4_init,
+              tuple(figsize), dpi, BASEMAP_VERSION)
+    if params in _memo:
+        return _memo[params]
+
+    cache_dir = data_access.cache_dir()
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, f'basemap-{data_access.digest(repr(params))}.png')
+        if os.path.exists(cache_path):
+            _memo[params] = (mimage.imread(cache_path) * 255).round().astype(np.uint8)
+            return _memo[params]
+
+    with instrument.span('render_basemap', extent=str(params[0]), dpi=dpi):
+        image = render_basemap(extent, projection, figsize, dpi)
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Batch workers may race to write the same image; the last rename wins
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp.png'
+        mimage.imsave(tmp_path, image)
+        os.replace(tmp_path, cache_path)
+    _memo[params] = image
+    return image
+
+
+def draw_basemap(ax, figsize, dpi, snap=None, zorder=0):
+    """Show the cached background under everything else in a GeoAxes.
+
+    The extent is the current view of ax (set_extent or set_xlim/set_ylim,
+    in the coordinates of its projection), which is kept as it is.
+    """
+    xlim, ylim = ax.get_xlim(), ax.get_ylim()
+    extent = snap_extent(xlim + ylim, snap)
+    image = load_basemap(extent, ax.projection, figsize, dpi)
+    ax.imshow(image, extent=extent, transform=ax.projection, origin='upper',
+              interpolation='antialiased', zorder=zorder)
+    ax.set_xlim(xlim)
+    ax.set_ylim(ylim)
@@ -0,0 +1,212 @@
+"""CMA best-track archive parser with a columnar, memory-mappable store.
+
+A CMA best-track file is a sequence of storms, each introduced by a header
+
+    66666 2306   66 0007 2306 0 6 KHANUN                             20240322
+
+(international number, record count, serial, Chinese id, end flag, interval
+hours, name, revision date) followed by one line per fix:
+
+    2023072606 1  88 1415 1002      13
+
+(time, grade, lat*10, lon*10, pressure hPa, wind m/s).
+
+parse_archive decodes all fixes of all storms straight into typed NumPy
+columns. An archive is a plain dict of arrays:
+
+    storm_id, intl_id, name   one entry per storm
+    start, count              slice of each storm in the record columns
+    time, lat, lon, pressure, wind, grade
+                              one entry per fix, storms back to back
+
+save_archive writes it as a directory of .npy files that load_archive maps
+back into memory, so decades of storms open in milliseconds.
+"""
+import io
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from common import data_access
+
+HEADER = '66666'
+RECORD_COLUMNS = ('time', 'grade', 'lat', 'lon', 'pressure', 'wind')
+STORM_COLUMNS = ('storm_id', 'intl_id', 'name', 'start', 'count')
+COLUMNS = STORM_COLUMNS + RECORD_COLUMNS
+STORE_VERSION = 1
+
+
+def decode_time(stamps):
+    """YYYYMMDDHH integers to datetime64[h]"""
+    stamps = np.asarray(stamps, dtype=np.int64)
+    year, rest = np.divmod(stamps, 1000000)
+    month, rest = np.divmod(rest, 10000)
+    day, hour = np.divmod(rest, 100)
+    months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    return (months.astype('datetime64[h]')
+            + ((day - 1) * 24 + hour).astype('timedelta64[h]'))
+
+
+def _parse_header(line, index):
+    parts = line.split()
+    return (
+        parts[4] if len(parts) > 4 else str(index),
+        parts[1] if len(parts) > 1 else '',
+        # The name is absent for unnamed storms, leaving only the date
+        parts[7] if len(parts) > 8 else ''
+    )
+
+
+def parse_archive(text):
+    """Decode the text of a best-track file into an archive dict"""
+    lines = text.splitlines()
+    headers, counts, records = [], [], []
+    for line in lines:
+        if line.startswith(HEADER):
+            headers.append(_parse_header(line, len(headers)))
+            counts.append(0)
+        elif line.strip():
+            if not headers:
+                headers.append(_parse_header('', 0))
+                counts.append(0)
+            counts[-1] += 1
+            records.append(line)
+
+    # Newer files append an OWD column; only the first six are used
+    table = pd.read_csv(
+        io.StringIO('\n'.join(records)), sep=r'\s+', header=None,
+        names=list(range(7)), dtype=np.float64
+    ) if records else pd.DataFrame(np.zeros((0, 7)))
+    values = table.to_numpy()[:, :6]
+
+    counts = np.asarray(counts, dtype=np.int32)
+    ids, intl_ids, names = zip(*headers) if headers else ((), (), ())
+    return {
+        'storm_id': np.asarray(ids, dtype='U8'),
+        'intl_id': np.asarray(intl_ids, dtype='U8'),
+        'name': np.asarray(names, dtype='U24'),
+        'start': np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64),
+        'count': counts,
+        'time': decode_time(values[:, 0]),
+        'grade': values[:, 1].astype(np.int8),
+        'lat': (values[:, 2] / 10).astype(np.float32),
+        'lon': (values[:, 3] / 10).astype(np.float32),
+        'pressure': values[:, 4].astype(np.int16),
+        'wind': values[:, 5].astype(np.int16),
+    }
+
+
+def read_archive(*paths):
+    """Parse one or more best-track files into a single archive"""
+    archives = []
+    for path in paths:
+        with open(path, 'r') as f:
+            archives.append(parse_archive(f.read()))
+    return concat_archives(archives)
+
+
+def concat_archives(archives):
+    """Join archives back to back, fixing up the storm offsets"""
+    if len(archives) == 1:
+        return archives[0]
+    merged = {key: np.concatenate([a[key] for a in archives]) for key in COLUMNS}
+    merged['start'] = np.concatenate(([0], np.cumsum(merged['count'])[:-1])).astype(np.int64)
+    return merged
+
+
+def storm_count(archive):
+    return len(archive['storm_id'])
+
+
+def get_storm(archive, index):
+    """One storm as the dict the trajectory script plots"""
+    begin = int(archive['start'][index])
+    end = begin + int(archive['count'][index])
+    return {
+        'id': str(archive['storm_id'][index]),
+        'name': str(archive['name'][index]),
+        'times': archive['time'][begin:end].astype('datetime64[s]'),
+        # Fixes are stored in tenths of a degree
+        'lats': np.asarray(archive['lat'][begin:end], dtype=float).round(1),
+        'lons': np.asarray(archive['lon'][begin:end], dtype=float).round(1),
+        'winds': np.asarray(archive['wind'][begin:end], dtype=int),
+        'pressures': np.asarray(archive['pressure'][begin:end]),
+        'grades': np.asarray(archive['grade'][begin:end]),
+    }
+
+
+def find_storm(archive, key):
+    """Index of a storm by Chinese id, international number or name"""
+    key = str(key)
+    for column in ('storm_id', 'intl_id'):
+        hits = np.flatnonzero(archive[column] == key)
+        if len(hits):
+            return int(hits[0])
+    hits = np.flatnonzero(np.char.upper(archive['name']) == key.upper())
+    if len(hits):
+        return int(hits[0])
+    raise KeyError(key)
+
+
+def save_archive(archive, directory):
+    """Write one .npy file per column"""
+    os.makedirs(directory, exist_ok=True)
+    for key in COLUMNS:
+        np.save(os.path.join(directory, key + '.npy'), archive[key])
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({'version': STORE_VERSION, 'storms': storm_count(archive),
+                   'records': len(archive['time'])}, f)
+
+
+def load_archive(directory, mmap=True):
+    """Open a store written by save_archive, memory-mapped by default"""
+    with open(os.path.join(directory, 'meta.json')) as f:
+        if json.load(f)['version'] != STORE_VERSION:
+            raise ValueError(f'Unsupported track store version in {directory}')
+    mode = 'r' if mmap else None
+    return {key: np.load(os.path.join(directory, key + '.npy'), mmap_mode=mode)
+            for key in COLUMNS}
+
+
+def load_track_archive(*paths):
+    """Archive for the given track files, parsed once and then served from the store.
+
+    The store lives in the shared cache directory, keyed on the files'
+    (path, mtime, size). Defaults to the Khanun track file.
+    """
+    paths = paths or (data_access.data_path(data_access.KHANUN_TRACK),)
+    cache_dir = data_access.cache_dir()
+    if not cache_dir:
+        return read_archive(*paths)
+    key = repr([data_access.file_key(p) for p in paths] + [STORE_VERSION])
+    directory = os.path.join(cache_dir, 'tracks-' + data_access.digest(key))
+    if os.path.exists(os.path.join(directory, 'meta.json')):
+        return load_archive(directory)
+    archive = read_archive(*paths)
+    building = f'{directory}.{os.getpid()}.tmp'
+    try:
+        save_archive(archive, building)
+        os.replace(building, directory)
+    except OSError:
+        # Another process stored the same files first; use its store
+        if not os.path.exists(os.path.join(directory, 'meta.json')):
+            raise
+    finally:
+        shutil.rmtree(building, ignore_errors=True)
+    return load_archive(directory)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Convert CMA best-track files to a track store')
+    parser.add_argument('inputs', nargs='+')
+    parser.add_argument('--output', required=True, help='Directory of the track store')
+    args = parser.parse_args()
+
+    archive = read_archive(*args.inputs)
+    save_archive(archive, args.output)
+    print(f"{storm_count(archive)} storms, {len(archive['time'])} records -> {args.output}")
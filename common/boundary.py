@@ -0,0 +1,303 @@
+"""Simplified, quantized boundary layers for embedding in the maps.
+
+Ningbo.json carries 6-decimal coordinates and a dozen metadata fields per
+district, far more than a Leaflet overlay needs at any given zoom. This module
+simplifies the boundaries with Douglas-Peucker at a per-zoom tolerance,
+rounds the coordinates and keeps only the properties the maps use.
+
+Rings are split into arcs at the vertices where neighbouring districts meet,
+and each shared arc is simplified exactly once, so adjacent districts never
+open gaps or overlaps along their common border. The same arc table is used
+to emit TopoJSON.
+
+Results are cached on disk keyed on the SHA-1 of the source file and the
+simplification parameters, so every map generator reuses one computation.
+
+Usage (from the repository root):
+    python -m common.boundary output.json --zoom 9 [--topojson]
+"""
+import json
+import math
+import os
+
+import numpy as np
+
+from common import data_access, instrument
+
+# Properties kept on every feature (GeoJsonTooltip uses 'name')
+KEEP_PROPERTIES = ('adcode', 'name', 'level')
+
+_memo = {}
+
+
+def zoom_tolerance(zoom):
+    """Width of one screen pixel in degrees at the given web-map zoom"""
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def zoom_precision(tolerance):
+    """Decimal places needed to keep rounding error well under the tolerance"""
+    return max(0, math.ceil(-math.log10(tolerance)) + 1)
+
+
+def douglas_peucker(points, tolerance, keep_apex=False):
+    """Indexes of the points kept when simplifying an open polyline.
+
+    With keep_apex the point farthest from the end chord is always kept, so
+    an arc never collapses to a straight segment.
+    """
+    n = len(points)
+    if n < 3:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    first = True
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = points[start], points[end]
+        inner = points[start + 1:end]
+        ab = b - a
+        norm = math.hypot(ab[0], ab[1])
+        if norm == 0:
+            dist = np.hypot(inner[:, 0] - a[0], inner[:, 1] - a[1])
+        else:
+            dist = np.abs(ab[0] * (inner[:, 1] - a[1]) - ab[1] * (inner[:, 0] - a[0])) / norm
+        i = int(dist.argmax())
+        if dist[i] > tolerance or (first and keep_apex):
+            mid = start + 1 + i
+            keep[mid] = True
+            stack.append((start, mid))
+            stack.append((mid, end))
+        first = False
+    return np.flatnonzero(keep)
+
+
+def ring_area(coords):
+    """Unsigned shoelace area of a closed ring, in square degrees"""
+    x, y = coords[:, 0], coords[:, 1]
+    return abs(float(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]))) / 2
+
+
+def _polygons(geometry):
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    return geometry['coordinates']
+
+
+def build_arcs(geojson):
+    """Split every ring into arcs at the vertices shared between rings.
+
+    Returns (arcs, shapes): arcs is a list of (n, 2) arrays, each shared arc
+    stored once; shapes mirrors the features as polygons -> rings -> lists
+    of (arc_index, reversed) references.
+    """
+    rings = []
+    for feature in geojson['features']:
+        for polygon in _polygons(feature['geometry']):
+            for ring in polygon:
+                coords = [tuple(pt) for pt in ring]
+                if len(coords) > 1 and coords[0] == coords[-1]:
+                    coords = coords[:-1]
+                rings.append(coords)
+
+    # Which rings each vertex belongs to
+    owners = {}
+    for ring_id, coords in enumerate(rings):
+        for pt in coords:
+            owners.setdefault(pt, set()).add(ring_id)
+
+    arcs, arc_index = [], {}
+
+    def add_arc(chain):
+        backward = chain[::-1]
+        reverse = backward < chain
+        key = tuple(backward if reverse else chain)
+        if key not in arc_index:
+            arc_index[key] = len(arcs)
+            arcs.append(np.array(key, dtype=float))
+        return arc_index[key], reverse
+
+    ring_arcs = []
+    for coords in rings:
+        n = len(coords)
+        sigs = [frozenset(owners[pt]) for pt in coords]
+        junctions = [
+            i for i in range(n)
+            if len(sigs[i]) > 2 or sigs[i] != sigs[i - 1] or sigs[i] != sigs[(i + 1) % n]
+        ]
+        if not junctions:
+            # Closed ring touching nobody: one closed arc starting at its minimum
+            start = min(range(n), key=coords.__getitem__)
+            junctions = [start]
+        refs = []
+        for k, start in enumerate(junctions):
+            end = junctions[(k + 1) % len(junctions)]
+            if end <= start:
+                end += n
+            chain = [coords[i % n] for i in range(start, end + 1)]
+            refs.append(add_arc(chain))
+        ring_arcs.append(refs)
+
+    shapes, pos = [], 0
+    for feature in geojson['features']:
+        polygons = []
+        for polygon in _polygons(feature['geometry']):
+            polygons.append(ring_arcs[pos:pos + len(polygon)])
+            pos += len(polygon)
+        shapes.append(polygons)
+    return arcs, shapes
+
+
+def _simplify_arc(arc, tolerance, keep_apex):
+    if len(arc) > 2 and np.array_equal(arc[0], arc[-1]):
+        # Closed arc: split at the point farthest from its start
+        far = int(np.hypot(*(arc - arc[0]).T).argmax())
+        head = douglas_peucker(arc[:far + 1], tolerance, True)
+        tail = douglas_peucker(arc[far:], tolerance, True) + far
+        return arc[np.concatenate((head, tail[1:]))]
+    return arc[douglas_peucker(arc, tolerance, keep_apex)]
+
+
+def _dedupe(coords):
+    if len(coords) < 2:
+        return coords
+    step = np.any(coords[1:] != coords[:-1], axis=1)
+    return coords[np.concatenate(([True], step))]
+
+
+def _ring_coords(refs, arcs):
+    parts = []
+    for k, (index, reverse) in enumerate(refs):
+        arc = arcs[index][::-1] if reverse else arcs[index]
+        parts.append(arc if k == 0 else arc[1:])
+    return np.concatenate(parts)
+
+
+def simplify(geojson, tolerance, precision=None, keep_properties=KEEP_PROPERTIES,
+             topojson=False):
+    """Simplify a FeatureCollection of (Multi)Polygons.
+
+    Polygons smaller than tolerance² (islets invisible at this zoom) are
+    dropped, except the largest polygon of each feature. Returns GeoJSON, or
+    TopoJSON with one object named 'boundary' when topojson is true.
+    """
+    if precision is None:
+        precision = zoom_precision(tolerance)
+    arcs, shapes = build_arcs(geojson)
+
+    # Rings made of fewer than three arcs must keep an apex on each arc
+    short = {index for polygons in shapes for polygon in polygons
+             for refs in polygon if len(refs) < 3 for index, _ in refs}
+    simple = [
+        _dedupe(np.round(_simplify_arc(arc, tolerance, i in short), precision))
+        for i, arc in enumerate(arcs)
+    ]
+
+    features, geometries = [], []
+    for feature, polygons in zip(geojson['features'], shapes):
+        areas = [ring_area(_ring_coords(polygon[0], arcs)) for polygon in polygons]
+        largest = int(np.argmax(areas))
+        kept = []
+        for k, polygon in enumerate(polygons):
+            if k != largest and areas[k] < tolerance ** 2:
+                continue
+            rings = [refs for refs in polygon
+                     if len(_dedupe(_ring_coords(refs, simple))) >= 4]
+            if rings and rings[0] is polygon[0]:
+                kept.append(rings)
+        properties = {key: feature['properties'][key]
+                      for key in keep_properties if key in feature['properties']}
+        if topojson:
+            geometries.append({
+                'type': 'MultiPolygon',
+                'arcs': [[[i if not rev else ~i for i, rev in refs] for refs in rings]
+                         for rings in kept],
+                'properties': properties
+            })
+        else:
+            coordinates = [[_dedupe(_ring_coords(refs, simple)).tolist() for refs in rings]
+                           for rings in kept]
+            features.append({
+                'type': 'Feature',
+                'properties': properties,
+                'geometry': {'type': 'MultiPolygon', 'coordinates': coordinates}
+            })
+
+    if not topojson:
+        return {'type': 'FeatureCollection', 'features': features}
+    return _topology(simple, geometries, precision)
+
+
+def _topology(arcs, geometries, precision):
+    """Quantized, delta-encoded TopoJSON topology"""
+    points = np.concatenate(arcs)
+    origin = points.min(axis=0)
+    scale = 10.0 ** -precision
+    encoded = []
+    for arc in arcs:
+        grid = np.rint((arc - origin) / scale).astype(np.int64)
+        encoded.append(np.concatenate((grid[:1], np.diff(grid, axis=0))).tolist())
+    return {
+        'type': 'Topology',
+        'transform': {'scale': [scale, scale], 'translate': origin.tolist()},
+        'objects': {'boundary': {'type': 'GeometryCollection', 'geometries': geometries}},
+        'arcs': encoded
+    }
+
+
+def load_simplified_boundary(zoom=None, tolerance=None, precision=None,
+                             topojson=False, path=None):
+    """Ningbo.json simplified for display up to the given zoom level.
+
+    Pass either zoom (one pixel of tolerance at that zoom) or an explicit
+    tolerance in degrees. The result is computed once per source file
+    content and parameters, then served from memory or the on-disk cache.
+    The returned dict is shared; treat it as read-only.
+    """
+    path = path or data_access.data_path(data_access.BOUNDARY_JSON)
+    if tolerance is None:
+        tolerance = zoom_tolerance(12 if zoom is None else zoom)
+    if precision is None:
+        precision = zoom_precision(tolerance)
+    params = (data_access.file_digest(path), tolerance, precision, topojson, KEEP_PROPERTIES)
+    if params in _memo:
+        return _memo[params]
+
+    cache_dir = data_access.cache_dir()
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, f'boundary-{data_access.digest(repr(params))}.json')
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                _memo[params] = json.load(f)
+            return _memo[params]
+
+    with instrument.span('simplify_boundary', tolerance=tolerance, topojson=topojson):
+        result = simplify(data_access.load_boundary(path), tolerance, precision,
+                          topojson=topojson)
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(cache_path + '.tmp', cache_path)
+    _memo[params] = result
+    return result
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Write a simplified copy of Ningbo.json')
+    parser.add_argument('output')
+    parser.add_argument('--zoom', type=int, default=12)
+    parser.add_argument('--precision', type=int, default=None)
+    parser.add_argument('--topojson', action='store_true')
+    args = parser.parse_args()
+
+    result = load_simplified_boundary(zoom=args.zoom, precision=args.precision,
+                                      topojson=args.topojson)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, separators=(',', ':'))
@@ -0,0 +1,234 @@
+"""Incremental rebuild of the maps: only regenerate what changed.
+
+Each target is one visualization script with its outputs and the data
+files it reads. Its fingerprint hashes the script, the shared common/
+code (which also carries the style parameters of the scripts), the
+arguments it is run with and the contents of its input files: the impact
+CSV, the track file and Ningbo.json. Fingerprints are kept in
+<output dir>/.build-manifest.json; a target whose fingerprint and outputs
+are unchanged is skipped.
+
+When only rows were added to the end of typhoon_data.csv, appendable
+targets add the features of the new rows to their existing page instead
+of rebuilding it: the interactive map is streamed with a marker after its
+last feature, and the TimestampedGeoJson slider picks up any new days.
+
+Usage (from the repository root):
+    python -m common.build                      # every target
+    python -m common.build interactive --force
+    python -m common.build duration_lines --args duration_lines "--render tiles"
+"""
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+
+import pandas as pd
+
+from common import data_access
+from common.data_access import BOUNDARY_JSON, IMPACT_CSV, KHANUN_TRACK, ROOT, file_digest
+
+MANIFEST = '.build-manifest.json'
+
+TARGETS = {
+    'interactive': {
+        'script': 'Interactive spatiotemporal mapping of disaster locations/'
+                  'Interactive spatiotemporal mapping of disaster locations.py',
+        'outputs': ['Interactive spatiotemporal mapping of disaster locations.html'],
+        'inputs': [IMPACT_CSV, BOUNDARY_JSON, KHANUN_TRACK],
+        # Streamed pages can be appended to, unless the arguments select
+        # rows or change the features (the script rejects --append-after then)
+        'args': ['--stream'],
+        'append': True,
+        'append_blocking_args': ['--near-track', '--lazy-popups', '--intervals', '--categories',
+                                 '--admin-level', '--start', '--end', '--bbox'],
+    },
+    'trajectories': {
+        'script': 'Spatiotemporal visualization of typhoon trajectories/'
+                  'Spatiotemporal visualization of typhoon trajectories.py',
+        'outputs': ['enhanced_typhoon_path.png'],
+        'inputs': [KHANUN_TRACK],
+        'args': [],
+    },
+    'duration_lines': {
+        'script': 'Visualization of Disaster Impact Duration/'
+                  'Visualization of Disaster Impact Duration(have connection lines, location marking).py',
+        'outputs': ['Visualization of Disaster Impact Duration(have connection lines, location marking).html'],
+        # The track is read for --color-by exposure
+        'inputs': [IMPACT_CSV, BOUNDARY_JSON, KHANUN_TRACK],
+        'args': [],
+    },
+    'duration': {
+        'script': 'Visualization of Disaster Impact Duration/'
+                  'Visualization of Disaster Impact Duration(No connection lines, location marking).py',
+        'outputs': ['Visualization of Disaster Impact Duration(No connection lines, location marking).html'],
+        'inputs': [IMPACT_CSV, BOUNDARY_JSON, KHANUN_TRACK],
+        'args': [],
+    },
+    'filtering': {
+        'script': 'Multidimensional Filtering of Affected Locations and Interactive Map Visualization/'
+                  'Multidimensional Filtering of Affected Locations and Interactive Map Visualization.py',
+        'outputs': ['typhoon_map/index.html', 'typhoon_map/data.bin', 'typhoon_map/ningbo.json'],
+        'inputs': [IMPACT_CSV, BOUNDARY_JSON],
+        'args': [],
+    },
+}
+
+
+def code_digest():
+    """Hash of the shared common/ sources"""
+    sha1 = hashlib.sha1()
+    directory = os.path.join(ROOT, 'common')
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.py'):
+            sha1.update(name.encode('utf-8'))
+            sha1.update(file_digest(os.path.join(directory, name)).encode('ascii'))
+    return sha1.hexdigest()
+
+
+def fingerprint(target, args, code, skip=()):
+    """Hash of everything a target's outputs depend on, minus the inputs in skip"""
+    spec = TARGETS[target]
+    parts = {
+        'script': file_digest(os.path.join(ROOT, spec['script'])),
+        'common': code,
+        'args': args,
+        'inputs': {name: file_digest(data_access.data_path(name))
+                   for name in spec['inputs'] if name not in skip},
+    }
+    return data_access.digest(json.dumps(parts, sort_keys=True))
+
+
+def csv_state(path):
+    """Size, SHA-1 and row count of the impact CSV"""
+    return {
+        'size': os.path.getsize(path),
+        'sha1': file_digest(path),
+        'rows': len(pd.read_csv(path, usecols=[0])),
+    }
+
+
+def _prefix_digest(path, size):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        remaining = size
+        while remaining:
+            block = f.read(min(remaining, 1 << 20))
+            if not block:
+                break
+            sha1.update(block)
+            remaining -= len(block)
+    return sha1.hexdigest()
+
+
+def appended_rows(old, path):
+    """Row count of old if the CSV at path is old plus rows added at the end, else None"""
+    size = os.path.getsize(path)
+    if size <= old['size']:
+        return None
+    with open(path, 'rb') as f:
+        # The last old row must be complete, or the first new bytes extend it
+        f.seek(old['size'] - 1)
+        if f.read(1) != b'\n':
+            return None
+    if _prefix_digest(path, old['size']) != old['sha1']:
+        return None
+    return old['rows']
+
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def can_append(target, args):
+    """Whether a target run with args can add rows to its existing outputs"""
+    spec = TARGETS[target]
+    blocking = set(spec.get('append_blocking_args', ()))
+    return spec.get('append', False) and not any(arg.split('=', 1)[0] in blocking
+                                                 for arg in args)
+
+
+def run_script(target, args, output_dir):
+    """Run a target's script with output_dir as working directory"""
+    env = dict(os.environ, MPLBACKEND='Agg',
+               TYPHOON_DATA_ROOT=os.path.dirname(data_access.data_path(IMPACT_CSV)))
+    if data_access.cache_dir():
+        env['TYPHOON_CACHE_DIR'] = os.path.abspath(data_access.cache_dir())
+    script = os.path.join(ROOT, TARGETS[target]['script'])
+    subprocess.run([sys.executable, script] + args, cwd=output_dir, env=env, check=True)
+
+
+def build(targets=None, output_dir='.', force=False, extra_args=None):
+    """Bring the outputs of targets up to date; returns {target: action}.
+
+    action is 'built', 'appended' or 'up to date'.
+    """
+    targets = targets or list(TARGETS)
+    extra_args = extra_args or {}
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    code = code_digest()
+    csv_path = data_access.data_path(IMPACT_CSV)
+    results = {}
+    for target in targets:
+        spec = TARGETS[target]
+        args = spec['args'] + extra_args.get(target, [])
+        entry = {'fingerprint': fingerprint(target, args, code)}
+        uses_csv = IMPACT_CSV in spec['inputs']
+        if uses_csv:
+            entry['base'] = fingerprint(target, args, code, skip=(IMPACT_CSV,))
+            entry['csv'] = csv_state(csv_path)
+        old = manifest.get(target, {})
+        complete = all(os.path.exists(os.path.join(output_dir, name)) for name in spec['outputs'])
+        if not force and complete and old.get('fingerprint') == entry['fingerprint']:
+            results[target] = 'up to date'
+            continue
+        skip = None
+        if (not force and complete and can_append(target, args) and uses_csv
+                and old.get('base') == entry['base'] and 'csv' in old):
+            skip = appended_rows(old['csv'], csv_path)
+        if skip is not None:
+            run_script(target, args + ['--append-after', str(skip)], output_dir)
+            results[target] = 'appended'
+        else:
+            run_script(target, args, output_dir)
+            results[target] = 'built'
+        manifest[target] = entry
+        save_manifest(output_dir, manifest)
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Regenerate the maps whose inputs changed')
+    parser.add_argument('targets', nargs='*', metavar='TARGET',
+                        help='Targets to build (default: all of ' + ', '.join(TARGETS) + ')')
+    parser.add_argument('--output-dir', default='.', help='Where the outputs are written')
+    parser.add_argument('--force', action='store_true', help='Rebuild even if nothing changed')
+    parser.add_argument('--args', nargs=2, action='append', default=[], metavar=('TARGET', 'ARGS'),
+                        help='Extra arguments for a target\'s script, e.g. --args duration "--render tiles"')
+    args = parser.parse_args()
+    extra = {}
+    for target in args.targets:
+        if target not in TARGETS:
+            parser.error(f'unknown target {target}')
+    for target, value in args.args:
+        if target not in TARGETS:
+            parser.error(f'unknown target {target}')
+        extra.setdefault(target, []).extend(shlex.split(value))
+    for target, action in build(args.targets, args.output_dir, args.force, extra).items():
+        print(f'{target}: {action}')
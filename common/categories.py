@@ -0,0 +1,69 @@
+"""Impact-category bitmasks and inverted index.
+
+The categories column of typhoon_data.csv holds a comma-separated list such
+as "Population,Service Industry  ". Each row is packed into one integer
+with bit i set when the row lists CATEGORIES[i], so "does the row match
+any of the selected categories" is a single bitwise AND. The inverted
+index lists, per category, the rows that carry it, in CSR layout:
+
+    rows[offsets[i]:offsets[i + 1]]   sorted ids of the rows in category i
+"""
+import numpy as np
+
+CATEGORIES = (
+    "Population",
+    "Infrastructure",
+    "Buildings",
+    "Industry",
+    "Public Services",
+    "Agriculture and Fishery",
+    "Service Industry",
+    "Land Resources",
+    "Ecological Resources",
+    "Water Resources",
+    "Biological Resources",
+    "Mineral Resources",
+)
+
+MASK_DTYPE = np.uint16
+
+
+def category_masks(values, categories=CATEGORIES):
+    """One bitmask per row of comma-separated category lists.
+
+    values is a pandas Series; unknown names and missing values add no bits.
+    """
+    bits = {name: 1 << i for i, name in enumerate(categories)}
+    names = values.fillna('').astype(str).str.split(',').explode().str.strip()
+    row_bits = names.map(bits).fillna(0).to_numpy(dtype=np.int64)
+    # explode repeats the row label; turn it into row positions
+    counts = values.fillna('').astype(str).str.count(',').to_numpy() + 1
+    positions = np.repeat(np.arange(len(values)), counts)
+    masks = np.zeros(len(values), dtype=np.int64)
+    np.bitwise_or.at(masks, positions, row_bits)
+    return masks.astype(MASK_DTYPE)
+
+
+def inverted_index(masks, ncategories=len(CATEGORIES)):
+    """Rows of every category as (offsets, rows) in CSR layout"""
+    masks = np.asarray(masks)
+    lists = [np.flatnonzero(masks & (1 << i)) for i in range(ncategories)]
+    offsets = np.concatenate(([0], np.cumsum([len(rows) for rows in lists])))
+    rows = np.concatenate(lists) if lists else np.zeros(0, dtype=np.int64)
+    return offsets.astype(np.uint32), rows.astype(np.uint32)
+
+
+def selection_mask(selected, categories=CATEGORIES):
+    """Bitmask of the selected category names"""
+    mask = 0
+    for name in selected:
+        mask |= 1 << categories.index(name)
+    return mask
+
+
+def filter_rows(masks, selected, categories=CATEGORIES):
+    """Ids of the rows in any of the selected categories (all rows if none)"""
+    mask = selection_mask(selected, categories)
+    if not mask:
+        return np.arange(len(masks))
+    return np.flatnonzero(np.asarray(masks) & mask)
@@ -0,0 +1,164 @@
+"""Shared, cached access to the files under data/.
+
+Every visualization loads typhoon_data.csv and Ningbo.json through this
+module instead of re-opening hard-coded paths. Results are memoized per
+process, keyed on (path, mtime, size), and the parsed impact table is also
+pickled to an on-disk cache so warm runs skip CSV date parsing entirely.
+
+The data root defaults to the repository's data/ directory and can be
+changed with the TYPHOON_DATA_ROOT environment variable or set_data_root().
+"""
+import hashlib
+import json
+import os
+import pickle
+
+import pandas as pd
+
+from common import instrument
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPACT_CSV = 'typhoon_data.csv'
+BOUNDARY_JSON = 'Ningbo.json'
+KHANUN_TRACK = 'Track data of Typhoon Khanun.txt'
+
+# Bump when the derived columns of the impact table change
+CACHE_VERSION = 1
+
+_data_root = os.environ.get('TYPHOON_DATA_ROOT', os.path.join(ROOT, 'data'))
+_cache_dir = os.environ.get('TYPHOON_CACHE_DIR', os.path.join(ROOT, '.cache'))
+_memo = {}
+
+
+def set_data_root(path):
+    """Point every loader at another data directory"""
+    global _data_root
+    _data_root = path
+
+
+def set_cache_dir(path):
+    """Move the on-disk cache; None disables it"""
+    global _cache_dir
+    _cache_dir = path
+
+
+def cache_dir():
+    """Directory of the on-disk cache, or None when disabled"""
+    return _cache_dir
+
+
+def data_path(name):
+    """Absolute path of a file in the data root"""
+    return os.path.join(_data_root, name)
+
+
+def file_key(path):
+    """Identity of a file's current contents: (path, mtime, size)"""
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_mtime_ns, st.st_size
+
+
+def clear_cache(disk=False):
+    """Drop memoized results, and optionally the on-disk cache files"""
+    _memo.clear()
+    if disk and _cache_dir and os.path.isdir(_cache_dir):
+        for name in os.listdir(_cache_dir):
+            if name.endswith('.pkl'):
+                os.remove(os.path.join(_cache_dir, name))
+
+
+def _memoized(kind, path, build):
+    key = (kind,) + file_key(path)
+    if key not in _memo:
+        # Keep only the latest version of each file
+        for old in [k for k in _memo if k[:2] == key[:2]]:
+            del _memo[old]
+        _memo[key] = build(key)
+    return _memo[key]
+
+
+def digest(text):
+    """Short stable hash used to name cache entries"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def file_digest(path):
+    """SHA-1 of a file's contents"""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _disk_cache_prefix(key):
+    """Name prefix shared by the cache files of every version of one file"""
+    return f'{key[0]}-{digest(key[1])}-'
+
+
+def _disk_cache_path(key):
+    name = _disk_cache_prefix(key) + digest(repr(key + (CACHE_VERSION,))) + '.pkl'
+    return os.path.join(_cache_dir, name)
+
+
+def _prune_disk_cache(key):
+    """Remove the cache files of older versions of key's file"""
+    prefix = _disk_cache_prefix(key)
+    keep = os.path.basename(_disk_cache_path(key))
+    for name in os.listdir(_cache_dir):
+        if name.startswith(prefix) and name.endswith('.pkl') and name != keep:
+            try:
+                os.remove(os.path.join(_cache_dir, name))
+            except OSError:
+                pass
+
+
+def _read_impact_table(path):
+    with instrument.span('read_csv', path=os.path.basename(path)):
+        df = pd.read_csv(path, parse_dates=['start_date', 'end_date'])
+    instrument.count('rows_read', len(df))
+    df['duration'] = (df['end_date'] - df['start_date']).dt.days + 1
+    df['Impact Days'] = df['duration']
+    return df
+
+
+def _build_impact_table(key):
+    path = key[1]
+    if not _cache_dir:
+        return _read_impact_table(path)
+    cache_path = _disk_cache_path(key)
+    try:
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+    df = _read_impact_table(path)
+    os.makedirs(_cache_dir, exist_ok=True)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+    _prune_disk_cache(key)
+    return df
+
+
+def load_impact_table(path=None):
+    """typhoon_data.csv with parsed dates and the derived duration columns.
+
+    Both ``duration`` and ``Impact Days`` hold end_date - start_date + 1.
+    A copy is returned, so callers may add columns or filter freely.
+    """
+    path = path or data_path(IMPACT_CSV)
+    return _memoized('impact', path, _build_impact_table).copy()
+
+
+def load_boundary(path=None):
+    """Parsed Ningbo.json. The returned dict is shared; treat it as read-only."""
+    path = path or data_path(BOUNDARY_JSON)
+
+    def build(key):
+        with instrument.span('load_boundary'), open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    return _memoized('boundary', path, build)
@@ -0,0 +1,174 @@
+"""Assignment of affected locations to the districts of Ningbo.json.
+
+Every district MultiPolygon is prepared once into a flat edge table
+(x0, y0, x1, y1 per ring segment, holes included) and a band index: the
+district's latitude range is cut into horizontal bands and each band lists
+the edges whose latitude span overlaps it, in CSR layout
+
+    edges[offsets[b]:offsets[b + 1]]   edges crossing band b
+
+A point lies inside a district when a ray cast eastward from it crosses
+an odd number of the district's edges, and only edges in the point's band
+can be crossed. assign_districts prefilters the points by district
+bounding box, pairs every candidate with the edges of its band and counts
+the crossings with one vectorized test over the pairs, in chunks of at
+most chunk_pairs pairs. Work per point is the handful of edges near its
+latitude rather than every vertex of the boundary.
+
+Rings are closed and tested with the even-odd rule, so holes and
+multi-part districts need no special handling. Points on a shared border
+go to whichever of the districts comes first.
+"""
+import numpy as np
+import pandas as pd
+
+from common import data_access, instrument
+from common.boundary import _polygons
+from common.spatial import CHUNK_PAIRS, _expand
+
+# Target number of edges per band
+EDGES_PER_BAND = 4
+MAX_BANDS = 4096
+
+_memo = {}
+
+
+def _edges(geometry):
+    """(x0, y0, x1, y1) of every ring segment of a Polygon or MultiPolygon"""
+    parts = []
+    for polygon in _polygons(geometry):
+        for ring in polygon:
+            ring = np.asarray(ring, dtype=float)[:, :2]
+            if len(ring) < 3:
+                continue
+            if not np.array_equal(ring[0], ring[-1]):
+                ring = np.vstack([ring, ring[:1]])
+            parts.append(np.hstack([ring[:-1], ring[1:]]))
+    if not parts:
+        return np.zeros((0, 4))
+    edges = np.vstack(parts)
+    # Horizontal edges are never crossed by a horizontal ray
+    return edges[edges[:, 1] != edges[:, 3]]
+
+
+def prepare_district(feature):
+    """Edge table, band index and bounding box of one GeoJSON feature"""
+    properties = feature.get('properties') or {}
+    edges = _edges(feature['geometry'])
+    ylo = np.minimum(edges[:, 1], edges[:, 3])
+    yhi = np.maximum(edges[:, 1], edges[:, 3])
+    if len(edges):
+        bbox = (float(min(edges[:, 0].min(), edges[:, 2].min())), float(ylo.min()),
+                float(max(edges[:, 0].max(), edges[:, 2].max())), float(yhi.max()))
+    else:
+        bbox = (np.inf, np.inf, -np.inf, -np.inf)
+    nbands = int(np.clip(len(edges) // EDGES_PER_BAND, 1, MAX_BANDS))
+    height = max((bbox[3] - bbox[1]) / nbands, 1e-12) if len(edges) else 1.0
+
+    first = np.clip(((ylo - bbox[1]) / height).astype(np.int64), 0, nbands - 1)
+    last = np.clip(((yhi - bbox[1]) / height).astype(np.int64), 0, nbands - 1)
+    counts = last - first + 1
+    edge_ids = np.repeat(np.arange(len(edges)), counts)
+    bands = _expand(first, counts)
+    order = np.argsort(bands, kind='stable')
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(bands, minlength=nbands))))
+    return {
+        'adcode': properties.get('adcode'),
+        'name': properties.get('name'),
+        'level': properties.get('level'),
+        'bbox': bbox,
+        'edges': edges[edge_ids[order]],
+        'offsets': offsets,
+        'height': height,
+    }
+
+
+def load_districts(path=None):
+    """Prepared districts of Ningbo.json, computed once per file version"""
+    path = path or data_access.data_path(data_access.BOUNDARY_JSON)
+    key = data_access.file_key(path)
+    if key not in _memo:
+        geojson = data_access.load_boundary(path)
+        _memo.clear()
+        _memo[key] = [prepare_district(feature) for feature in geojson['features']]
+    return _memo[key]
+
+
+def _inside(district, lats, lons, chunk_pairs):
+    """Even-odd test of points against one prepared district"""
+    edges, offsets = district['edges'], district['offsets']
+    band = np.clip(((lats - district['bbox'][1]) / district['height']).astype(np.int64),
+                   0, len(offsets) - 2)
+    starts = offsets[band]
+    counts = offsets[band + 1] - starts
+    crossings = np.zeros(len(lats), dtype=np.int64)
+
+    bounds = np.cumsum(counts)
+    start = 0
+    while start < len(counts):
+        base = bounds[start - 1] if start else 0
+        stop = max(start + 1, int(np.searchsorted(bounds, base + chunk_pairs, side='right')))
+        point = np.repeat(np.arange(start, stop), counts[start:stop])
+        x0, y0, x1, y1 = edges[_expand(starts[start:stop], counts[start:stop])].T
+        px, py = lons[point], lats[point]
+        # Half-open in y, so a ray through a vertex counts it once
+        straddles = (y0 > py) != (y1 > py)
+        crossing_x = x0 + (py - y0) * (x1 - x0) / np.where(straddles, y1 - y0, 1.0)
+        hits = straddles & (px < crossing_x)
+        crossings += np.bincount(point[hits], minlength=len(lats))
+        start = stop
+    return crossings % 2 == 1
+
+
+def assign_districts(lats, lons, districts=None, chunk_pairs=CHUNK_PAIRS):
+    """Index into districts of the district containing every point, -1 if none"""
+    districts = load_districts() if districts is None else districts
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    result = np.full(len(lats), -1, dtype=np.int64)
+    for i, district in enumerate(districts):
+        west, south, east, north = district['bbox']
+        # NaN coordinates fail every comparison and are never candidates
+        candidates = np.flatnonzero((result < 0) & (lons >= west) & (lons <= east)
+                                    & (lats >= south) & (lats <= north))
+        if len(candidates):
+            inside = _inside(district, lats[candidates], lons[candidates], chunk_pairs)
+            result[candidates[inside]] = i
+    return result
+
+
+def add_districts(df, districts=None, chunk_pairs=CHUNK_PAIRS):
+    """Copy of an impact table with the adcode, district (name) and
+    district_level of every row; rows outside every district get adcode -1"""
+    districts = load_districts() if districts is None else districts
+    with instrument.span('assign_districts', rows=len(df), districts=len(districts)):
+        ids = assign_districts(df['latitude'].to_numpy(), df['longitude'].to_numpy(),
+                               districts, chunk_pairs)
+    found = ids >= 0
+    result = df.copy()
+    for column, field, missing in (('adcode', 'adcode', -1), ('district', 'name', None),
+                                   ('district_level', 'level', None)):
+        values = np.array([d[field] for d in districts] + [missing], dtype=object)
+        result[column] = values[ids]
+    result['adcode'] = result['adcode'].astype(np.int64)
+    instrument.count('rows_outside_districts', int((~found).sum()))
+    return result
+
+
+def district_summary(df, column='Impact Days', districts=None):
+    """Affected locations and mean of column per district, for every district.
+
+    df must carry the adcode column of add_districts. Districts without
+    locations have count 0 and mean NaN.
+    """
+    districts = load_districts() if districts is None else districts
+    stats = (df[df['adcode'] >= 0].groupby('adcode')[column]
+             .agg(['size', 'mean']).rename(columns={'size': 'count'}))
+    summary = pd.DataFrame({
+        'adcode': [d['adcode'] for d in districts],
+        'name': [d['name'] for d in districts],
+        'level': [d['level'] for d in districts],
+    })
+    summary = summary.join(stats, on='adcode')
+    summary['count'] = summary['count'].fillna(0).astype(np.int64)
+    return summary
@@ -0,0 +1,88 @@
+"""Physical storm exposure of every affected location.
+
+For each site the track (interpolated with common.interpolate to a fine
+time step) gives:
+
+    closest_approach_km    distance of the nearest storm position
+    closest_approach_time  when that was
+    wind_at_closest        storm wind (m/s) at that moment
+    hours_within_radius    time the storm centre spent within radius_km:
+                           the length of the track steps whose two ends
+                           are both within it
+
+The distances of a block of sites to all track positions are one
+broadcasted haversine call; sites are processed in blocks of at most
+chunk_pairs (site, position) pairs, so memory stays bounded however
+large the table is.
+"""
+import numpy as np
+
+from common.interpolate import interpolate_track
+from common.spatial import CHUNK_PAIRS, haversine_km
+
+DEFAULT_RADIUS_KM = 200
+
+# What the impact-duration maps can be coloured by: column, legend caption,
+# and whether small values are the severe ones
+COLOR_BY = {
+    'days': ('Impact Days', 'Typhoon Impact Duration (days)', False),
+    'closest': ('closest_approach_km', 'Closest approach of Typhoon Khanun (km)', True),
+    'hours': ('hours_within_radius', 'Hours within {radius:g} km of Typhoon Khanun', False),
+    'wind': ('wind_at_closest', 'Typhoon wind at closest approach (m/s)', False),
+}
+
+
+def track_positions(storm, step_hours=0.5, method='great_circle'):
+    """Times, lat, lon and wind of the storm every step_hours hours"""
+    times = np.asarray(storm['times'], dtype='datetime64[s]')
+    step = np.timedelta64(int(round(step_hours * 3600)), 's')
+    grid = np.arange(times[0], times[-1] + np.timedelta64(1, 's'), step)
+    values = interpolate_track(storm, grid, method, extrapolate=True)
+    return grid, values['lat'], values['lon'], values['wind']
+
+
+def exposure_arrays(lats, lons, storm, radius_km=DEFAULT_RADIUS_KM, step_hours=0.5,
+                    chunk_pairs=CHUNK_PAIRS, method='great_circle'):
+    """Exposure metrics of sites at (lats, lons) as a dict of arrays (see module doc)"""
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    times, track_lat, track_lon, track_wind = track_positions(storm, step_hours, method)
+    n = len(lats)
+    closest = np.full(n, np.nan)
+    nearest = np.zeros(n, dtype=np.int64)
+    hours = np.zeros(n)
+    step_lengths = np.diff(times).astype(np.int64) / 3600
+
+    block = max(1, chunk_pairs // max(len(times), 1))
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        dist = haversine_km(lats[start:stop, None], lons[start:stop, None],
+                            track_lat[None, :], track_lon[None, :])
+        nearest[start:stop] = np.argmin(dist, axis=1)
+        closest[start:stop] = dist[np.arange(stop - start), nearest[start:stop]]
+        within = dist <= radius_km
+        hours[start:stop] = (within[:, :-1] & within[:, 1:]) @ step_lengths
+
+    # Sites without coordinates get no exposure
+    missing = np.isnan(closest)
+    when = times[nearest]
+    when[missing] = np.datetime64('NaT')
+    wind = track_wind[nearest].astype(float)
+    wind[missing] = np.nan
+    return {
+        'closest_approach_km': closest,
+        'closest_approach_time': when,
+        'wind_at_closest': wind,
+        'hours_within_radius': hours,
+    }
+
+
+def add_exposure(df, storm, radius_km=DEFAULT_RADIUS_KM, step_hours=0.5,
+                 chunk_pairs=CHUNK_PAIRS, method='great_circle'):
+    """Copy of an impact table with the exposure columns added"""
+    columns = exposure_arrays(df['latitude'].to_numpy(), df['longitude'].to_numpy(), storm,
+                              radius_km, step_hours, chunk_pairs, method)
+    result = df.copy()
+    for name, values in columns.items():
+        result[name] = values
+    return result
@@ -0,0 +1,383 @@
+"""Offline gazetteer for geocoding impact records without coordinates.
+
+The location column holds hierarchical names, most specific first, such
+as "Shimen Village,Xikou Town". The gazetteer is seeded from
+
+    Ningbo.json       every district at its centroid, under its Chinese
+                      name and the English name in DISTRICT_NAMES
+    typhoon_data.csv  every row with coordinates, linked to the broader
+                      name after its comma; a broader name that has no row
+                      of its own sits at the mean of the rows under it
+
+Names are compared by key: NFKC, lower case, punctuation and spaces
+dropped, and a trailing administrative word (Town, Village, Subdistrict,
+镇, 村, 街道, ...) removed, so "Xikou Town" and "xikou" meet. Three indexes
+are built over the keys:
+
+    exact      dict of key to entries
+    prefix     the keys sorted, so the entries starting with a prefix are
+               one searchsorted range (a flattened trie)
+    trigrams   entries of every character trigram in CSR layout, for
+               misspelt names, scored by the Dice overlap of the trigrams
+
+A name is resolved part by part, most specific first. A match that agrees
+with the broader parts (its parent, or the district it lies in) is
+preferred; when the specific part is unknown, the broader part's position
+is used with method 'parent'. geocode resolves each distinct string once
+and keeps the results in an on-disk cache keyed on the contents of the
+seed files.
+
+Usage (from the repository root):
+    python -m common.gazetteer reports.csv geocoded.csv
+    python -m common.gazetteer --query "Shimen Village,Xikou Town"
+"""
+import os
+import pickle
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from common import data_access, instrument
+from common.districts import assign_districts, load_districts
+from common.spatial import _expand
+
+# Bump when resolution rules change, to invalidate cached results
+GAZETTEER_VERSION = 1
+
+# English names of the districts of Ningbo.json, by adcode
+DISTRICT_NAMES = {
+    330203: 'Haishu District',
+    330205: 'Jiangbei District',
+    330206: 'Beilun District',
+    330211: 'Zhenhai District',
+    330212: 'Yinzhou District',
+    330213: 'Fenghua District',
+    330225: 'Xiangshan County',
+    330226: 'Ninghai County',
+    330281: 'Yuyao City',
+    330282: 'Cixi City',
+}
+
+ADMIN_WORDS = ('subdistrict', 'township', 'town', 'village', 'district', 'county', 'city',
+               'street', 'community')
+CJK_SUFFIXES = ('街道', '社区', '区', '县', '市', '镇', '乡', '村')
+
+# A candidate needs a prefix of MIN_PREFIX characters or a trigram
+# similarity of MIN_SIMILARITY, and a match a score of MIN_SCORE. Scores
+# are scaled by MISMATCH when the match disagrees with the broader parts
+# of the name, and by PARENT for every specific part that went unmatched.
+MIN_PREFIX = 3
+MIN_SIMILARITY = 0.5
+MIN_SCORE = 0.45
+MISMATCH = 0.8
+PARENT = 0.9
+
+_memo = {}
+
+
+def name_key(name):
+    """Comparison key of a place name (see module doc)"""
+    text = unicodedata.normalize('NFKC', str(name)).lower()
+    words = re.findall(r'[0-9a-z\u3400-\u9fff]+', text)
+    if len(words) > 1 and words[-1] in ADMIN_WORDS:
+        words.pop()
+    key = ''.join(words)
+    for suffix in CJK_SUFFIXES:
+        if key.endswith(suffix) and len(key) - len(suffix) >= 2:
+            return key[:-len(suffix)]
+    return key
+
+
+def split_location(text):
+    """Keys of the parts of a hierarchical name, most specific first"""
+    if not isinstance(text, str):
+        return []
+    keys = [name_key(part) for part in re.split(r'[,，;；]', text)]
+    return [key for key in keys if key]
+
+
+def trigrams(key):
+    padded = f'##{key}$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Gazetteer:
+    """Place-name entries with exact, prefix and trigram indexes.
+
+    entries is a DataFrame with one row per place: name, key, parent
+    (key of the broader place, '' for none), level, latitude, longitude
+    and adcode (district, -1 if outside Ningbo).
+    """
+
+    def __init__(self, entries, version=''):
+        self.entries = entries.reset_index(drop=True)
+        self.version = version
+        self.keys = self.entries['key'].tolist()
+        self.parents = self.entries['parent'].tolist()
+        self.adcodes = self.entries['adcode'].to_numpy()
+        self.lat = self.entries['latitude'].to_numpy(dtype=float)
+        self.lon = self.entries['longitude'].to_numpy(dtype=float)
+
+        self.exact = {}
+        for i, key in enumerate(self.keys):
+            self.exact.setdefault(key, []).append(i)
+        self.order = np.argsort(np.array(self.keys, dtype=object), kind='stable')
+        self.sorted_keys = np.array([self.keys[i] for i in self.order], dtype=str)
+
+        grams = [trigrams(key) for key in self.keys]
+        vocabulary = sorted(set().union(*grams)) if grams else []
+        self.gram_ids = {gram: i for i, gram in enumerate(vocabulary)}
+        self.gram_counts = np.array([len(g) for g in grams], dtype=np.int64)
+        pairs = [(self.gram_ids[gram], i) for i, entry_grams in enumerate(grams)
+                 for gram in entry_grams]
+        pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+        pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        self.gram_offsets = np.concatenate(
+            ([0], np.cumsum(np.bincount(pairs[:, 0], minlength=len(vocabulary)))))
+        self.gram_rows = pairs[:, 1]
+
+        # District keys of every adcode, to check "town, district" names
+        districts = self.entries[self.entries['level'] == 'district']
+        self.district_keys = {}
+        for key, adcode in zip(districts['key'], districts['adcode']):
+            self.district_keys.setdefault(adcode, set()).add(key)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _prefixed(self, key):
+        lo = np.searchsorted(self.sorted_keys, key, side='left')
+        hi = np.searchsorted(self.sorted_keys, key + '\uffff', side='left')
+        return self.order[lo:hi]
+
+    def _similar(self, key):
+        """Entries sharing trigrams with key and their Dice similarity"""
+        ids = [self.gram_ids[g] for g in trigrams(key) if g in self.gram_ids]
+        if not ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        ids = np.array(ids)
+        starts = self.gram_offsets[ids]
+        counts = self.gram_offsets[ids + 1] - starts
+        rows = self.gram_rows[_expand(starts, counts)]
+        rows, shared = np.unique(rows, return_counts=True)
+        similarity = 2 * shared / (len(trigrams(key)) + self.gram_counts[rows])
+        keep = similarity >= MIN_SIMILARITY
+        return rows[keep], similarity[keep]
+
+    def candidates(self, key):
+        """(entry ids, scores, method) of the best way key matches"""
+        if key in self.exact:
+            ids = np.array(self.exact[key])
+            return ids, np.ones(len(ids)), 'exact'
+        if len(key) >= MIN_PREFIX:
+            ids = self._prefixed(key)
+            if len(ids):
+                lengths = np.array([len(self.keys[i]) for i in ids])
+                return ids, 0.7 + 0.3 * len(key) / lengths, 'prefix'
+        ids, similarity = self._similar(key)
+        return ids, 0.9 * similarity, 'fuzzy'
+
+    def _agrees(self, i, broader):
+        context = {self.parents[i]} | self.district_keys.get(self.adcodes[i], set())
+        return bool(context & set(broader))
+
+    def resolve(self, text):
+        """(entry id, score, method) of a hierarchical name, or None"""
+        parts = split_location(text)
+        for depth, key in enumerate(parts):
+            ids, scores, method = self.candidates(key)
+            if not len(ids):
+                continue
+            broader = parts[depth + 1:]
+            if broader:
+                agrees = np.array([self._agrees(i, broader) for i in ids])
+                scores = np.where(agrees, scores, scores * MISMATCH)
+            best = int(np.argmax(scores))
+            score = float(scores[best]) * PARENT ** depth
+            if score >= MIN_SCORE:
+                return int(ids[best]), score, 'parent' if depth else method
+        return None
+
+    def geocode(self, locations, cache=True):
+        """Position of every location string, as a DataFrame aligned with the input.
+
+        Columns: latitude, longitude, matched (entry name), level, score
+        and method (exact, prefix, fuzzy or parent; None if unresolved).
+        """
+        locations = pd.Series(locations, dtype=object).reset_index(drop=True)
+        unique = pd.unique(locations.fillna(''))
+        results = _load_results(self.version) if cache else {}
+        missing = [text for text in unique if text not in results]
+        with instrument.span('geocode', strings=len(unique), missing=len(missing)):
+            results.update((text, self.resolve(text)) for text in missing)
+        instrument.count('geocoded', len(missing))
+        if cache and missing:
+            _save_results(self.version, results)
+
+        rows = locations.fillna('').map(results)
+        # Unresolved rows take id -1, the missing value appended to every column
+        ids = np.array([r[0] if r else -1 for r in rows], dtype=np.int64)
+        result = pd.DataFrame({
+            'latitude': np.append(self.lat, np.nan)[ids],
+            'longitude': np.append(self.lon, np.nan)[ids],
+            'matched': np.append(self.entries['name'].to_numpy(dtype=object), None)[ids],
+            'level': np.append(self.entries['level'].to_numpy(dtype=object), None)[ids],
+            'score': [r[1] if r else 0.0 for r in rows],
+            'method': [r[2] if r else None for r in rows],
+        })
+        return result
+
+
+def _results_path(version):
+    cache_dir = data_access.cache_dir()
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, f'geocode-{version}.pkl')
+
+
+def _load_results(version):
+    path = _results_path(version)
+    if path:
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+    return {}
+
+
+def _save_results(version, results):
+    path = _results_path(version)
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def district_entries(boundary_path=None):
+    """One entry per district name (Chinese and English) at its centroid"""
+    geojson = data_access.load_boundary(boundary_path)
+    rows = []
+    for feature in geojson['features']:
+        properties = feature['properties']
+        lon, lat = properties.get('centroid') or properties['center']
+        for name in (properties['name'], DISTRICT_NAMES.get(properties['adcode'])):
+            if name:
+                rows.append({'name': name, 'key': name_key(name), 'parent': '',
+                             'level': 'district', 'latitude': lat, 'longitude': lon,
+                             'adcode': properties['adcode']})
+    return pd.DataFrame(rows)
+
+
+def record_entries(df, districts=None):
+    """Entries of the impact rows with coordinates, plus their broader places"""
+    df = df.dropna(subset=['latitude', 'longitude'])
+    names = df['location'].astype(str).str.split(r'[,，]', n=1, regex=True)
+    entries = pd.DataFrame({
+        'name': names.str[0].str.strip(),
+        'key': [name_key(n) for n in names.str[0]],
+        'parent': [name_key(n[1]) if len(n) > 1 else '' for n in names],
+        'level': df['admin_level'].fillna('').to_numpy() if 'admin_level' in df else '',
+        'latitude': df['latitude'].to_numpy(dtype=float),
+        'longitude': df['longitude'].to_numpy(dtype=float),
+    })
+    entries = entries[entries['key'] != '']
+
+    # Broader places without a row of their own, at the mean of their children
+    children = entries[entries['parent'] != '']
+    known = set(entries['key'])
+    derived = (children[~children['parent'].isin(known)]
+               .groupby('parent').agg(latitude=('latitude', 'mean'),
+                                      longitude=('longitude', 'mean')).reset_index())
+    parent_names = dict(zip([name_key(n[1]) for n in names if len(n) > 1],
+                            [n[1].strip() for n in names if len(n) > 1]))
+    derived = pd.DataFrame({
+        'name': derived['parent'].map(parent_names),
+        'key': derived['parent'],
+        'parent': '',
+        'level': 'town',
+        'latitude': derived['latitude'],
+        'longitude': derived['longitude'],
+    })
+    entries = pd.concat([entries, derived], ignore_index=True)
+
+    # Repeated places are merged at their mean position
+    entries = (entries.groupby(['key', 'parent'], sort=False)
+               .agg(name=('name', 'first'), level=('level', 'first'),
+                    latitude=('latitude', 'mean'), longitude=('longitude', 'mean'))
+               .reset_index())
+    districts = load_districts() if districts is None else districts
+    ids = assign_districts(entries['latitude'].to_numpy(), entries['longitude'].to_numpy(),
+                           districts)
+    adcodes = np.array([d['adcode'] for d in districts] + [-1], dtype=np.int64)
+    entries['adcode'] = adcodes[ids]
+    return entries
+
+
+def load_gazetteer(csv_path=None, boundary_path=None):
+    """Gazetteer seeded from Ningbo.json and the impact table, built once per
+    version of the two files"""
+    csv_path = csv_path or data_access.data_path(data_access.IMPACT_CSV)
+    boundary_path = boundary_path or data_access.data_path(data_access.BOUNDARY_JSON)
+    key = data_access.file_key(csv_path) + data_access.file_key(boundary_path)
+    if key not in _memo:
+        version = data_access.digest(f'{data_access.file_digest(csv_path)}:'
+                                     f'{data_access.file_digest(boundary_path)}:'
+                                     f'{GAZETTEER_VERSION}')
+        with instrument.span('build_gazetteer'):
+            entries = pd.concat([district_entries(boundary_path),
+                                 record_entries(data_access.load_impact_table(csv_path),
+                                                load_districts(boundary_path))],
+                                ignore_index=True)
+            _memo.clear()
+            _memo[key] = Gazetteer(entries, version)
+    return _memo[key]
+
+
+def fill_coordinates(df, gazetteer=None):
+    """Copy of a table whose rows without latitude/longitude are geocoded
+    from their location; geocode_method records how (None if untouched)"""
+    if gazetteer is None:
+        gazetteer = load_gazetteer()
+    result = df.copy()
+    if 'latitude' not in result:
+        result['latitude'] = np.nan
+    if 'longitude' not in result:
+        result['longitude'] = np.nan
+    result['geocode_method'] = None
+    missing = result['latitude'].isna() | result['longitude'].isna()
+    if missing.any():
+        found = gazetteer.geocode(result.loc[missing, 'location'])
+        found.index = result.index[missing]
+        result.loc[missing, ['latitude', 'longitude']] = found[['latitude', 'longitude']]
+        result.loc[missing, 'geocode_method'] = found['method']
+    return result
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Fill in missing coordinates from place names')
+    parser.add_argument('input', nargs='?', help='CSV with a location column')
+    parser.add_argument('output', nargs='?', help='Where to write the geocoded CSV')
+    parser.add_argument('--query', action='append', default=[],
+                        help='Resolve one location string and print the match')
+    args = parser.parse_args()
+    if not args.query and not (args.input and args.output):
+        parser.error('give input and output CSVs, or --query')
+
+    gazetteer = load_gazetteer()
+    if args.query:
+        print(pd.concat([pd.Series(args.query, name='location'), gazetteer.geocode(args.query)],
+                        axis=1).to_string(index=False))
+    if args.input:
+        table = pd.read_csv(args.input)
+        result = fill_coordinates(table, gazetteer)
+        result.to_csv(args.output, index=False)
+        print(f"{int(result['geocode_method'].notna().sum())} of {len(result)} rows geocoded "
+              f"into {args.output}")
@@ -0,0 +1,194 @@
+"""Per-stage timing and memory instrumentation for the map generators.
+
+Tracing is off by default and every hook is then a no-op. It is turned on
+by the TYPHOON_TRACE environment variable or the --trace flag of the
+scripts (see add_arguments), whose value is the trace file to write, or
+an existing directory that gets one <script>-<timestamp>.trace.json per
+run. TYPHOON_TRACE_MEMORY=1 or --trace-memory also records the
+tracemalloc peak of every span; --trace-memory alone traces to the
+TYPHOON_TRACE path, or else to one file per run in the current directory.
+
+    with instrument.span('read_csv', path=path):
+        ...
+    instrument.count('features', len(features))
+    instrument.count_file('bytes_written', output_path)
+
+The trace is written when the process exits, in the Chrome trace-event
+format (open it in chrome://tracing or ui.perfetto.dev): one complete
+event per span with its arguments and memory peak, one counter event per
+count() call, and the counter totals under "otherData".
+"""
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import ContextDecorator
+
+_state = {
+    'path': None,
+    'memory': False,
+    'events': [],
+    'counters': {},
+    'origin': time.perf_counter(),
+}
+# Per-thread stack of the memory peaks seen by the open spans
+_local = threading.local()
+
+
+def enabled():
+    return _state['path'] is not None
+
+
+def _micros(seconds):
+    return round((seconds - _state['origin']) * 1e6, 1)
+
+
+def enable(path, memory=False):
+    """Start tracing; the trace is written to path at exit (or by write())"""
+    if not enabled():
+        atexit.register(write)
+    _state['path'] = path
+    _state['memory'] = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def _memory_stack():
+    if not hasattr(_local, 'peaks'):
+        _local.peaks = []
+    return _local.peaks
+
+
+class span(ContextDecorator):
+    """Records the duration (and memory peak) of the enclosed block.
+
+    Use it as a context manager, a decorator (@span('create_map')), or
+    call start() and stop() around top-level script code.
+    """
+
+    def __init__(self, name, **args):
+        self.name = name
+        self.args = args
+        self._begin = None
+        self._peaks = None
+
+    def start(self):
+        if not enabled():
+            return self
+        self._peaks = _memory_stack() if _state['memory'] else None
+        if self._peaks is not None:
+            # tracemalloc has one peak; fold it into the enclosing span and restart it
+            current, peak = tracemalloc.get_traced_memory()
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self._peaks.append(current)
+        self._begin = time.perf_counter()
+        return self
+
+    def stop(self):
+        if self._begin is None:
+            return
+        end = time.perf_counter()
+        args = self.args
+        if self._peaks is not None:
+            own = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], own)
+            tracemalloc.reset_peak()
+            args = dict(args, peak_traced_mb=round(own / (1 << 20), 3))
+        _state['events'].append({
+            'name': self.name, 'ph': 'X', 'ts': _micros(self._begin),
+            'dur': round((end - self._begin) * 1e6, 1),
+            'pid': os.getpid(), 'tid': threading.get_ident(),
+            'args': {key: _jsonable(value) for key, value in args.items()},
+        })
+        self._begin = None
+
+    def _recreate_cm(self):
+        # A decorated function gets a fresh span per call
+        return span(self.name, **self.args)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def count(name, value=1):
+    """Add value to a counter"""
+    if not enabled():
+        return
+    total = _state['counters'].get(name, 0) + value
+    _state['counters'][name] = total
+    _state['events'].append({
+        'name': name, 'ph': 'C', 'ts': _micros(time.perf_counter()),
+        'pid': os.getpid(), 'args': {name: total},
+    })
+
+
+def count_file(name, path):
+    """Add the size of a written file to a counter"""
+    if enabled():
+        count(name, os.path.getsize(path))
+
+
+def _jsonable(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def _output_path(path):
+    if os.path.isdir(path):
+        script = os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0]
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        return os.path.join(path, f'{script}-{stamp}-{os.getpid()}.trace.json')
+    return path
+
+
+def write(path=None):
+    """Write the trace collected so far; returns the file written, if any"""
+    path = path or _state['path']
+    if path is None:
+        return None
+    path = _output_path(path)
+    trace = {
+        'traceEvents': _state['events'],
+        'displayTimeUnit': 'ms',
+        'otherData': {
+            'argv': sys.argv,
+            'counters': _state['counters'],
+        },
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(trace, f, ensure_ascii=False)
+    return path
+
+
+def add_arguments(parser):
+    """Add --trace and --trace-memory to a script's argument parser"""
+    parser.add_argument('--trace', metavar='PATH',
+                        help='Write a Chrome trace-event file of the run stages to PATH '
+                             '(a file, or a directory for one file per run)')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Also record the tracemalloc peak of every stage (without '
+                             '--trace, the trace goes to the current directory)')
+
+
+def configure(args):
+    """Enable tracing from parsed --trace/--trace-memory arguments"""
+    if args.trace:
+        enable(args.trace, memory=args.trace_memory or _state['memory'])
+    elif args.trace_memory:
+        enable(_state['path'] or os.curdir, memory=True)
+
+
+if os.environ.get('TYPHOON_TRACE'):
+    enable(os.environ['TYPHOON_TRACE'],
+           memory=os.environ.get('TYPHOON_TRACE_MEMORY', '') not in ('', '0'))
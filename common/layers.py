@@ -0,0 +1,343 @@
+"""Scalable folium layers for the impact-duration maps.
+
+The original scripts add one CircleMarker, Popup, DivIcon label and
+PolyLine per affected location; each becomes its own Leaflet object and JS
+snippet. The builders here emit the same information as a single data
+payload plus one small JS function:
+
+    add_point_layer   all locations as one GeoJSON layer; marker colour and
+                      popup are read from feature properties on the client
+    add_cluster_layer all locations as one FastMarkerCluster array
+    add_spoke_layer   every centre-to-location line as one MultiLineString
+    add_tile_layer    all locations (and the boundary) as vector tiles
+                      written next to the page, loaded per visible tile
+    add_direct_layer  the markers mode itself (lines, circle markers, labels
+                      and popups) drawn by one JS loop over one data array
+    add_district_layer  the districts filled by their number of affected
+                      locations or mean impact days (common.districts)
+
+Popups keep the scripts' look: pass the same HTML template the per-marker
+path formats in Python, with {location}, {days} and {details} placeholders.
+The popup HTML is only built when a popup is opened. With lazy=True the
+details are left out of the page entirely and each popup is a placeholder
+for row id (the row's position in df) of a common.popups side store.
+"""
+
+import json
+import os
+
+import folium
+import pandas as pd
+from branca.colormap import LinearColormap
+from branca.element import MacroElement
+from folium.plugins import FastMarkerCluster, VectorGridProtobuf
+from folium.utilities import JsCode
+from jinja2 import Template
+
+from common.boundary import load_simplified_boundary
+from common.popups import PLACEHOLDER_TEMPLATE, js_template
+from common.tiles import BOUNDARY_LAYER, MAX_ZOOM, MIN_ZOOM, POINT_LAYER, export_tiles
+
+RENDER_MODES = ('markers', 'direct', 'geojson', 'cluster', 'tiles')
+
+# Dashed centre-to-location lines of the impact-duration maps
+SPOKE_STYLE = {'color': '#666666', 'weight': 1.5, 'opacity': 0.7, 'dashArray': '5, 3'}
+
+# What the district choropleth shows: district_summary column and legend caption
+CHOROPLETH = {
+    'count': ('count', 'Affected locations per district'),
+    'days': ('mean', 'Mean impact days per district'),
+}
+
+
+def color_column(df, colormap, column='Impact Days'):
+    """Colormap applied once per distinct value rather than once per row"""
+    values = df[column]
+    colors = {value: colormap(value) for value in values.unique()}
+    return values.map(colors)
+
+
+def _popup_column(df, lazy):
+    """Details for inline popups, or the row ids of a lazy side store"""
+    if lazy:
+        return list(range(len(df)))
+    return df['details'].fillna('').tolist()
+
+
+def impact_features(df, colormap, lazy=False, column='Impact Days'):
+    """One Point feature per row with the properties the client-side popup uses
+
+    The marker colour is colormap applied to column.
+    """
+    key = 'id' if lazy else 'details'
+    columns = zip(
+        df['longitude'].tolist(), df['latitude'].tolist(),
+        df['location'].tolist(), df['Impact Days'].tolist(),
+        _popup_column(df, lazy), color_column(df, colormap, column).tolist()
+    )
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                'properties': {'location': location, 'days': days,
+                               key: popup, 'color': color}
+            }
+            for lon, lat, location, days, popup, color in columns
+        ]
+    }
+
+
+def add_point_layer(m, df, colormap, popup_html, radius=8, fill_opacity=0.9,
+                    max_width=300, name='Affected locations', lazy=False,
+                    column='Impact Days'):
+    """All affected locations as one GeoJSON layer of canvas circle markers"""
+    popup = js_template(PLACEHOLDER_TEMPLATE if lazy else popup_html)
+    folium.GeoJson(
+        impact_features(df, colormap, lazy, column),
+        name=name,
+        marker=folium.CircleMarker(radius=radius, fill=True, fill_opacity=fill_opacity),
+        tooltip=folium.GeoJsonTooltip(fields=['location'], labels=False),
+        on_each_feature=JsCode(f"""
+            function(feature, layer) {{
+                var p = feature.properties;
+                layer.setStyle({{color: p.color, fillColor: p.color}});
+                layer.bindPopup(function() {{ return ({popup})(p); }}, {{maxWidth: {max_width}}});
+            }}
+        """)
+    ).add_to(m)
+
+
+def add_cluster_layer(m, df, colormap, popup_html, radius=8, fill_opacity=0.9,
+                      max_width=300, name='Affected locations', lazy=False,
+                      column='Impact Days'):
+    """All affected locations as one FastMarkerCluster of circle markers"""
+    rows = zip(
+        df['latitude'].tolist(), df['longitude'].tolist(),
+        df['location'].tolist(), df['Impact Days'].tolist(),
+        _popup_column(df, lazy), color_column(df, colormap, column).tolist()
+    )
+    key = 'id' if lazy else 'details'
+    callback = f"""
+        (function () {{
+        var popup = {js_template(PLACEHOLDER_TEMPLATE if lazy else popup_html)};
+        return function (row) {{
+            var p = {{location: row[2], days: row[3], {key}: row[4]}};
+            var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {{
+                radius: {radius}, color: row[5], fillColor: row[5],
+                fill: true, fillOpacity: {fill_opacity}
+            }});
+            marker.bindTooltip(p.location);
+            marker.bindPopup(function() {{ return popup(p); }}, {{maxWidth: {max_width}}});
+            return marker;
+        }};
+        }})()
+    """
+    FastMarkerCluster([list(row) for row in rows], callback=callback, name=name).add_to(m)
+
+
+def add_spoke_layer(m, df, center, name='Connections'):
+    """Dashed lines from the centre to every location, as one MultiLineString"""
+    center_lonlat = [center[1], center[0]]
+    lines = [[center_lonlat, [lon, lat]]
+             for lat, lon in zip(df['latitude'].tolist(), df['longitude'].tolist())]
+    folium.GeoJson(
+        {'type': 'Feature', 'properties': {},
+         'geometry': {'type': 'MultiLineString', 'coordinates': lines}},
+        name=name,
+        style_function=lambda x: SPOKE_STYLE
+    ).add_to(m)
+
+
+class _DirectLayer(MacroElement):
+    """Draws the rows of one columnar data array in a single loop"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            (function() {
+                var d = {{ this.data }};
+                var popup = {{ this.popup }};
+                var label = {{ this.label }};
+                var spokes = {{ this.spokes|tojson }};
+                var group = L.featureGroup();
+                function add(i) {
+                    var latlng = [d.lat[i], d.lon[i]];
+                    var color = d.palette[d.color[i]];
+                    var p = {location: d.location[i], days: d.days[i], id: i};
+                    if (d.details) p.details = d.details[i];
+                    if (spokes) L.polyline([spokes.center, latlng], spokes.style).addTo(group);
+                    L.circleMarker(latlng, {
+                        radius: {{ this.radius }}, color: color, fillColor: color,
+                        fill: true, fillOpacity: {{ this.fill_opacity }}
+                    }).bindTooltip(p.location)
+                      .bindPopup(function() { return popup(p); }, {maxWidth: {{ this.max_width }}})
+                      .addTo(group);
+                    if (label) {
+                        L.marker([latlng[0] - {{ this.label_offset }}, latlng[1]], {
+                            icon: L.divIcon({html: label(p), className: 'empty'}),
+                            zIndexOffset: 200
+                        }).addTo(group);
+                    }
+                }
+                for (var i = 0; i < d.lat.length; i++) add(i);
+                group.addTo({{ this._parent.get_name() }});
+            })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, data, popup, radius, fill_opacity, max_width, spokes=None,
+                 label=None, label_offset=0.015):
+        super().__init__()
+        self._name = 'DirectLayer'
+        # Free text may contain '</script>'
+        self.data = json.dumps(data, ensure_ascii=False, separators=(',', ':')).replace('</', '<\\/')
+        self.popup = popup
+        self.label = label or 'null'
+        self.spokes = spokes
+        self.radius = radius
+        self.fill_opacity = fill_opacity
+        self.max_width = max_width
+        self.label_offset = label_offset
+
+
+def add_direct_layer(m, df, colormap, popup_html, radius=8, fill_opacity=0.9,
+                     max_width=300, lazy=False, column='Impact Days', spokes=None,
+                     label_html=None, label_offset=0.015):
+    """The markers mode of the scripts, without one folium object per row.
+
+    Every row still becomes its own Leaflet circle marker with a tooltip
+    and popup (and a dashed line from spokes, the centre as [lat, lon],
+    and a DivIcon label from label_html, a '{location}' template, when
+    given), but they are all created client-side by one loop over a single
+    columnar array, so the page grows with the data and not with per-object
+    JS. Colours are sent once per distinct colour.
+    """
+    codes, palette = pd.factorize(color_column(df, colormap, column))
+    data = {
+        'lat': df['latitude'].tolist(),
+        'lon': df['longitude'].tolist(),
+        'days': df['Impact Days'].tolist(),
+        'location': df['location'].tolist(),
+        'color': codes.tolist(),
+        'palette': list(palette),
+    }
+    if not lazy:
+        data['details'] = _popup_column(df, lazy)
+    popup = js_template(PLACEHOLDER_TEMPLATE if lazy else popup_html)
+    label = js_template(label_html) if label_html else None
+    if spokes is not None:
+        spokes = {'center': list(spokes), 'style': SPOKE_STYLE}
+    _DirectLayer(data, popup, radius, fill_opacity, max_width, spokes, label,
+                 label_offset).add_to(m)
+
+
+class _TilePopups(MacroElement):
+    """Opens a popup for the clicked feature of a vector tile layer"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            {{ this.layer.get_name() }}.on('click', function(e) {
+                // Only the locations have popups, not the boundary
+                if (e.layer.properties.days === undefined) return;
+                var popup = {{ this.popup }};
+                L.popup({maxWidth: {{ this.max_width }}})
+                    .setLatLng(e.latlng)
+                    .setContent(popup(e.layer.properties))
+                    .openOn({{ this._parent.get_name() }});
+            });
+        {% endmacro %}
+    """)
+
+    def __init__(self, layer, popup, max_width):
+        super().__init__()
+        self._name = 'TilePopups'
+        self.layer = layer
+        self.popup = popup
+        self.max_width = max_width
+
+
+def add_tile_layer(m, df, colormap, popup_html, directory, radius=8, fill_opacity=0.9,
+                   max_width=300, name='Affected locations', lazy=False,
+                   boundary_style=None, minzoom=MIN_ZOOM, maxzoom=MAX_ZOOM,
+                   column='Impact Days'):
+    """All affected locations as vector tiles written to directory.
+
+    The page requests directory/{z}/{x}/{y}.pbf relative to itself, so save
+    it next to the directory and serve both over HTTP. With boundary_style
+    (a Leaflet path style) the Ningbo districts go into the tiles as well.
+    Below maxzoom the locations are thinned, keeping the longest-affected
+    location of each few pixels.
+    """
+    points = pd.DataFrame({
+        'longitude': df['longitude'].to_numpy(),
+        'latitude': df['latitude'].to_numpy(),
+        'location': df['location'].to_numpy(),
+        'days': df['Impact Days'].to_numpy(),
+        'id' if lazy else 'details': _popup_column(df, lazy),
+        'color': color_column(df, colormap, column).to_numpy(),
+    })
+    export_tiles(points, directory=directory, minzoom=minzoom, maxzoom=maxzoom,
+                 priority='days', boundary=boundary_style is not None)
+
+    styles = {POINT_LAYER: f"""function(p) {{
+                return {{radius: {radius}, fill: true, color: p.color, fillColor: p.color,
+                         fillOpacity: {fill_opacity}, weight: 1}};
+            }}"""}
+    if boundary_style is not None:
+        styles[BOUNDARY_LAYER] = json.dumps(dict(boundary_style, fill=True))
+    layer_styles = ',\n            '.join(f'{json.dumps(layer)}: {style}'
+                                          for layer, style in styles.items())
+    options = f"""{{
+        rendererFactory: L.canvas.tile,
+        interactive: true,
+        minNativeZoom: {minzoom},
+        maxNativeZoom: {maxzoom},
+        vectorTileLayerStyles: {{
+            {layer_styles}
+        }}
+    }}"""
+    url = os.path.basename(os.path.normpath(directory)) + '/{z}/{x}/{y}.pbf'
+    layer = VectorGridProtobuf(url, name, options).add_to(m)
+    popup = js_template(PLACEHOLDER_TEMPLATE if lazy else popup_html)
+    _TilePopups(layer, popup, max_width).add_to(m)
+    return layer
+
+
+def add_district_layer(m, summary, value='count', zoom=9, name='Districts',
+                       colors=('#f7fbff', '#6baed6', '#08306b'), fill_opacity=0.6):
+    """Ningbo districts filled by a column of common.districts.district_summary
+
+    value is a key of CHOROPLETH. Districts without a value are left
+    unfilled. Returns the colormap, which is also added to the map.
+    """
+    column, caption = CHOROPLETH[value]
+    values = summary.set_index('adcode')[column]
+    known = values.dropna()
+    colormap = LinearColormap(list(colors), vmin=float(known.min()) if len(known) else 0,
+                              vmax=float(known.max()) if len(known) else 1)
+    colormap.caption = caption
+
+    boundary = load_simplified_boundary(zoom=zoom)
+    features = []
+    for feature in boundary['features']:
+        properties = dict(feature['properties'])
+        amount = values.get(properties.get('adcode'))
+        has_value = amount is not None and pd.notna(amount)
+        properties['value'] = round(float(amount), 2) if has_value else None
+        properties['fill'] = colormap(amount) if has_value else None
+        features.append(dict(feature, properties=properties))
+
+    folium.GeoJson(
+        {'type': 'FeatureCollection', 'features': features},
+        name=name,
+        style_function=lambda feature: {
+            'fillColor': feature['properties']['fill'] or '#ffffff',
+            'fillOpacity': fill_opacity if feature['properties']['fill'] else 0,
+            'color': '#555555',
+            'weight': 1,
+        },
+        tooltip=folium.GeoJsonTooltip(fields=['name', 'value'], aliases=['District:', caption + ':'])
+    ).add_to(m)
+    m.add_child(colormap)
+    return colormap
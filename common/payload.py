@@ -0,0 +1,140 @@
+"""Columnar binary payloads that a page maps straight onto typed arrays.
+
+Layout of a payload file:
+
+    b'TYPB'  uint32 header length  header JSON  column data
+
+The header JSON is padded so the column data starts on an 8-byte boundary
+and lists every column as {"name", "dtype", "offset", "length"}, offsets
+counted from the start of the column data and aligned to 8 bytes, so the
+browser wraps each column with new Float32Array(buffer, offset, length)
+and friends without copying or parsing anything. All numbers are
+little-endian.
+
+Strings are dictionary encoded: a column of integer codes plus a string
+table stored as two columns, '<name>.text' (UTF-8 bytes of all distinct
+values back to back) and '<name>.offsets' (value i is
+text[offsets[i]:offsets[i + 1]]).
+
+write_payload also writes a gzip-compressed copy next to the file for
+servers or pages that fetch the precompressed version.
+"""
+import gzip
+import json
+import struct
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b'TYPB'
+VERSION = 1
+ALIGN = 8
+
+# dtype name -> little-endian numpy dtype; the names match the JS typed arrays
+DTYPES = {
+    'uint8': '<u1',
+    'uint16': '<u2',
+    'uint32': '<u4',
+    'int32': '<i4',
+    'float32': '<f4',
+    'float64': '<f8',
+}
+
+
+def dictionary_encode(values):
+    """(codes, distinct values) of a sequence of strings; missing values become ''"""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object).fillna('').astype(str))
+    dtype = 'uint8' if len(uniques) <= 0xff else 'uint16' if len(uniques) <= 0xffff else 'uint32'
+    return codes.astype(DTYPES[dtype]), list(uniques)
+
+
+def string_table(strings):
+    """UTF-8 bytes of strings back to back, and the offsets of each string"""
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.concatenate(([0], np.cumsum([len(b) for b in encoded]))).astype('<u4')
+    return np.frombuffer(b''.join(encoded), dtype='<u1'), offsets
+
+
+def add_strings(columns, name, values):
+    """Dictionary-encode values into columns[name] plus its string table"""
+    codes, table = dictionary_encode(values)
+    columns[name] = codes
+    columns[name + '.text'], columns[name + '.offsets'] = string_table(table)
+
+
+def _dtype_name(array):
+    for name, dtype in DTYPES.items():
+        if array.dtype == np.dtype(dtype):
+            return name
+    raise TypeError(f'Unsupported payload dtype {array.dtype}')
+
+
+def encode_payload(columns, meta=None):
+    """Serialize a dict of 1-d arrays to payload bytes"""
+    specs, parts, offset = [], [], 0
+    for name, values in columns.items():
+        array = np.ascontiguousarray(values)
+        array = array.astype(array.dtype.newbyteorder('<'))
+        padding = -offset % ALIGN
+        parts.append(b'\0' * padding)
+        offset += padding
+        specs.append({'name': name, 'dtype': _dtype_name(array),
+                      'offset': offset, 'length': len(array)})
+        parts.append(array.tobytes())
+        offset += array.nbytes
+    header = json.dumps({'version': VERSION, 'meta': meta or {}, 'columns': specs})
+    header = header.encode('utf-8')
+    header += b' ' * (-(8 + len(header)) % ALIGN)
+    return b''.join([MAGIC, struct.pack('<I', len(header)), header] + parts)
+
+
+def decode_payload(data):
+    """(meta, columns) of payload bytes; the columns are views into data"""
+    if data[:4] != MAGIC:
+        raise ValueError('Not a payload file')
+    (size,) = struct.unpack('<I', data[4:8])
+    header = json.loads(data[8:8 + size].decode('utf-8'))
+    if header['version'] != VERSION:
+        raise ValueError(f"Unsupported payload version {header['version']}")
+    start = 8 + size
+    columns = {spec['name']: np.frombuffer(data, dtype=DTYPES[spec['dtype']],
+                                           count=spec['length'], offset=start + spec['offset'])
+               for spec in header['columns']}
+    return header['meta'], columns
+
+
+def strings(columns, name):
+    """Decoded values of a dictionary-encoded column"""
+    text = columns[name + '.text'].tobytes()
+    offsets = columns[name + '.offsets']
+    table = [text[a:b].decode('utf-8') for a, b in zip(offsets[:-1], offsets[1:])]
+    return [table[code] for code in columns[name]]
+
+
+def write_payload(path, columns, meta=None, compress=True):
+    """Write a payload file, plus path + '.gz' when compress is set"""
+    data = encode_payload(columns, meta)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if compress:
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    return len(data)
+
+
+def read_payload(path):
+    """(meta, columns) of a payload file, plain or gzip-compressed"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    return decode_payload(data)
+
+
+def read_meta(path):
+    """meta of an uncompressed payload file, reading only its header"""
+    with open(path, 'rb') as f:
+        if f.read(4) != MAGIC:
+            raise ValueError('Not a payload file')
+        (size,) = struct.unpack('<I', f.read(4))
+        return json.loads(f.read(size).decode('utf-8'))['meta']
@@ -0,0 +1,142 @@
+"""Popups loaded on click from a chunked side store.
+
+Inlining a styled HTML popup with the free-text details for every marker
+makes up most of a saved map, although few popups are ever opened. In lazy
+mode each marker only carries a placeholder
+
+    <div class="lazy-popup" data-id="17"></div>
+
+and the popup records are written to <store>/<id // chunk_size>.json. A
+single popupopen handler on the map fetches the chunk (once), renders the
+record through one template styled by a shared CSS block, and swaps it
+into the popup. This works for any folium popup: CircleMarker popups,
+GeoJSON layers and the TimestampedGeoJson 'popup' property alike.
+
+The side store is fetched over HTTP, so serve the output directory (for
+example with python -m http.server) rather than opening the file directly.
+"""
+import json
+import os
+import re
+
+from branca.element import MacroElement
+from jinja2 import Template
+
+CHUNK_SIZE = 1000
+
+_FIELD = re.compile(r'\{(\w+)\}')
+
+
+def js_template(html):
+    """Turn a '{field}' HTML template into a JS function of a record"""
+    body = html.replace('\\', '\\\\').replace('`', '\\`').replace('${', '\\${')
+    return 'function(p) { return `' + _FIELD.sub(r'${p.\1}', body) + '`; }'
+
+
+def placeholder(popup_id):
+    """Popup content standing in for a record of the side store"""
+    return f'<div class="lazy-popup" data-id="{popup_id}"></div>'
+
+
+PLACEHOLDER_TEMPLATE = placeholder('{id}')
+
+
+class PopupStore:
+    """Writes popup records to chunked JSON files as they are added.
+
+    Ids are assigned consecutively from 0, so a record's chunk file and
+    position follow from its id alone.
+    """
+
+    def __init__(self, directory, chunk_size=CHUNK_SIZE):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.count = 0
+        self._rows = []
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, record):
+        """Store one record and return its id"""
+        self._rows.append(record)
+        self.count += 1
+        if len(self._rows) == self.chunk_size:
+            self._flush()
+        return self.count - 1
+
+    def extend(self, records):
+        """Store several records and return their ids"""
+        return [self.add(record) for record in records]
+
+    def _flush(self):
+        if not self._rows:
+            return
+        chunk = (self.count - 1) // self.chunk_size
+        path = os.path.join(self.directory, f'{chunk}.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self._rows, f, ensure_ascii=False, separators=(',', ':'))
+        self._rows = []
+
+    def close(self):
+        self._flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_popup_store(records, directory, chunk_size=CHUNK_SIZE):
+    """Write all records to a store; returns the number written"""
+    with PopupStore(directory, chunk_size) as store:
+        store.extend(records)
+    return store.count
+
+
+class LazyPopups(MacroElement):
+    """Fills lazy-popup placeholders from a side store when a popup opens.
+
+    url is the store directory relative to the saved page, template an HTML
+    template over the record fields and css the stylesheet its classes use.
+    """
+
+    _template = Template("""
+        {% macro header(this, kwargs) %}
+            <style>
+                .lazy-popup:empty::after { content: 'Loading...'; color: #888; }
+                {{ this.css }}
+            </style>
+        {% endmacro %}
+        {% macro script(this, kwargs) %}
+            (function() {
+                var chunks = {};
+                var render = {{ this.render_function }};
+                function load(chunk) {
+                    if (!chunks[chunk]) {
+                        chunks[chunk] = fetch({{ this.url|tojson }} + '/' + chunk + '.json')
+                            .then(function(response) { return response.json(); });
+                    }
+                    return chunks[chunk];
+                }
+                {{ this._parent.get_name() }}.on('popupopen', function(e) {
+                    var el = e.popup.getElement().querySelector('.lazy-popup');
+                    if (!el) return;
+                    var id = Number(el.dataset.id);
+                    load(Math.floor(id / {{ this.chunk_size }})).then(function(rows) {
+                        e.popup.setContent(render(rows[id % {{ this.chunk_size }}]));
+                    }).catch(function(error) {
+                        console.error('Error loading popup:', error);
+                        el.textContent = 'Failed to load details';
+                    });
+                });
+            })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, url, template, css='', chunk_size=CHUNK_SIZE):
+        super().__init__()
+        self._name = 'LazyPopups'
+        self.url = url
+        self.render_function = js_template(template)
+        self.css = css
+        self.chunk_size = chunk_size
@@ -0,0 +1,248 @@
+"""In-process multidimensional queries over the impact table.
+
+A QueryEngine keeps the parsed table resident with one index per filter
+dimension:
+
+    categories    the category bitmask of every row and the rows of every
+                  category in CSR layout (common.categories)
+    admin_level   dictionary-encoded: an int code per row, the distinct
+                  levels, and the rows of every level in CSR layout
+    dates         start and end days sorted, with the row order; the rows
+                  overlapping [a, b] are a prefix of the start order
+                  (start <= b) intersected with a suffix of the end order
+                  (end >= a)
+    bbox          longitudes sorted, with the row order
+
+Filters combine conjunctively. select sizes the candidate list of every
+filter with a binary search (or the posting lengths), takes the smallest
+one and checks the remaining filters on those candidates only. A
+selective query therefore touches a handful of rows rather than the whole
+table, and returns sorted row ids.
+
+Engines are built once per version of the CSV and shared, so the map
+generators can render any subset without reading the CSV again:
+
+    df = filter_table(categories=['Population'], start='2023-08-02', end='2023-08-03')
+
+Usage (from the repository root):
+    python -m common.query --categories Population,Infrastructure --admin-level town \\
+        --start 2023-08-02 --end 2023-08-03 --bbox 121.3,29.6,121.7,30.0 --output subset.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from common import data_access, instrument
+from common.categories import CATEGORIES, category_masks, inverted_index, selection_mask
+from common.timeline import day_numbers
+
+_memo = {}
+
+
+def _postings(codes, ncodes):
+    """Rows of every code in CSR layout: rows[offsets[c]:offsets[c + 1]]"""
+    order = np.argsort(codes, kind='stable')
+    offsets = np.searchsorted(codes[order], np.arange(ncodes + 1), side='left')
+    return offsets, order
+
+
+class QueryEngine:
+    """Resident impact table with per-dimension indexes (see module doc)"""
+
+    def __init__(self, df):
+        self.df = df.reset_index(drop=True)
+        n = len(self.df)
+
+        if 'categories' in self.df:
+            self.masks = category_masks(self.df['categories'])
+        else:
+            self.masks = np.zeros(n, dtype=np.uint16)
+        self.category_offsets, self.category_rows = inverted_index(self.masks, len(CATEGORIES))
+
+        codes, levels = pd.factorize(self.df['admin_level'] if 'admin_level' in self.df
+                                     else pd.Series([None] * n))
+        self.level_codes = codes.astype(np.int32)
+        self.levels = [str(level) for level in levels]
+        # Missing levels (code -1) sort first and belong to no posting list
+        self.level_offsets, self.level_rows = _postings(codes, len(levels))
+
+        self.start = day_numbers(self.df['start_date'])
+        self.end = day_numbers(self.df['end_date'])
+        self.by_start = np.argsort(self.start, kind='stable')
+        self.starts = self.start[self.by_start]
+        self.by_end = np.argsort(self.end, kind='stable')
+        self.ends = self.end[self.by_end]
+
+        self.lat = self.df['latitude'].to_numpy(dtype=float)
+        self.lon = self.df['longitude'].to_numpy(dtype=float)
+        # NaN longitudes sort last and fall outside every range
+        self.by_lon = np.argsort(self.lon, kind='stable')
+        self.lons = self.lon[self.by_lon]
+
+    def __len__(self):
+        return len(self.df)
+
+    def _union(self, offsets, rows, codes):
+        lists = [rows[offsets[c]:offsets[c + 1]] for c in codes]
+        return np.unique(np.concatenate(lists)) if lists else np.zeros(0, dtype=np.int64)
+
+    def select(self, categories=(), admin_levels=(), start=None, end=None, bbox=None):
+        """Sorted ids of the rows matching every given filter.
+
+        categories    rows listing any of these names
+        admin_levels  rows with any of these admin_level values
+        start, end    rows whose [start_date, end_date] overlaps the range;
+                      dates or days since 1970-01-01, either may be None
+        bbox          (west, south, east, north) in degrees
+        """
+        unknown = [name for name in categories if name not in CATEGORIES]
+        if unknown:
+            raise ValueError(f'Unknown categories: {", ".join(unknown)}')
+        mask = selection_mask(categories)
+        level_codes = [self.levels.index(level) for level in admin_levels
+                       if level in self.levels]
+        if admin_levels and not level_codes:
+            return np.zeros(0, dtype=np.int64)
+        start = None if start is None else int(day_numbers(start))
+        end = None if end is None else int(day_numbers(end))
+
+        # (size, candidates) of every index that can narrow the search
+        n = len(self)
+        plans = [(n, lambda: np.arange(n))]
+        if end is not None:
+            k = int(np.searchsorted(self.starts, end, side='right'))
+            plans.append((k, lambda: self.by_start[:k]))
+        if start is not None:
+            j = int(np.searchsorted(self.ends, start, side='left'))
+            plans.append((n - j, lambda: self.by_end[j:]))
+        if bbox is not None:
+            lo = int(np.searchsorted(self.lons, bbox[0], side='left'))
+            hi = int(np.searchsorted(self.lons, bbox[2], side='right'))
+            plans.append((hi - lo, lambda: self.by_lon[lo:hi]))
+        if mask:
+            selected = [c for c in range(len(CATEGORIES)) if mask & (1 << c)]
+            size = int(sum(self.category_offsets[c + 1] - self.category_offsets[c]
+                           for c in selected))
+            plans.append((size, lambda: self._union(self.category_offsets,
+                                                    self.category_rows, selected)))
+        if level_codes:
+            size = int(sum(self.level_offsets[c + 1] - self.level_offsets[c]
+                           for c in level_codes))
+            plans.append((size, lambda: self._union(self.level_offsets, self.level_rows,
+                                                    level_codes)))
+        rows = min(plans, key=lambda plan: plan[0])[1]()
+
+        keep = np.ones(len(rows), dtype=bool)
+        if end is not None:
+            keep &= self.start[rows] <= end
+        if start is not None:
+            keep &= self.end[rows] >= start
+        if bbox is not None:
+            west, south, east, north = bbox
+            lon, lat = self.lon[rows], self.lat[rows]
+            keep &= (lon >= west) & (lon <= east) & (lat >= south) & (lat <= north)
+        if mask:
+            keep &= (self.masks[rows] & mask) != 0
+        if level_codes:
+            keep &= np.isin(self.level_codes[rows], level_codes)
+        return np.sort(rows[keep])
+
+    def frame(self, rows):
+        """The given rows of the table, as a copy the caller may modify"""
+        return self.df.iloc[rows].copy()
+
+
+def load_engine(csv_path=None):
+    """QueryEngine over typhoon_data.csv, built once per version of the file"""
+    csv_path = csv_path or data_access.data_path(data_access.IMPACT_CSV)
+    key = data_access.file_key(csv_path)
+    if key not in _memo:
+        df = data_access.load_impact_table(csv_path)
+        with instrument.span('build_query_engine', rows=len(df)):
+            engine = QueryEngine(df)
+        _memo.clear()
+        _memo[key] = engine
+    return _memo[key]
+
+
+def filter_table(csv_path=None, **filters):
+    """Rows of the impact table matching QueryEngine.select(**filters)"""
+    engine = load_engine(csv_path)
+    with instrument.span('query', **{k: str(v) for k, v in filters.items()}):
+        rows = engine.select(**filters)
+    instrument.count('rows_selected', len(rows))
+    return engine.frame(rows)
+
+
+def _names(text):
+    return [name.strip() for name in text.split(',') if name.strip()]
+
+
+def _categories(text):
+    names = _names(text)
+    unknown = [name for name in names if name not in CATEGORIES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f'unknown categories: {", ".join(unknown)}; '
+                                         f'expected names from {", ".join(CATEGORIES)}')
+    return names
+
+
+def _date(text):
+    try:
+        day_numbers(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'not a YYYY-MM-DD date: {text!r}') from None
+    return text
+
+
+def _bbox(text):
+    try:
+        bbox = tuple(float(v) for v in text.split(','))
+    except ValueError:
+        bbox = ()
+    if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        raise argparse.ArgumentTypeError('expected west,south,east,north')
+    return bbox
+
+
+def add_arguments(parser):
+    """Add the row filters (--categories, --admin-level, --start, --end, --bbox)"""
+    group = parser.add_argument_group('row filters')
+    group.add_argument('--categories', type=_categories, default=[], metavar='NAMES',
+                       help='Only rows in any of these comma-separated impact categories')
+    group.add_argument('--admin-level', type=_names, default=[], metavar='LEVELS',
+                       help='Only rows with any of these comma-separated admin levels')
+    group.add_argument('--start', type=_date, metavar='DATE',
+                       help='Only rows affected on or after this date')
+    group.add_argument('--end', type=_date, metavar='DATE',
+                       help='Only rows affected on or before this date')
+    group.add_argument('--bbox', type=_bbox, metavar='W,S,E,N',
+                       help='Only rows inside this bounding box')
+
+
+def filters_from(args):
+    """select() keyword arguments of parsed add_arguments flags"""
+    return {
+        'categories': args.categories,
+        'admin_levels': args.admin_level,
+        'start': args.start,
+        'end': args.end,
+        'bbox': args.bbox,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Select rows of the impact table')
+    add_arguments(parser)
+    parser.add_argument('--output', help='Write the selected rows to this CSV')
+    args = parser.parse_args()
+
+    subset = filter_table(**filters_from(args))
+    if args.output:
+        columns = [c for c in subset.columns if c not in ('duration', 'Impact Days')]
+        subset[columns].to_csv(args.output, index=False, date_format='%Y-%m-%d')
+        print(f'{len(subset)} rows written to {args.output}')
+    else:
+        print(subset[['location', 'admin_level', 'start_date', 'end_date', 'categories']]
+              .to_string())
@@ -0,0 +1,426 @@
+"""Local HTTP service for the affected locations.
+
+The map generators write one static page holding every feature. Here the
+parsed table stays resident in one process and a page asks for only the
+features it shows:
+
+    GET /                  the map page (see QueryLayer)
+    GET /api/meta          categories, day range and row count
+    GET /api/features      FeatureCollection of the matching rows
+    GET /api/boundary      simplified Ningbo.json
+
+/api/features takes any of
+
+    start, end     YYYY-MM-DD; rows whose [start_date, end_date] overlaps
+                   the range (one of them alone is an open range)
+    categories     comma-separated names from common.categories; rows in
+                   any of them
+    bbox           west,south,east,north in degrees
+
+Features are JSON-encoded once at startup; a query is a common.query
+selection over the resident table followed by a byte join. Responses
+carry an ETag derived from the data version and the normalized query, so
+browsers revalidate with If-None-Match and get 304s, are gzip-compressed
+when the client accepts it, and the most recent ones are kept in memory.
+
+Only the standard library is used, and the server binds to 127.0.0.1 by
+default, so it can be started on port 0 and queried from a test.
+"""
+import gzip
+import json
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from branca.element import MacroElement
+from jinja2 import Template
+
+from common import data_access, instrument
+from common.boundary import load_simplified_boundary
+from common.categories import CATEGORIES
+from common.query import QueryEngine
+from common.timeline import day_numbers
+
+# Responses kept per server, and the size below which gzip is not worth it
+CACHE_ENTRIES = 256
+GZIP_MIN_BYTES = 1024
+
+
+def _encode(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FeatureIndex:
+    """Resident impact table (a common.query engine) and its pre-encoded features.
+
+    df holds the rows (latitude, longitude, start_date, end_date and
+    categories) and features their GeoJSON features in the same order.
+    version identifies the data and goes into every ETag.
+    """
+
+    def __init__(self, df, features, version):
+        if len(df) != len(features):
+            raise ValueError(f'{len(df)} rows but {len(features)} features')
+        self.engine = QueryEngine(df)
+        self.features = [_encode(feature) for feature in features]
+        self.version = version
+
+    def __len__(self):
+        return len(self.features)
+
+    def meta(self):
+        return {
+            'version': self.version,
+            'rows': len(self),
+            'categories': list(CATEGORIES),
+            'first': int(self.engine.starts[0]) if len(self) else 0,
+            'last': int(self.engine.ends[-1]) if len(self) else 0,
+        }
+
+    def select(self, start=None, end=None, categories=(), bbox=None):
+        """Row ids matching a normalized query (see parse_query)"""
+        return self.engine.select(categories, start=start, end=end, bbox=bbox)
+
+    def collection(self, rows):
+        """FeatureCollection of the given rows as UTF-8 JSON"""
+        features = b','.join([self.features[i] for i in rows.tolist()])
+        return b'{"type":"FeatureCollection","features":[' + features + b']}'
+
+
+def _day(value, name):
+    try:
+        return int(day_numbers(value))
+    except ValueError:
+        raise ValueError(f'{name} must be a YYYY-MM-DD date, got {value!r}') from None
+
+
+def parse_query(params):
+    """(start, end, categories, bbox) of /api/features query parameters.
+
+    params maps names to lists of values, as from urllib.parse.parse_qs.
+    Raises ValueError for malformed values or unknown categories.
+    """
+    def value(name):
+        values = params.get(name)
+        return values[-1] if values else None
+
+    start = value('start')
+    end = value('end')
+    start = _day(start, 'start') if start else None
+    end = _day(end, 'end') if end else None
+    if start is not None and end is not None and start > end:
+        raise ValueError('start is after end')
+
+    names = sorted({name.strip() for name in (value('categories') or '').split(',')
+                    if name.strip()})
+    unknown = [name for name in names if name not in CATEGORIES]
+    if unknown:
+        raise ValueError(f'Unknown categories: {", ".join(unknown)}')
+
+    bbox = value('bbox')
+    if bbox:
+        try:
+            bbox = tuple(float(v) for v in bbox.split(','))
+        except ValueError:
+            bbox = ()
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise ValueError('bbox must be west,south,east,north')
+    else:
+        bbox = None
+    return start, end, tuple(names), bbox
+
+
+class _Response:
+    """Body of a cacheable response, with its gzip version made on first use"""
+
+    def __init__(self, body, content_type, etag):
+        self.body = body
+        self.content_type = content_type
+        self.etag = etag
+        self._compressed = None
+
+    def compressed(self):
+        if self._compressed is None:
+            self._compressed = gzip.compress(self.body, compresslevel=6)
+        return self._compressed
+
+
+class MapServer(ThreadingHTTPServer):
+    """HTTP server over a FeatureIndex; page is the HTML served at /"""
+
+    daemon_threads = True
+
+    def __init__(self, address, index, page=None, cache_entries=CACHE_ENTRIES, quiet=False):
+        super().__init__(address, _Handler)
+        self.index = index
+        self.quiet = quiet
+        self.cache_entries = cache_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._static = {
+            '/api/meta': self._response(_encode(index.meta()), 'application/json', 'meta'),
+        }
+        if page is not None:
+            self._static['/'] = self._response(page.encode('utf-8'), 'text/html; charset=utf-8',
+                                               'page')
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def _response(self, body, content_type, key):
+        etag = f'"{self.index.version}-{data_access.digest(repr(key))}"'
+        return _Response(body, content_type, etag)
+
+    def static(self, path):
+        if path == '/api/boundary' and path not in self._static:
+            # Simplified on first request; the result is cached on disk
+            self._static[path] = self._response(_encode(load_simplified_boundary(zoom=13)),
+                                                'application/json', 'boundary')
+        return self._static.get(path)
+
+    def features(self, query):
+        """Cached response of a normalized /api/features query"""
+        with self._lock:
+            if query in self._cache:
+                self._cache.move_to_end(query)
+                return self._cache[query]
+        with instrument.span('query_features'):
+            rows = self.index.select(*query)
+            response = self._response(self.index.collection(rows), 'application/geo+json',
+                                      ('features',) + query)
+        instrument.count('features_served', len(rows))
+        with self._lock:
+            self._cache[query] = response
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return response
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'TyphoonMap/1.0'
+
+    def do_GET(self):
+        self._get(head=False)
+
+    def do_HEAD(self):
+        self._get(head=True)
+
+    def _get(self, head):
+        url = urlsplit(self.path)
+        if url.path == '/api/features':
+            try:
+                query = parse_query(parse_qs(url.query))
+            except ValueError as e:
+                self._error(HTTPStatus.BAD_REQUEST, str(e), head)
+                return
+            response = self.server.features(query)
+        else:
+            response = self.server.static(url.path)
+        if response is None:
+            self._error(HTTPStatus.NOT_FOUND, f'No such resource: {url.path}', head)
+            return
+        self._send(response, head)
+
+    def _send(self, response, head):
+        accepts_gzip = 'gzip' in self.headers.get('Accept-Encoding', '')
+        compress = accepts_gzip and len(response.body) >= GZIP_MIN_BYTES
+        # The two encodings are different representations, so their tags differ
+        etag = response.etag[:-1] + '-gz"' if compress else response.etag
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        body = response.compressed() if compress else response.body
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', response.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        # Always revalidate; unchanged data costs a 304
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _error(self, status, message, head):
+        body = _encode({'error': message})
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def make_server(index, page=None, host='127.0.0.1', port=8000, **options):
+    """A MapServer bound to host:port (port 0 picks a free one), not yet serving"""
+    return MapServer((host, port), index, page, **options)
+
+
+def serve(index, page=None, host='127.0.0.1', port=8000, **options):
+    """Serve until interrupted"""
+    server = make_server(index, page, host, port, **options)
+    print(f'Serving {len(index)} locations on {server.url} (Ctrl+C to stop)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class QueryLayer(MacroElement):
+    """Circle markers loaded from the /api/features endpoint of a MapServer.
+
+    Only the rows active on the selected day, in the selected categories
+    and inside the current view (padded by a quarter on every side) are
+    requested; panning within the loaded area does not request again.
+    Features may carry 'popup', 'location' (tooltip) and 'style'
+    properties; style defaults to the style argument. date_input is the id
+    of an <input type="date"> kept in sync with the day slider.
+    """
+
+    _template = Template("""
+        {% macro header(this, kwargs) %}
+            <style>
+                .query-layer { background: rgba(255,255,255,0.9); padding: 6px 10px;
+                    border-radius: 4px; box-shadow: 0 1px 5px rgba(0,0,0,0.4); font: 12px Arial; }
+                .query-layer input[type=range] { width: 240px; vertical-align: middle; }
+                .query-layer span { display: inline-block; min-width: 150px; margin-left: 6px; }
+                .query-layer .categories { margin-top: 6px; max-height: 180px; overflow-y: auto; }
+                .query-layer label { display: block; }
+            </style>
+        {% endmacro %}
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function() {
+                var map = {{ this._parent.get_name() }};
+                var api = {{ this.url|tojson }};
+                var style = {{ this.style|tojson }};
+                var renderer = L.canvas();
+                var group = L.featureGroup().addTo(map);
+                var dateInput = document.getElementById({{ this.date_input|tojson }});
+                var slider, label, boxes = [];
+                var day = null, loaded = null, pending = null;
+
+                function iso(d) { return new Date(d * 86400000).toISOString().slice(0, 10); }
+                function selected() {
+                    return boxes.filter(function(b) { return b.checked; })
+                                .map(function(b) { return b.value; }).join(',');
+                }
+                // Padded view, rounded outward so nearby views share a cached response
+                function paddedBox() {
+                    var b = map.getBounds().pad(0.25);
+                    return [Math.floor(b.getWest() * 100) / 100, Math.floor(b.getSouth() * 100) / 100,
+                            Math.ceil(b.getEast() * 100) / 100, Math.ceil(b.getNorth() * 100) / 100];
+                }
+                function covers(box, bounds) {
+                    return box[0] <= bounds.getWest() && box[1] <= bounds.getSouth() &&
+                           box[2] >= bounds.getEast() && box[3] >= bounds.getNorth();
+                }
+
+                function refresh() {
+                    if (day === null) return;
+                    var categories = selected();
+                    if (loaded && loaded.day === day && loaded.categories === categories &&
+                            covers(loaded.box, map.getBounds())) return;
+                    var box = paddedBox();
+                    var params = new URLSearchParams({start: iso(day), end: iso(day), bbox: box.join(',')});
+                    if (categories) params.set('categories', categories);
+                    if (pending) pending.abort();
+                    pending = new AbortController();
+                    var query = {day: day, categories: categories, box: box};
+                    fetch(api + '/features?' + params, {signal: pending.signal})
+                        .then(function(response) {
+                            if (!response.ok) throw new Error(response.status + ' ' + response.url);
+                            return response.json();
+                        })
+                        .then(function(data) {
+                            group.clearLayers();
+                            data.features.forEach(function(feature) {
+                                var p = feature.properties;
+                                var c = feature.geometry.coordinates;
+                                var layer = L.circleMarker([c[1], c[0]],
+                                    Object.assign({renderer: renderer}, style, p.style));
+                                if (p.popup) layer.bindPopup(p.popup);
+                                if (p.location) layer.bindTooltip(p.location);
+                                group.addLayer(layer);
+                            });
+                            loaded = query;
+                            label.textContent = iso(day).replace(/-/g, '/') + ' (' + data.features.length + ' in view)';
+                        })
+                        .catch(function(error) {
+                            if (error.name !== 'AbortError') console.error('Error loading features:', error);
+                        });
+                }
+
+                function show(d) {
+                    day = Math.max(Number(slider.min), Math.min(Number(slider.max), d));
+                    slider.value = day;
+                    if (dateInput) dateInput.value = iso(day);
+                    refresh();
+                }
+
+                var control = L.control({position: {{ this.position|tojson }}});
+                control.onAdd = function() {
+                    var div = L.DomUtil.create('div', 'query-layer');
+                    slider = L.DomUtil.create('input', '', div);
+                    slider.type = 'range';
+                    label = L.DomUtil.create('span', '', div);
+                    var list = L.DomUtil.create('div', 'categories', div);
+                    L.DomEvent.disableClickPropagation(div);
+                    L.DomEvent.disableScrollPropagation(div);
+                    div.list = list;
+                    slider.addEventListener('input', function() { show(Number(slider.value)); });
+                    return div;
+                };
+                control.addTo(map);
+                map.on('moveend', refresh);
+
+                fetch(api + '/meta')
+                    .then(function(response) { return response.json(); })
+                    .then(function(meta) {
+                        slider.min = meta.first;
+                        slider.max = meta.last;
+                        var list = control.getContainer().list;
+                        meta.categories.forEach(function(name) {
+                            var item = L.DomUtil.create('label', '', list);
+                            var box = L.DomUtil.create('input', '', item);
+                            box.type = 'checkbox';
+                            box.value = name;
+                            box.addEventListener('change', refresh);
+                            item.appendChild(document.createTextNode(' ' + name));
+                            boxes.push(box);
+                        });
+                        if (dateInput) {
+                            dateInput.min = iso(meta.first);
+                            dateInput.max = iso(meta.last);
+                            dateInput.addEventListener('change', function() {
+                                if (this.value) show(Math.floor(Date.parse(this.value) / 86400000));
+                            });
+                        }
+                        show(meta.first);
+                    })
+                    .catch(function(error) { console.error('Error loading metadata:', error); });
+                return {show: show, group: group, refresh: refresh};
+            })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, url='api', style=None, date_input=None, position='bottomleft'):
+        super().__init__()
+        self._name = 'QueryLayer'
+        self.url = url
+        self.style = style or {}
+        self.date_input = date_input
+        self.position = position
@@ -0,0 +1,171 @@
+"""Spatial index over affected locations and storm-track buffer queries.
+
+The index buckets sites into a regular lat/lon grid and sorts them by cell
+key, so the sites of any run of cells in one grid row form a contiguous
+slice found with a single searchsorted. A radius query turns each query
+point into a handful of such slices, gathers the candidates and keeps the
+ones whose haversine distance is within the radius. Every step is a NumPy
+call over all query points at once; memory is bounded by processing the
+candidates in chunks.
+"""
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Upper bound on candidate pairs examined per chunk of a radius query
+CHUNK_PAIRS = 4_000_000
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km; the arguments broadcast against each other"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float))
+                              for v in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def _wrap_lon(lons):
+    return (np.asarray(lons, dtype=float) + 180) % 360 - 180
+
+
+def build_site_index(lats, lons, cell_deg=0.5):
+    """Grid index over site coordinates; site ids are positions in the inputs"""
+    lats = np.asarray(lats, dtype=float)
+    lons = _wrap_lon(lons)
+    ncols = int(np.ceil(360 / cell_deg))
+    rows = np.floor((lats + 90) / cell_deg).astype(np.int64)
+    cols = np.floor((lons + 180) / cell_deg).astype(np.int64) % ncols
+    keys = rows * ncols + cols
+    order = np.argsort(keys, kind='stable')
+    return {
+        'cell_deg': cell_deg,
+        'ncols': ncols,
+        'keys': keys[order],
+        'order': order,
+        'lat': lats,
+        'lon': lons,
+    }
+
+
+def _expand(starts, counts):
+    """Concatenated aranges start[i] .. start[i] + count[i]"""
+    total = int(counts.sum())
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + (np.arange(total) - offsets)
+
+
+def _candidate_slices(index, lats, lons, radius_km):
+    """For every query point, the slices of index['keys'] that may hold hits.
+
+    Returns (query ids, lo, hi) with one entry per contiguous run of cells.
+    """
+    cell, ncols = index['cell_deg'], index['ncols']
+    dlat = np.degrees(radius_km / EARTH_RADIUS_KM)
+    lat_lo = np.clip(lats - dlat, -90, 90)
+    lat_hi = np.clip(lats + dlat, -90, 90)
+    coslat = np.cos(np.radians(np.maximum(np.abs(lat_lo), np.abs(lat_hi))))
+    dlon = np.where(coslat > 1e-9, dlat / np.maximum(coslat, 1e-9), 360.0)
+
+    row0 = np.floor((lat_lo + 90) / cell).astype(np.int64)
+    row1 = np.floor((lat_hi + 90) / cell).astype(np.int64)
+    col0 = np.floor((lons - dlon + 180) / cell).astype(np.int64)
+    col1 = np.floor((lons + dlon + 180) / cell).astype(np.int64)
+    full = col1 - col0 + 1 >= ncols
+    col0 = np.where(full, 0, col0)
+    col1 = np.where(full, ncols - 1, col1)
+
+    # One entry per (query, grid row)
+    nrows = row1 - row0 + 1
+    query = np.repeat(np.arange(len(lats)), nrows)
+    row = _expand(row0, nrows)
+    c0, c1 = col0[query], col1[query]
+
+    # Spans crossing the antimeridian become two spans
+    spans = [(query, row, np.maximum(c0, 0), np.minimum(c1, ncols - 1))]
+    left = c0 < 0
+    spans.append((query[left], row[left], c0[left] + ncols, np.full(left.sum(), ncols - 1)))
+    right = c1 >= ncols
+    spans.append((query[right], row[right], np.zeros(right.sum(), np.int64), c1[right] - ncols))
+    query, row, s0, s1 = (np.concatenate(parts) for parts in zip(*spans))
+
+    keys = index['keys']
+    lo = np.searchsorted(keys, row * ncols + s0, side='left')
+    hi = np.searchsorted(keys, row * ncols + s1, side='right')
+    return query, lo, hi
+
+
+def query_radius(index, lats, lons, radius_km, chunk_pairs=CHUNK_PAIRS):
+    """Sites within radius_km of each query point.
+
+    Returns (offsets, sites, distances) in CSR layout: the hits of query i
+    are sites[offsets[i]:offsets[i + 1]], sorted by site id, with their
+    distances in km.
+    """
+    lats = np.atleast_1d(np.asarray(lats, dtype=float))
+    lons = _wrap_lon(np.atleast_1d(lons))
+    query, lo, hi = _candidate_slices(index, lats, lons, radius_km)
+    counts = hi - lo
+    nonempty = counts > 0
+    query, lo, counts = query[nonempty], lo[nonempty], counts[nonempty]
+    order = np.argsort(query, kind='stable')
+    query, lo, counts = query[order], lo[order], counts[order]
+
+    hit_query, hit_site, hit_dist = [], [], []
+    # Split the slices into chunks of at most chunk_pairs candidates
+    bounds = np.cumsum(counts)
+    start = 0
+    while start < len(counts):
+        base = bounds[start - 1] if start else 0
+        stop = max(start + 1, int(np.searchsorted(bounds, base + chunk_pairs, side='right')))
+        q = np.repeat(query[start:stop], counts[start:stop])
+        sites = index['order'][_expand(lo[start:stop], counts[start:stop])]
+        dist = haversine_km(lats[q], lons[q], index['lat'][sites], index['lon'][sites])
+        keep = dist <= radius_km
+        hit_query.append(q[keep])
+        hit_site.append(sites[keep])
+        hit_dist.append(dist[keep])
+        start = stop
+
+    if hit_query:
+        q, sites, dist = (np.concatenate(parts) for parts in (hit_query, hit_site, hit_dist))
+    else:
+        q = sites = np.zeros(0, dtype=np.int64)
+        dist = np.zeros(0)
+    order = np.lexsort((sites, q))
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(q, minlength=len(lats)))))
+    return offsets, sites[order], dist[order]
+
+
+def track_buffer(index, storm, radius_km):
+    """Sites within radius_km of every fix of a storm track.
+
+    storm is a dict as returned by common.best_track.get_storm. Returns a
+    DataFrame with one row per (fix, site) pair: track_index, time, site
+    and distance_km.
+    """
+    offsets, sites, dist = query_radius(index, storm['lats'], storm['lons'], radius_km)
+    track_index = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    return pd.DataFrame({
+        'track_index': track_index,
+        'time': np.asarray(storm['times'])[track_index],
+        'site': sites,
+        'distance_km': dist,
+    })
+
+
+def sites_near_track(df, storm, radius_km, index=None):
+    """Rows of an impact table that came within radius_km of the track.
+
+    Adds track_distance_km (closest fix distance) and track_time (time of
+    that fix), so the map generators can use the result directly.
+    """
+    if index is None:
+        index = build_site_index(df['latitude'].to_numpy(), df['longitude'].to_numpy())
+    pairs = track_buffer(index, storm, radius_km)
+    closest = pairs.sort_values('distance_km').drop_duplicates('site').sort_values('site')
+    near = df.iloc[closest['site'].to_numpy()].copy()
+    near['track_distance_km'] = closest['distance_km'].to_numpy()
+    near['track_time'] = closest['time'].to_numpy()
+    return near
@@ -0,0 +1,480 @@
+"""Mapbox Vector Tile pyramid of the affected locations and the boundary.
+
+Inlining every feature in the HTML stops working at national scale. This
+module cuts the points and the district boundary into Mapbox Vector Tiles
+(MVT 2.1, protobuf encoded here without extra dependencies) for a range of
+zooms, and writes them either as a {z}/{x}/{y}.pbf directory that any
+static file server can serve, or packed into one MBTiles (SQLite) file.
+A Leaflet map then only loads the tiles in view (layers.add_tile_layer).
+
+Every tile holds up to two layers:
+
+    locations   one point per location; below the top zoom the points are
+                thinned to one per THIN_PX x THIN_PX screen pixels, keeping
+                the highest-priority point of each cell, and a 'count'
+                property says how many locations it stands for
+    boundary    the districts of Ningbo.json, simplified for each zoom by
+                common.boundary and clipped to the tile
+
+Usage (from the repository root):
+    python -m common.tiles --dir tiles --mbtiles ningbo.mbtiles --maxzoom 14
+"""
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+
+import numpy as np
+
+from common import data_access
+from common.boundary import KEEP_PROPERTIES, load_simplified_boundary
+
+EXTENT = 4096
+# Tile units copied from the neighbouring tiles, so markers and strokes
+# crossing a tile edge are not cut off
+BUFFER = 256
+THIN_PX = 4
+MIN_ZOOM = 6
+MAX_ZOOM = 14
+POINT_LAYER = 'locations'
+BOUNDARY_LAYER = 'boundary'
+MAX_LAT = 85.0511287798
+
+POINT, POLYGON = 1, 3
+
+
+# Protobuf encoding
+
+def _varint(value, out):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _key(field, wire_type, out):
+    _varint(field << 3 | wire_type, out)
+
+
+def _bytes(field, data, out):
+    _key(field, 2, out)
+    _varint(len(data), out)
+    out += data
+
+
+def _packed(field, values, out):
+    body = bytearray()
+    for value in values:
+        _varint(value, body)
+    _bytes(field, body, out)
+
+
+def _zigzag(n):
+    return n << 1 if n >= 0 else (-n << 1) - 1
+
+
+def _value(value):
+    out = bytearray()
+    if isinstance(value, bool):
+        _key(7, 0, out)
+        _varint(int(value), out)
+    elif isinstance(value, int):
+        if value >= 0:
+            _key(5, 0, out)
+            _varint(value, out)
+        else:
+            _key(6, 0, out)
+            _varint(_zigzag(value), out)
+    elif isinstance(value, float):
+        _key(3, 1, out)
+        out += np.float64(value).astype('<f8').tobytes()
+    else:
+        _bytes(1, str(value).encode('utf-8'), out)
+    return bytes(out)
+
+
+def encode_layer(name, features, extent=EXTENT):
+    """One MVT layer; features are (geometry type, geometry, properties)"""
+    keys, values = {}, {}
+    out = bytearray()
+    _key(15, 0, out)
+    _varint(2, out)
+    _bytes(1, name.encode('utf-8'), out)
+    for geometry_type, geometry, properties in features:
+        tags = []
+        for key, value in properties.items():
+            if value is None or (isinstance(value, float) and value != value):
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+        feature = bytearray()
+        _packed(2, tags, feature)
+        _key(3, 0, feature)
+        _varint(geometry_type, feature)
+        _packed(4, geometry, feature)
+        _bytes(2, feature, out)
+    for key in keys:
+        _bytes(3, key.encode('utf-8'), out)
+    for _, value in values:
+        _bytes(4, _value(value), out)
+    _key(5, 0, out)
+    _varint(extent, out)
+    return bytes(out)
+
+
+def encode_tile(layers):
+    """MVT tile bytes from {layer name: features}"""
+    out = bytearray()
+    for name, features in layers.items():
+        if features:
+            _bytes(3, encode_layer(name, features), out)
+    return bytes(out)
+
+
+def _command(command, count):
+    return (command & 7) | (count << 3)
+
+
+def point_geometry(x, y):
+    return [_command(1, 1), _zigzag(x), _zigzag(y)]
+
+
+def polygon_geometry(rings):
+    """Geometry commands of (x, y) integer rings, open, exteriors before their holes"""
+    commands = []
+    cx = cy = 0
+    for ring in rings:
+        x, y = ring[0]
+        commands += [_command(1, 1), _zigzag(x - cx), _zigzag(y - cy)]
+        commands.append(_command(2, len(ring) - 1))
+        for nx, ny in ring[1:]:
+            commands += [_zigzag(nx - x), _zigzag(ny - y)]
+            x, y = nx, ny
+        commands.append(_command(7, 1))
+        cx, cy = x, y
+    return commands
+
+
+# Projection and tiling
+
+def world_pixels(lon, lat, zoom):
+    """Web Mercator pixel coordinates at a zoom, 256 pixels per tile"""
+    scale = 256.0 * 2 ** zoom
+    lon = np.asarray(lon, dtype=float)
+    sin = np.sin(np.radians(np.clip(np.asarray(lat, dtype=float), -MAX_LAT, MAX_LAT)))
+    x = (lon + 180) / 360 * scale
+    y = (0.5 - np.log((1 + sin) / (1 - sin)) / (4 * np.pi)) * scale
+    return x, y
+
+
+def thin_points(px, py, priority=None, cell_px=THIN_PX):
+    """Keep one point per cell_px square of pixels.
+
+    Returns the kept indices (the highest priority in each cell, else the
+    first) and the number of points each one stands for.
+    """
+    cx = np.floor(px / cell_px).astype(np.int64)
+    cy = np.floor(py / cell_px).astype(np.int64)
+    rank = np.zeros(len(cx)) if priority is None else -np.asarray(priority, dtype=float)
+    order = np.lexsort((np.arange(len(cx)), rank, cy, cx))
+    cx, cy = cx[order], cy[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (cx[1:] != cx[:-1]) | (cy[1:] != cy[:-1])
+    starts = np.flatnonzero(first)
+    counts = np.diff(np.append(starts, len(order)))
+    return order[starts], counts
+
+
+def point_tiles(px, py, zoom):
+    """(tile x, tile y, point ids, local x, local y) for every tile holding points.
+
+    Points within BUFFER of a tile edge are also placed in the neighbour.
+    """
+    units = EXTENT / 256.0
+    tx = np.floor(px / 256).astype(np.int64)
+    ty = np.floor(py / 256).astype(np.int64)
+    lx = (px - tx * 256) * units
+    ly = (py - ty * 256) * units
+    ntiles = 2 ** zoom
+    parts = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            near = np.ones(len(px), dtype=bool)
+            if dx:
+                near &= (lx < BUFFER) if dx < 0 else (lx > EXTENT - BUFFER)
+            if dy:
+                near &= (ly < BUFFER) if dy < 0 else (ly > EXTENT - BUFFER)
+            ids = np.flatnonzero(near & (tx + dx >= 0) & (tx + dx < ntiles)
+                                 & (ty + dy >= 0) & (ty + dy < ntiles))
+            parts.append((ids, tx[ids] + dx, ty[ids] + dy,
+                          lx[ids] - dx * EXTENT, ly[ids] - dy * EXTENT))
+    ids, x, y, lx, ly = (np.concatenate(p) for p in zip(*parts))
+    order = np.lexsort((ids, y, x))
+    ids, x, y = ids[order], x[order], y[order]
+    lx, ly = np.round(lx[order]).astype(np.int64), np.round(ly[order]).astype(np.int64)
+    bounds = np.flatnonzero(np.diff(x) | np.diff(y)) + 1
+    for part in np.split(np.arange(len(ids)), bounds):
+        if len(part):
+            yield int(x[part[0]]), int(y[part[0]]), ids[part], lx[part], ly[part]
+
+
+def _clip(points, axis, bound, keep_above):
+    """Sutherland-Hodgman clip of a closed ring against one axis-aligned line"""
+    inside = points[:, axis] >= bound if keep_above else points[:, axis] <= bound
+    if inside.all() or not inside.any():
+        return points if inside.all() else points[:0]
+    prev = np.roll(points, 1, axis=0)
+    crossing = inside != np.roll(inside, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (bound - prev[:, axis]) / (points[:, axis] - prev[:, axis])
+        cut = prev + t[:, None] * (points - prev)
+    out = np.stack([cut, points], axis=1).reshape(-1, 2)
+    return out[np.stack([crossing, inside], axis=1).reshape(-1)]
+
+
+def _signed_area(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)) / 2
+
+
+def clip_ring(ring, exterior):
+    """Ring in tile units clipped to the buffered tile, as open integer points.
+
+    Exterior rings come out with positive area in tile coordinates (y down)
+    and holes with negative area, as MVT requires; None if nothing is left.
+    Concave rings may keep zero-width edges along the tile border, which do
+    not show when the polygon is filled.
+    """
+    for axis in (0, 1):
+        ring = _clip(ring, axis, -BUFFER, True)
+        ring = _clip(ring, axis, EXTENT + BUFFER, False)
+        if not len(ring):
+            return None
+    ring = np.round(ring).astype(np.int64)
+    keep = np.any(ring != np.roll(ring, 1, axis=0), axis=1)
+    ring = ring[keep]
+    if len(ring) < 3:
+        return None
+    area = _signed_area(ring)
+    if area == 0:
+        return None
+    if (area > 0) != exterior:
+        ring = ring[::-1]
+    return ring.tolist()
+
+
+def polygon_tiles(geojson, zoom, keep_properties=KEEP_PROPERTIES):
+    """(tile x, tile y, feature) for every tile a boundary feature touches"""
+    units = EXTENT / 256.0
+    pad = BUFFER / units
+    ntiles = 2 ** zoom
+    for feature in geojson['features']:
+        geometry = feature['geometry']
+        if geometry is None or geometry['type'] not in ('Polygon', 'MultiPolygon'):
+            continue
+        polygons = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+        projected = []
+        for polygon in polygons:
+            rings = []
+            for ring in polygon:
+                coords = np.asarray(ring, dtype=float)[:-1]
+                if len(coords) >= 3:
+                    rings.append(np.column_stack(world_pixels(coords[:, 0], coords[:, 1], zoom)))
+            if rings:
+                projected.append(rings)
+        if not projected:
+            continue
+        properties = {key: feature['properties'].get(key) for key in keep_properties}
+        allpoints = np.concatenate([p[0] for p in projected])
+        x0, y0 = np.floor((allpoints.min(axis=0) - pad) / 256).astype(int)
+        x1, y1 = np.floor((allpoints.max(axis=0) + pad) / 256).astype(int)
+        for tx in range(max(x0, 0), min(x1, ntiles - 1) + 1):
+            for ty in range(max(y0, 0), min(y1, ntiles - 1) + 1):
+                origin = np.array([tx * 256.0, ty * 256.0])
+                rings = []
+                for polygon in projected:
+                    exterior = clip_ring((polygon[0] - origin) * units, True)
+                    if exterior is None:
+                        continue
+                    rings.append(exterior)
+                    for hole in polygon[1:]:
+                        clipped = clip_ring((hole - origin) * units, False)
+                        if clipped is not None:
+                            rings.append(clipped)
+                if rings:
+                    yield tx, ty, (POLYGON, polygon_geometry(rings), properties)
+
+
+def iter_tiles(points=None, boundary_path=None, minzoom=MIN_ZOOM, maxzoom=MAX_ZOOM,
+               priority=None, thin_px=THIN_PX, boundary=True):
+    """Yield (z, x, y, MVT bytes) for every non-empty tile of the pyramid.
+
+    points is a DataFrame with longitude and latitude columns; every other
+    column becomes a feature property. priority names the column preferred
+    when thinning (for example 'days'). boundary adds the district layer.
+    """
+    if points is not None:
+        points = points.dropna(subset=['longitude', 'latitude'])
+        lon = points['longitude'].to_numpy(dtype=float)
+        lat = points['latitude'].to_numpy(dtype=float)
+        columns = [c for c in points.columns if c not in ('longitude', 'latitude')]
+        values = {c: points[c].tolist() for c in columns}
+        rank = None if priority is None else points[priority].to_numpy(dtype=float)
+
+    for zoom in range(minzoom, maxzoom + 1):
+        tiles = {}
+        if points is not None and len(points):
+            px, py = world_pixels(lon, lat, zoom)
+            if zoom < maxzoom and thin_px:
+                keep, counts = thin_points(px, py, rank, thin_px)
+            else:
+                keep, counts = np.arange(len(px)), np.ones(len(px), dtype=np.int64)
+            counts = counts.tolist()
+            for tx, ty, ids, lx, ly in point_tiles(px[keep], py[keep], zoom):
+                features = tiles.setdefault((tx, ty), {}).setdefault(POINT_LAYER, [])
+                for i, x, y in zip(ids.tolist(), lx.tolist(), ly.tolist()):
+                    row = int(keep[i])
+                    properties = {c: values[c][row] for c in columns}
+                    properties['count'] = counts[i]
+                    features.append((POINT, point_geometry(x, y), properties))
+        if boundary:
+            geojson = load_simplified_boundary(zoom=zoom, path=boundary_path)
+            for tx, ty, feature in polygon_tiles(geojson, zoom):
+                tiles.setdefault((tx, ty), {}).setdefault(BOUNDARY_LAYER, []).append(feature)
+        for (tx, ty), layers in sorted(tiles.items()):
+            # Boundary first, so the locations are drawn on top of it
+            ordered = {name: layers.get(name) for name in (BOUNDARY_LAYER, POINT_LAYER)}
+            yield zoom, tx, ty, encode_tile(ordered)
+
+
+def tile_metadata(points=None, minzoom=MIN_ZOOM, maxzoom=MAX_ZOOM, name='typhoon impact'):
+    """MBTiles/TileJSON style metadata of a pyramid"""
+    layers = [{'id': BOUNDARY_LAYER, 'fields': {key: 'String' for key in KEEP_PROPERTIES},
+               'minzoom': minzoom, 'maxzoom': maxzoom}]
+    bounds = [-180, -MAX_LAT, 180, MAX_LAT]
+    if points is not None and len(points):
+        fields = {c: 'Number' if points[c].dtype.kind in 'iuf' else 'String'
+                  for c in points.columns if c not in ('longitude', 'latitude')}
+        fields['count'] = 'Number'
+        layers.append({'id': POINT_LAYER, 'fields': fields, 'minzoom': minzoom, 'maxzoom': maxzoom})
+        bounds = [float(points['longitude'].min()), float(points['latitude'].min()),
+                  float(points['longitude'].max()), float(points['latitude'].max())]
+    return {
+        'name': name,
+        'format': 'pbf',
+        'minzoom': minzoom,
+        'maxzoom': maxzoom,
+        'bounds': bounds,
+        'center': [(bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2, minzoom],
+        'vector_layers': layers,
+    }
+
+
+def write_tile_directory(directory, tiles, metadata):
+    """Write uncompressed {z}/{x}/{y}.pbf files plus metadata.json
+
+    The pyramid is written to a sibling directory that then replaces
+    directory, so no tile of an earlier export is left behind.
+    """
+    directory = os.path.normpath(directory)
+    building = f'{directory}.{os.getpid()}.tmp'
+    shutil.rmtree(building, ignore_errors=True)
+    count = 0
+    try:
+        os.makedirs(building)
+        for zoom, x, y, data in tiles:
+            folder = os.path.join(building, str(zoom), str(x))
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, f'{y}.pbf'), 'wb') as f:
+                f.write(data)
+            count += 1
+        with open(os.path.join(building, 'metadata.json'), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False)
+    except BaseException:
+        shutil.rmtree(building, ignore_errors=True)
+        raise
+    if os.path.exists(directory):
+        old = f'{directory}.{os.getpid()}.old'
+        os.replace(directory, old)
+        os.replace(building, directory)
+        shutil.rmtree(old, ignore_errors=True)
+    else:
+        os.replace(building, directory)
+    return count
+
+
+def write_mbtiles(path, tiles, metadata):
+    """Pack gzip-compressed tiles into one MBTiles file (TMS row order)"""
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE metadata (name TEXT, value TEXT);
+        CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER,
+                            tile_row INTEGER, tile_data BLOB);
+        CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+    """)
+    rows = {
+        'name': metadata['name'],
+        'format': metadata['format'],
+        'minzoom': str(metadata['minzoom']),
+        'maxzoom': str(metadata['maxzoom']),
+        'bounds': ','.join(str(v) for v in metadata['bounds']),
+        'center': ','.join(str(v) for v in metadata['center']),
+        'json': json.dumps({'vector_layers': metadata['vector_layers']}),
+    }
+    connection.executemany('INSERT INTO metadata VALUES (?, ?)', rows.items())
+    count = 0
+    for zoom, x, y, data in tiles:
+        connection.execute('INSERT INTO tiles VALUES (?, ?, ?, ?)',
+                           (zoom, x, (1 << zoom) - 1 - y, gzip.compress(data, mtime=0)))
+        count += 1
+    connection.commit()
+    connection.close()
+    return count
+
+
+def export_tiles(points=None, directory=None, mbtiles=None, minzoom=MIN_ZOOM,
+                 maxzoom=MAX_ZOOM, priority=None, thin_px=THIN_PX, boundary=True,
+                 boundary_path=None):
+    """Build the pyramid once and write it to a directory and/or an MBTiles file"""
+    metadata = tile_metadata(points, minzoom, maxzoom)
+    tiles = iter_tiles(points, boundary_path, minzoom, maxzoom, priority, thin_px, boundary)
+    if directory and mbtiles:
+        tiles = list(tiles)
+    count = 0
+    if directory:
+        count = write_tile_directory(directory, tiles, metadata)
+    if mbtiles:
+        count = write_mbtiles(mbtiles, tiles, metadata)
+    return count
+
+
+def impact_points(df):
+    """The impact table as the point columns of the tile layer"""
+    points = df[['longitude', 'latitude', 'location', 'Impact Days', 'admin_level', 'details']]
+    points = points.rename(columns={'Impact Days': 'days'})
+    points['start'] = df['start_date'].dt.strftime('%Y-%m-%d')
+    points['end'] = df['end_date'].dt.strftime('%Y-%m-%d')
+    return points
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export the impact table and boundary as vector tiles')
+    parser.add_argument('--dir', help='Directory of {z}/{x}/{y}.pbf tiles')
+    parser.add_argument('--mbtiles', help='MBTiles file')
+    parser.add_argument('--minzoom', type=int, default=MIN_ZOOM)
+    parser.add_argument('--maxzoom', type=int, default=MAX_ZOOM)
+    parser.add_argument('--thin-px', type=float, default=THIN_PX,
+                        help='Keep one location per N x N pixels below maxzoom (0 keeps all)')
+    args = parser.parse_args()
+    if not args.dir and not args.mbtiles:
+        parser.error('give --dir and/or --mbtiles')
+
+    points = impact_points(data_access.load_impact_table())
+    count = export_tiles(points, args.dir, args.mbtiles, args.minzoom, args.maxzoom,
+                         priority='days', thin_px=args.thin_px)
+    print(f'{count} tiles, zoom {args.minzoom}-{args.maxzoom}')
@@ -0,0 +1,205 @@
+"""Interval-encoded day slider for point features.
+
+TimestampedGeoJson wants one timestamp per feature per day and filters
+every feature on every slider tick, so a 30-day event over 100k sites puts
+3M timestamps in the page. Here each feature carries a single
+
+    "interval": [first day, last day]
+
+(days since 1970-01-01) and the page gets an index built once in Python:
+
+    start, by_start   feature start days sorted, and the feature order
+    end, by_end       the same for end days
+    counts            number of active features on every day of the range
+
+A feature is active on day d if start <= d <= end. Moving the slider from
+day a to day b only touches the features whose start or end falls between
+a and b, which two binary searches in the sorted arrays find, so a tick
+costs O(log n + k) for k features entering or leaving the map and the
+payload grows with n rather than n * days.
+"""
+import json
+
+import numpy as np
+from branca.element import MacroElement
+from jinja2 import Template
+
+
+def day_numbers(dates):
+    """Dates as integer days since 1970-01-01"""
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+
+
+def interval_index(start, end):
+    """Sorted start/end arrays and per-day active counts for day intervals"""
+    start = np.asarray(start, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+    by_start = np.argsort(start, kind='stable')
+    by_end = np.argsort(end, kind='stable')
+    starts, ends = start[by_start], end[by_end]
+    if len(start):
+        first, last = int(starts[0]), int(ends[-1])
+    else:
+        first = last = 0
+    days = np.arange(first, last + 1)
+    counts = (np.searchsorted(starts, days, side='right')
+              - np.searchsorted(ends, days, side='left'))
+    return {
+        'first': first,
+        'last': last,
+        'start': starts.tolist(),
+        'by_start': by_start.tolist(),
+        'end': ends.tolist(),
+        'by_end': by_end.tolist(),
+        'counts': counts.tolist(),
+    }
+
+
+def feature_index(features):
+    """interval_index over the 'interval' property of GeoJSON features"""
+    spans = np.array([f['properties']['interval'] for f in features],
+                     dtype=np.int64).reshape(-1, 2)
+    return interval_index(spans[:, 0], spans[:, 1])
+
+
+class IntervalTimeline(MacroElement):
+    """Circle markers shown on the days of their interval, with a day slider.
+
+    data is a FeatureCollection of Point features with an 'interval'
+    property, as a dict or a JSON string; index is interval_index over the
+    same features in the same order, or a JSON string. Features may carry
+    'popup', 'location' (tooltip) and 'style' properties; style defaults to
+    the style argument. date_input is the id of an <input type="date"> kept
+    in sync with the slider.
+    """
+
+    _template = Template("""
+        {% macro header(this, kwargs) %}
+            <style>
+                .interval-timeline { background: rgba(255,255,255,0.9); padding: 6px 10px;
+                    border-radius: 4px; box-shadow: 0 1px 5px rgba(0,0,0,0.4); font: 12px Arial; }
+                .interval-timeline button { width: 28px; margin-right: 6px; }
+                .interval-timeline input { width: 240px; vertical-align: middle; }
+                .interval-timeline span { display: inline-block; min-width: 150px; margin-left: 6px; }
+            </style>
+        {% endmacro %}
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function() {
+                var map = {{ this._parent.get_name() }};
+                var data = {{ this.data }};
+                var index = {{ this.index }};
+                var style = {{ this.style|tojson }};
+                var features = data.features;
+                var group = L.featureGroup().addTo(map);
+                var layers = features.map(function(feature) {
+                    var p = feature.properties;
+                    var c = feature.geometry.coordinates;
+                    var layer = L.circleMarker([c[1], c[0]], Object.assign({}, style, p.style));
+                    if (p.popup) layer.bindPopup(p.popup);
+                    if (p.location) layer.bindTooltip(p.location);
+                    return layer;
+                });
+
+                // First position in a sorted array with a[i] > x (upper) or a[i] >= x (lower)
+                function bound(a, x, upper) {
+                    var lo = 0, hi = a.length;
+                    while (lo < hi) {
+                        var mid = (lo + hi) >>> 1;
+                        if (a[mid] < x || (upper && a[mid] === x)) lo = mid + 1; else hi = mid;
+                    }
+                    return lo;
+                }
+                function each(order, from, to, test, action) {
+                    for (var k = from; k < to; k++) {
+                        var i = order[k];
+                        if (test(features[i].properties.interval)) action(layers[i]);
+                    }
+                }
+                function add(layer) { group.addLayer(layer); }
+                function remove(layer) { group.removeLayer(layer); }
+
+                var current = null;
+                function show(day) {
+                    day = Math.max(index.first, Math.min(index.last, day));
+                    if (current === null) {
+                        each(index.by_start, 0, bound(index.start, day, true),
+                             function(t) { return t[1] >= day; }, add);
+                    } else if (day > current) {
+                        var a = current;
+                        each(index.by_end, bound(index.end, a, false), bound(index.end, day, false),
+                             function(t) { return t[0] <= a; }, remove);
+                        each(index.by_start, bound(index.start, a, true), bound(index.start, day, true),
+                             function(t) { return t[1] >= day; }, add);
+                    } else if (day < current) {
+                        var b = current;
+                        each(index.by_start, bound(index.start, day, true), bound(index.start, b, true),
+                             function(t) { return t[1] >= b; }, remove);
+                        each(index.by_end, bound(index.end, day, false), bound(index.end, b, false),
+                             function(t) { return t[0] <= day; }, add);
+                    }
+                    current = day;
+                    slider.value = day;
+                    var iso = new Date(day * 86400000).toISOString().slice(0, 10);
+                    label.textContent = iso.replace(/-/g, '/') + ' (' + index.counts[day - index.first] + ' active)';
+                    if (dateInput) dateInput.value = iso;
+                }
+
+                var control = L.control({position: {{ this.position|tojson }}});
+                var slider, label, timer = null;
+                var dateInput = document.getElementById({{ this.date_input|tojson }});
+                control.onAdd = function() {
+                    var div = L.DomUtil.create('div', 'interval-timeline');
+                    var play = L.DomUtil.create('button', '', div);
+                    play.textContent = '▶';
+                    slider = L.DomUtil.create('input', '', div);
+                    slider.type = 'range';
+                    slider.min = index.first;
+                    slider.max = index.last;
+                    label = L.DomUtil.create('span', '', div);
+                    L.DomEvent.disableClickPropagation(div);
+                    slider.addEventListener('input', function() { show(Number(slider.value)); });
+                    play.addEventListener('click', function() {
+                        if (timer) {
+                            clearInterval(timer);
+                            timer = null;
+                            play.textContent = '▶';
+                            return;
+                        }
+                        if (current >= index.last) show(index.first);
+                        play.textContent = '❚❚';
+                        timer = setInterval(function() {
+                            if (current >= index.last) { play.click(); return; }
+                            show(current + 1);
+                        }, {{ this.interval }});
+                    });
+                    return div;
+                };
+                control.addTo(map);
+                if (dateInput) {
+                    dateInput.min = new Date(index.first * 86400000).toISOString().slice(0, 10);
+                    dateInput.max = new Date(index.last * 86400000).toISOString().slice(0, 10);
+                    dateInput.addEventListener('change', function() {
+                        if (this.value) show(Math.floor(Date.parse(this.value) / 86400000));
+                    });
+                }
+                show(index.first);
+                return {show: show, group: group};
+            })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, data, index=None, style=None, date_input=None,
+                 position='bottomleft', interval=500):
+        super().__init__()
+        self._name = 'IntervalTimeline'
+        if isinstance(data, str):
+            self.data = data
+        else:
+            self.data = json.dumps(data)
+            if index is None:
+                index = feature_index(data['features'])
+        self.index = index if isinstance(index, str) else json.dumps(index)
+        self.style = style or {}
+        self.date_input = date_input
+        self.position = position
+        self.interval = interval
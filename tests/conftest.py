@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# The tests import common/ the way the scripts do, from the repository root,
+# and share the synthetic tables of the benchmarks
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from synthetic import loaded_impact_frame  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def impact_table():
+    """Factory of synthetic impact tables as load_impact_table returns them:
+    impact_table(rows, **options), options as for synthetic.impact_frame"""
+    return loaded_impact_frame
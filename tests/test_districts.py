@@ -0,0 +1,94 @@
+"""common.districts against a plain ray cast over every ring edge."""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from common.boundary import _polygons
+from common.data_access import BOUNDARY_JSON, ROOT
+from common.districts import add_districts, assign_districts, prepare_district
+
+
+def ray_cast(lat, lon, geometry):
+    """Even-odd test of one point, half-open in y like common.districts"""
+    inside = False
+    for polygon in _polygons(geometry):
+        for ring in polygon:
+            for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+                if (y0 > lat) != (y1 > lat):
+                    if lon < x0 + (lat - y0) * (x1 - x0) / (y1 - y0):
+                        inside = not inside
+    return inside
+
+
+def brute_force(lats, lons, features):
+    result = []
+    for lat, lon in zip(lats, lons):
+        found = [i for i, f in enumerate(features) if ray_cast(lat, lon, f['geometry'])]
+        result.append(found[0] if found else -1)
+    return np.array(result)
+
+
+def square(west, south, east, north):
+    return [[west, south], [east, south], [east, north], [west, north], [west, south]]
+
+
+# A square with a hole, and a district of two parts, one inside that hole
+SYNTHETIC = [
+    {'properties': {'adcode': 1, 'name': 'Ring', 'level': 'district'},
+     'geometry': {'type': 'Polygon',
+                  'coordinates': [square(0, 0, 10, 10), square(3, 3, 7, 7)]}},
+    {'properties': {'adcode': 2, 'name': 'Parts', 'level': 'district'},
+     'geometry': {'type': 'MultiPolygon',
+                  'coordinates': [[square(4, 4, 6, 6)], [[[12, 0], [20, 5], [12, 10]]]]}},
+]
+
+
+@pytest.fixture(scope='module')
+def ningbo():
+    with open(os.path.join(ROOT, 'data', BOUNDARY_JSON), 'r', encoding='utf-8') as f:
+        return json.load(f)['features']
+
+
+def test_synthetic_districts():
+    districts = [prepare_district(f) for f in SYNTHETIC]
+    rng = np.random.default_rng(0)
+    lats, lons = rng.uniform(-2, 12, 2000), rng.uniform(-2, 22, 2000)
+    expected = brute_force(lats, lons, SYNTHETIC)
+    assert set(expected) == {-1, 0, 1}
+    np.testing.assert_array_equal(assign_districts(lats, lons, districts), expected)
+    # Points in the hole belong to the hole's own district, or to none
+    assert list(assign_districts([5, 3.5], [5, 3.5], districts)) == [1, -1]
+
+
+@pytest.mark.parametrize('chunk_pairs', [7, 1 << 20])
+def test_ningbo_matches_ray_cast(ningbo, chunk_pairs):
+    districts = [prepare_district(f) for f in ningbo]
+    west = min(d['bbox'][0] for d in districts)
+    south = min(d['bbox'][1] for d in districts)
+    east = max(d['bbox'][2] for d in districts)
+    north = max(d['bbox'][3] for d in districts)
+    rng = np.random.default_rng(1)
+    lats, lons = rng.uniform(south, north, 500), rng.uniform(west, east, 500)
+    expected = brute_force(lats, lons, ningbo)
+    assert (expected >= 0).any() and (expected < 0).any()
+    np.testing.assert_array_equal(assign_districts(lats, lons, districts, chunk_pairs),
+                                  expected)
+
+
+def test_missing_coordinates():
+    districts = [prepare_district(f) for f in SYNTHETIC]
+    result = assign_districts([np.nan, 5.0], [1.0, np.nan], districts)
+    assert list(result) == [-1, -1]
+
+
+def test_add_districts_columns():
+    districts = [prepare_district(f) for f in SYNTHETIC]
+    df = pd.DataFrame({'latitude': [1.0, 5.0, 5.0, 50.0], 'longitude': [1.0, 5.0, 14.0, 50.0]})
+    result = add_districts(df, districts)
+    assert result['adcode'].tolist() == [1, 2, 2, -1]
+    assert result['district'][:3].tolist() == ['Ring', 'Parts', 'Parts']
+    assert pd.isna(result['district'].iloc[3])
+    assert 'adcode' not in df
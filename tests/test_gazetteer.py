@@ -0,0 +1,170 @@
+"""common.gazetteer name normalization, resolution and result cache."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from common import data_access, gazetteer
+from common.gazetteer import Gazetteer, fill_coordinates, name_key, split_location
+
+# name, parent key, level, latitude, longitude, adcode
+PLACES = [
+    ('Fenghua District', '', 'district', 29.66, 121.41, 330213),
+    ('Xikou Town', '', 'town', 29.68, 121.24, 330213),
+    ('Shimen Village', 'xikou', 'village', 29.70, 121.20, 330213),
+    ('Dongqiao Town', '', 'town', 29.80, 121.40, 330212),
+    ('Shimen Village', 'dongqiao', 'village', 29.81, 121.41, 330212),
+    ('Shimenling Village', 'xikou', 'village', 29.72, 121.22, 330213),
+    ('Tengtou Village', 'xikou', 'village', 29.60, 121.30, 330213),
+]
+COLUMNS = ['name', 'parent', 'level', 'latitude', 'longitude', 'adcode']
+
+
+def entries(places=PLACES):
+    df = pd.DataFrame(places, columns=COLUMNS).astype({'latitude': float, 'longitude': float,
+                                                       'adcode': np.int64})
+    df.insert(1, 'key', [name_key(name) for name in df['name']])
+    return df
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path):
+    """A fresh on-disk cache per test"""
+    previous = data_access.cache_dir()
+    data_access.set_cache_dir(str(tmp_path))
+    yield tmp_path
+    data_access.set_cache_dir(previous)
+
+
+@pytest.fixture
+def places():
+    return Gazetteer(entries(), version='test')
+
+
+@pytest.mark.parametrize('name, key', [
+    ('Xikou Town', 'xikou'),
+    ('  XIKOU   town ', 'xikou'),
+    ('Ｘｉｋｏｕ Ｔｏｗｎ', 'xikou'),
+    ('Xi-kou (Town)', 'xikou'),
+    ('Town', 'town'),
+    ('溪口镇', '溪口'),
+    ('东村', '东村'),
+    ('Jiangbei District', 'jiangbei'),
+])
+def test_name_key(name, key):
+    assert name_key(name) == key
+
+
+def test_split_location():
+    assert split_location('Shimen Village,Xikou Town') == ['shimen', 'xikou']
+    assert split_location('石门村，溪口镇；奉化区') == ['石门', '溪口', '奉化']
+    assert split_location('Shimen Village, ,Xikou Town;') == ['shimen', 'xikou']
+    assert split_location(np.nan) == []
+
+
+def resolved(places, text):
+    match = places.resolve(text)
+    return None if match is None else (places.entries['name'][match[0]],
+                                       places.parents[match[0]], match[2])
+
+
+def test_exact(places):
+    assert resolved(places, 'Shimen Village,Xikou Town') == ('Shimen Village', 'xikou', 'exact')
+    assert places.resolve('Xikou Town')[1] == 1.0
+
+
+def test_broader_part_picks_among_duplicates(places):
+    assert resolved(places, 'Shimen Village,Dongqiao Town') == \
+        ('Shimen Village', 'dongqiao', 'exact')
+    # A district agrees with the places inside it
+    assert resolved(places, 'Shimen Village,Fenghua District') == \
+        ('Shimen Village', 'xikou', 'exact')
+
+
+def test_prefix(places):
+    assert resolved(places, 'Shimenl') == ('Shimenling Village', 'xikou', 'prefix')
+    # Shorter prefixes are not trusted
+    assert places.candidates('sh')[2] != 'prefix'
+
+
+def test_fuzzy(places):
+    assert resolved(places, 'Tengtuo Village') == ('Tengtou Village', 'xikou', 'fuzzy')
+    assert resolved(places, 'Tengtuo Village,Xikou Town') == \
+        ('Tengtou Village', 'xikou', 'fuzzy')
+
+
+def test_parent(places):
+    assert resolved(places, 'Baisha Village,Xikou Town') == ('Xikou Town', '', 'parent')
+    assert places.resolve('Baisha Village,Xikou Town')[1] < 1.0
+
+
+def test_disagreeing_parent_rejects_a_weak_match(places):
+    # Just similar enough on its own...
+    assert resolved(places, 'Tegntou Village') == ('Tengtou Village', 'xikou', 'fuzzy')
+    # ...but not under another town, which is used instead
+    assert resolved(places, 'Tegntou Village,Dongqiao Town') == ('Dongqiao Town', '', 'parent')
+    assert places.resolve('Tegntou Village,Nowhere Town') is None
+
+
+def test_unknown(places):
+    assert places.resolve('Nowhere') is None
+    assert places.resolve('') is None
+
+
+def test_geocode_columns(places):
+    result = places.geocode(['Shimen Village,Dongqiao Town', None, 'Nowhere'])
+    assert list(result.columns) == ['latitude', 'longitude', 'matched', 'level', 'score',
+                                    'method']
+    assert result['latitude'].tolist()[0] == 29.81
+    assert result['matched'][0] == 'Shimen Village'
+    assert result['method'][0] == 'exact'
+    assert result[['latitude', 'longitude', 'matched', 'method']][1:].isna().all().all()
+    assert result['score'][1:].tolist() == [0.0, 0.0]
+
+
+def test_geocode_cache(places, cache_dir, monkeypatch):
+    first = places.geocode(['Shimen Village,Xikou Town', 'Nowhere'])
+    assert os.listdir(cache_dir) == ['geocode-test.pkl']
+
+    # Cached strings are not resolved again, new ones are and join the cache
+    calls = []
+    resolve = Gazetteer.resolve
+    monkeypatch.setattr(Gazetteer, 'resolve',
+                        lambda self, text: calls.append(text) or resolve(self, text))
+    again = Gazetteer(entries(), version='test').geocode(['Nowhere', 'Shimen Village,Xikou Town',
+                                                         'Dongqiao Town'])
+    assert calls == ['Dongqiao Town']
+    pd.testing.assert_frame_equal(again.iloc[[1, 0]].reset_index(drop=True), first)
+    assert gazetteer._load_results('test').keys() == {
+        'Shimen Village,Xikou Town', 'Nowhere', 'Dongqiao Town'}
+
+    # Another version does not see these results, and cache=False writes nothing
+    calls.clear()
+    Gazetteer(entries(), version='other').geocode(['Dongqiao Town'], cache=False)
+    assert calls == ['Dongqiao Town']
+    assert os.listdir(cache_dir) == ['geocode-test.pkl']
+
+
+def test_fill_coordinates(places):
+    df = pd.DataFrame({'location': ['Shimen Village,Xikou Town', 'Tengtou Village', 'Nowhere'],
+                       'latitude': [np.nan, 30.0, np.nan], 'longitude': [np.nan, 121.0, np.nan]})
+    result = fill_coordinates(df, places)
+    assert result['latitude'].tolist()[:2] == [29.70, 30.0]
+    assert np.isnan(result['latitude'][2])
+    assert result['geocode_method'][0] == 'exact'
+    assert result['geocode_method'][1:].isna().all()
+    assert df['latitude'].isna().sum() == 2
+
+
+def test_fill_coordinates_keeps_an_empty_gazetteer(monkeypatch):
+    def fail():
+        raise AssertionError('the default gazetteer was loaded')
+
+    monkeypatch.setattr(gazetteer, 'load_gazetteer', fail)
+    empty = Gazetteer(entries([]), version='empty')
+    df = pd.DataFrame({'location': ['Shimen Village'], 'latitude': [np.nan],
+                       'longitude': [np.nan]})
+    result = fill_coordinates(df, empty)
+    assert result['latitude'].isna().all()
+    assert result['geocode_method'].isna().all()
@@ -0,0 +1,101 @@
+"""common.query.QueryEngine against a plain pandas filter."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from common.categories import CATEGORIES
+from common.query import QueryEngine
+from synthetic import ADMIN_LEVELS
+
+
+@pytest.fixture(scope='module')
+def table(impact_table):
+    # Every category but the last, so selecting that one matches nothing
+    df = impact_table(2000, max_days=6, start_spread=12,
+                      category_weights={name: 1 for name in CATEGORIES[:-1]}, max_categories=2)
+    rng = np.random.default_rng(0)
+    # Rows the map cannot place, and rows without a level
+    df.loc[rng.choice(len(df), 20, replace=False), ['latitude', 'longitude']] = np.nan
+    df.loc[rng.choice(len(df), 20, replace=False), 'admin_level'] = None
+    return df
+
+
+def brute_force(df, categories=(), admin_levels=(), start=None, end=None, bbox=None):
+    keep = pd.Series(True, index=df.index)
+    if categories:
+        listed = df['categories'].str.split(',').apply(lambda names: {n.strip() for n in names})
+        keep &= listed.apply(lambda names: bool(names & set(categories)))
+    if admin_levels:
+        keep &= df['admin_level'].isin(admin_levels)
+    if start is not None:
+        keep &= df['end_date'] >= pd.Timestamp(start)
+    if end is not None:
+        keep &= df['start_date'] <= pd.Timestamp(end)
+    if bbox is not None:
+        west, south, east, north = bbox
+        keep &= df['longitude'].between(west, east) & df['latitude'].between(south, north)
+    return np.flatnonzero(keep.to_numpy())
+
+
+def random_query(rng):
+    query = {}
+    if rng.random() < 0.5:
+        query['categories'] = list(rng.choice(CATEGORIES, rng.integers(1, 4), replace=False))
+    if rng.random() < 0.3:
+        query['admin_levels'] = list(rng.choice(list(ADMIN_LEVELS) + ['county'], rng.integers(1, 3),
+                                                replace=False))
+    day = np.datetime64('2023-07-26') + int(rng.integers(0, 20))
+    if rng.random() < 0.5:
+        query['start'] = str(day)
+    if rng.random() < 0.5:
+        query['end'] = str(day + int(rng.integers(0, 5)))
+    if rng.random() < 0.5:
+        west, south = rng.uniform(120.8, 122.3), rng.uniform(28.7, 30.4)
+        query['bbox'] = (west, south, west + rng.uniform(0, 0.8), south + rng.uniform(0, 0.8))
+    return query
+
+
+@pytest.fixture(scope='module')
+def engine(table):
+    return QueryEngine(table)
+
+
+def test_random_queries_match_brute_force(table, engine):
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        query = random_query(rng)
+        np.testing.assert_array_equal(engine.select(**query), brute_force(table, **query),
+                                      err_msg=repr(query))
+
+
+@pytest.mark.parametrize('query', [
+    {},
+    {'categories': ['Mineral Resources']},
+    {'admin_levels': ['county']},
+    {'start': '2023-09-01'},
+    {'end': '2023-07-01'},
+    {'start': '2023-08-01', 'end': '2023-08-01'},
+    {'bbox': (121.0, 29.0, 121.0, 29.0)},
+    {'bbox': (0.0, 0.0, 1.0, 1.0)},
+])
+def test_edge_queries(table, engine, query):
+    np.testing.assert_array_equal(engine.select(**query), brute_force(table, **query))
+
+
+def test_day_numbers_and_dates_agree(engine):
+    days = int(np.datetime64('2023-08-01', 'D').astype(np.int64))
+    np.testing.assert_array_equal(engine.select(start=days, end=days + 1),
+                                  engine.select(start='2023-08-01', end='2023-08-02'))
+
+
+def test_unknown_category(engine):
+    with pytest.raises(ValueError):
+        engine.select(categories=['Weather'])
+
+
+def test_frame_is_a_copy(table, engine):
+    rows = engine.select(categories=['Population'])
+    frame = engine.frame(rows)
+    frame['latitude'] = 0.0
+    assert len(frame) == len(rows)
+    assert (engine.df['latitude'].iloc[rows] != 0.0).any()
@@ -0,0 +1,141 @@
+"""common.server against a MapServer on a free localhost port."""
+import gzip
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pandas as pd
+import pytest
+
+from common.server import GZIP_MIN_BYTES, FeatureIndex, make_server
+
+
+def features_of(df):
+    return [{'type': 'Feature',
+             'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+             'properties': {'row': i}}
+            for i, (lat, lon) in enumerate(zip(df['latitude'], df['longitude']))]
+
+
+@pytest.fixture(scope='module')
+def table(impact_table):
+    return impact_table(200, max_days=5)
+
+
+@pytest.fixture(scope='module')
+def server(table):
+    server = make_server(FeatureIndex(table, features_of(table), 'v1'), page='<html></html>',
+                         port=0, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get(server, path, headers=None):
+    """(status, headers, body) of a GET request; HTTP errors are returned too"""
+    request = urllib.request.Request(server.url + path.lstrip('/'), headers=headers or {})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def rows_of(body):
+    return sorted(f['properties']['row'] for f in json.loads(body)['features'])
+
+
+def test_meta_and_page(server, table):
+    status, headers, body = get(server, '/api/meta')
+    assert status == 200
+    meta = json.loads(body)
+    assert meta['rows'] == len(table)
+    assert meta['version'] == 'v1'
+    status, headers, body = get(server, '/')
+    assert status == 200
+    assert headers['Content-Type'].startswith('text/html')
+    assert body == b'<html></html>'
+
+
+def test_features_filters(server, table):
+    query = '/api/features?start=2023-08-01&end=2023-08-02&categories=Buildings,Population' \
+            '&bbox=121.0,29.0,122.0,30.0'
+    status, headers, body = get(server, query)
+    assert status == 200
+    assert headers['Content-Type'] == 'application/geo+json'
+    start, end = pd.Timestamp('2023-08-01'), pd.Timestamp('2023-08-02')
+    expected = table.index[
+        (table['start_date'] <= end) & (table['end_date'] >= start)
+        & table['categories'].str.contains('Buildings|Population')
+        & table['longitude'].between(121.0, 122.0) & table['latitude'].between(29.0, 30.0)]
+    assert 0 < len(expected) < len(table)
+    assert rows_of(body) == expected.tolist()
+
+
+def test_unfiltered_returns_every_feature(server, table):
+    status, headers, body = get(server, '/api/features')
+    assert status == 200
+    assert rows_of(body) == list(range(len(table)))
+
+
+def test_etag_revalidation(server):
+    status, headers, body = get(server, '/api/features?start=2023-08-01')
+    etag = headers['ETag']
+    assert status == 200 and etag
+    assert headers['Cache-Control'] == 'no-cache'
+    status, headers, body = get(server, '/api/features?start=2023-08-01',
+                                {'If-None-Match': etag})
+    assert status == 304
+    assert headers['ETag'] == etag
+    assert body == b''
+    # Another query is another resource
+    status, headers, body = get(server, '/api/features?start=2023-08-02',
+                                {'If-None-Match': etag})
+    assert status == 200
+    assert headers['ETag'] != etag
+
+
+def test_gzip_negotiation(server):
+    status, plain_headers, plain = get(server, '/api/features')
+    assert len(plain) >= GZIP_MIN_BYTES
+    assert 'Content-Encoding' not in plain_headers
+    status, headers, body = get(server, '/api/features', {'Accept-Encoding': 'gzip'})
+    assert status == 200
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(body) == plain
+    # The encodings are different representations with different tags
+    assert headers['ETag'] != plain_headers['ETag']
+    status, headers, body = get(server, '/api/features',
+                                {'Accept-Encoding': 'gzip', 'If-None-Match': headers['ETag']})
+    assert status == 304
+
+
+def test_small_responses_are_not_compressed(server):
+    status, headers, body = get(server, '/api/meta', {'Accept-Encoding': 'gzip'})
+    assert status == 200
+    assert len(body) < GZIP_MIN_BYTES
+    assert 'Content-Encoding' not in headers
+
+
+@pytest.mark.parametrize('query', [
+    'start=2023-13-01',
+    'end=yesterday',
+    'start=2023-08-03&end=2023-08-01',
+    'bbox=121,29,122',
+    'bbox=a,b,c,d',
+    'bbox=122,29,121,30',
+    'categories=Weather',
+])
+def test_bad_queries(server, query):
+    status, headers, body = get(server, '/api/features?' + query)
+    assert status == 400
+    assert 'error' in json.loads(body)
+
+
+def test_unknown_path(server):
+    status, headers, body = get(server, '/api/nothing')
+    assert status == 404
@@ -0,0 +1,51 @@
+"""common.tiles directory export."""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from common.tiles import export_tiles, iter_tiles
+
+
+def points(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'longitude': rng.uniform(120.9, 122.3, rows),
+        'latitude': rng.uniform(28.8, 30.4, rows),
+        'days': rng.integers(1, 20, rows),
+    })
+
+
+def tile_files(directory):
+    found = set()
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.endswith('.pbf'):
+                z, x = os.path.relpath(root, directory).split(os.sep)
+                found.add((int(z), int(x), int(name[:-len('.pbf')])))
+    return found
+
+
+def test_export_writes_every_tile(tmp_path):
+    directory = tmp_path / 'tiles'
+    count = export_tiles(points(500), str(directory), minzoom=6, maxzoom=10, boundary=False)
+    expected = {(z, x, y) for z, x, y, _ in iter_tiles(points(500), minzoom=6, maxzoom=10,
+                                                       boundary=False)}
+    assert count == len(expected)
+    assert tile_files(directory) == expected
+    assert json.loads((directory / 'metadata.json').read_text())['maxzoom'] == 10
+
+
+def test_reexport_leaves_no_stale_tiles(tmp_path):
+    directory = tmp_path / 'tiles'
+    export_tiles(points(500), str(directory), minzoom=6, maxzoom=11, boundary=False)
+    first = tile_files(directory)
+    smaller = points(5, seed=1)
+    export_tiles(smaller, str(directory), minzoom=6, maxzoom=8, boundary=False)
+    expected = {(z, x, y) for z, x, y, _ in iter_tiles(smaller, minzoom=6, maxzoom=8,
+                                                       boundary=False)}
+    assert len(expected) < len(first)
+    assert tile_files(directory) == expected
+    # Nothing is left next to the directory either
+    assert os.listdir(tmp_path) == ['tiles']